@@ -0,0 +1,185 @@
+# ann_index.py
+import os
+
+import numpy as np
+
+# Ruta por defecto del índice persistido y tamaño mínimo de galería para usarlo.
+# Por debajo de ese tamaño la búsqueda exacta es igual de rápida.
+DEFAULT_INDEX_PATH = "gallery_ivf.npz"
+ANN_MIN_GALLERY_SIZE = 5000
+
+
+class IVFIndex:
+    """
+    Índice aproximado IVF (inverted file) sobre descriptores normalizados.
+
+    Un k-means esférico hace de cuantizador grueso: cada plantilla se asigna
+    al centroide más parecido y en la búsqueda solo se comparan las filas de
+    las n_probe listas más cercanas a la consulta. n_probe es el control de
+    recall vs latencia: más listas, más recall y más tiempo.
+
+    El índice no guarda copia de los vectores, solo el número de fila de la
+    galería; los puntajes se calculan sobre la matriz de la FaceGallery.
+    """
+
+    def __init__(self, dim=512, n_lists=None, n_probe=8):
+        self.dim = dim
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.centroids = None
+        self.template_ids = np.zeros(0, dtype=np.int64)
+        self._assign = np.zeros(0, dtype=np.int32)
+        self._lists = []
+
+    def __len__(self):
+        return len(self._assign)
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def train(self, matrix, n_iter=20, sample_size=None, seed=0):
+        """
+        Entrena los centroides con k-means esférico sobre una muestra de la matriz.
+
+        Args:
+            matrix: Descriptores normalizados (N x dim).
+            n_iter: Iteraciones de k-means.
+            sample_size: Filas usadas para entrenar (por defecto 64 por lista).
+            seed: Semilla para reproducibilidad.
+        """
+        n = len(matrix)
+        if n == 0:
+            raise ValueError("No se puede entrenar el índice con una galería vacía")
+        if self.n_lists is None:
+            self.n_lists = int(np.clip(4 * np.sqrt(n), 1, 4096))
+        k = min(self.n_lists, n)
+        self.n_lists = k
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, sample_size or 64 * k)
+        sample = np.asarray(matrix[np.sort(rng.choice(n, sample_size, replace=False))], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, k, replace=False)].copy()
+
+        for _ in range(n_iter):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assign, kind="stable")
+            sorted_assign = assign[order]
+            starts = np.flatnonzero(np.r_[True, sorted_assign[1:] != sorted_assign[:-1]])
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+
+            new_centroids = sample[rng.choice(sample_size, k)].copy()  # Reinicio de listas vacías
+            new_centroids[sorted_assign[starts]] = sums
+            norms = np.linalg.norm(new_centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = new_centroids / norms
+
+        self.centroids = centroids.astype(np.float32)
+        self._assign = np.zeros(0, dtype=np.int32)
+        self.template_ids = np.zeros(0, dtype=np.int64)
+        self._lists = [np.zeros(0, dtype=np.int64) for _ in range(k)]
+
+    def add(self, vectors, template_ids=None):
+        """
+        Inserta filas nuevas. Se numeran a continuación de las ya indexadas,
+        igual que en la galería, así que deben agregarse en el mismo orden.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(vectors) == 0:
+            return
+        if template_ids is None:
+            template_ids = np.full(len(vectors), -1, dtype=np.int64)
+        first_row = len(self._assign)
+        assign = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+        rows = np.arange(first_row, first_row + len(vectors), dtype=np.int64)
+        for lst in np.unique(assign):
+            self._lists[lst] = np.concatenate([self._lists[lst], rows[assign == lst]])
+        self._assign = np.concatenate([self._assign, assign])
+        self.template_ids = np.concatenate([self.template_ids, np.asarray(template_ids, dtype=np.int64)])
+
+    def remove_rows(self, keep):
+        """
+        Quita filas del índice. keep es la máscara de filas que quedan en la
+        galería; las restantes se renumeran igual que en ella.
+        """
+        self._assign = self._assign[keep]
+        self.template_ids = self.template_ids[keep]
+        self._rebuild_lists()
+
+    def _rebuild_lists(self):
+        order = np.argsort(self._assign, kind="stable")
+        bounds = np.searchsorted(self._assign[order], np.arange(self.n_lists + 1))
+        self._lists = [order[bounds[i]:bounds[i + 1]].astype(np.int64) for i in range(self.n_lists)]
+
+    def candidates(self, query, n_probe=None):
+        """Filas de la galería en las n_probe listas más cercanas a la consulta."""
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        list_scores = self.centroids @ np.asarray(query, dtype=np.float32).reshape(self.dim)
+        if n_probe < self.n_lists:
+            probe = np.argpartition(-list_scores, n_probe - 1)[:n_probe]
+        else:
+            probe = np.arange(self.n_lists)
+        return np.concatenate([self._lists[i] for i in probe])
+
+    def save(self, path=DEFAULT_INDEX_PATH):
+        """Guarda el índice en un archivo .npz (escritura atómica)."""
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, assign=self._assign,
+                 template_ids=self.template_ids, n_probe=self.n_probe)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=DEFAULT_INDEX_PATH):
+        """Carga un índice guardado con save()."""
+        with np.load(path) as data:
+            centroids = data["centroids"]
+            index = cls(dim=centroids.shape[1], n_lists=len(centroids), n_probe=int(data["n_probe"]))
+            index.centroids = centroids
+            index._assign = data["assign"].astype(np.int32)
+            index.template_ids = data["template_ids"].astype(np.int64)
+        index._rebuild_lists()
+        return index
+
+
+def load_or_build_index(gallery, path=DEFAULT_INDEX_PATH, n_probe=8):
+    """
+    Carga el índice del disco si corresponde a la galería; si no, lo construye.
+
+    Si el índice guardado cubre un prefijo de la galería (mismos ids de
+    plantilla en el mismo orden), solo se insertan las filas nuevas.
+    """
+    index = None
+    if os.path.exists(path):
+        try:
+            index = IVFIndex.load(path)
+        except Exception as e:
+            print(f"[ERROR] No se pudo cargar el índice ANN: {e}")
+        if index is not None:
+            n = len(index)
+            if n > len(gallery) or not np.array_equal(index.template_ids, gallery.template_ids[:n]):
+                print("[INFO] Índice ANN desactualizado, se reconstruye.")
+                index = None
+
+    if index is None:
+        print(f"[INFO] Construyendo índice ANN para {len(gallery)} plantillas...")
+        index = IVFIndex(dim=gallery.dim, n_probe=n_probe)
+        index.train(gallery.matrix)
+
+    if len(index) < len(gallery):
+        start = len(index)
+        index.add(gallery.matrix[start:], gallery.template_ids[start:])
+        index.save(path)
+    index.n_probe = n_probe
+    return index
+
+
+def maybe_attach_index(gallery, path=DEFAULT_INDEX_PATH, min_size=ANN_MIN_GALLERY_SIZE, n_probe=8):
+    """
+    Adjunta un índice ANN a la galería solo si es lo bastante grande.
+    Devuelve el índice o None si se sigue usando búsqueda exacta.
+    """
+    if len(gallery) < min_size:
+        return None
+    index = load_or_build_index(gallery, path=path, n_probe=n_probe)
+    gallery.attach_index(index, path=path)
+    return index
@@ -1,10 +1,19 @@
 # app.py
 import cv2
 import numpy as np
-from PIL import Image, ImageTk
 import tkinter as tk
-from face_recognition import get_face_descriptor, detect_faces
-from database import connect_db, load_faces_from_db
+from face_recognition import get_face_descriptors, get_detector, warm_up, mark_startup, startup_marks
+from face_quality import assess_face, landmarks_for
+from database import connect_db, release_db, load_faces_from_db
+from ann_index import maybe_attach_index
+from gallery_compact import GALLERY_STORAGE, maybe_compact_gallery
+from gallery_listener import GalleryListener
+from tracker import FaceTracker
+from scheduler import AdaptiveScheduler
+from capture import FrameCapture
+from preview import PreviewRenderer
+from event_sink import RecognitionEventSink
+import metrics
 import time
 import threading
 
@@ -14,32 +23,56 @@ class FaceRecognitionApp:
         self.registration_mode = registration_mode
         self.root.title("Reconocimiento Facial")
         self.root.geometry("800x600")
+        # Cerrar la ventana pasa por quit(): vacía la cola de eventos y detiene los hilos
+        self.root.protocol("WM_DELETE_WINDOW", self.quit)
 
-        # Conexión a la DB y normalización una sola vez
+        # Conexión a la DB; la galería ya viene normalizada en una matriz contigua
         self.conn, self.c = connect_db()
-        self.face_db = [(name, self.normalize(desc)) for name, desc in load_faces_from_db(self.c)]
+        self.face_db = load_faces_from_db(self.c)
+        if GALLERY_STORAGE:
+            # Galería consolidada por persona en float16/int8, con reescritura en float32
+            self.face_db = maybe_compact_gallery(self.face_db)
+        else:
+            # Índice ANN solo para galerías grandes; si no, búsqueda exacta
+            maybe_attach_index(self.face_db)
+        # Altas, bajas y cambios de nombre se aplican en vivo (LISTEN/NOTIFY);
+        # la galería compacta es de solo lectura y se reconstruye al reiniciar
+        self.gallery_listener = None
+        if not GALLERY_STORAGE:
+            self.gallery_listener = GalleryListener(self.face_db).start()
+        # Registro de asistencia en segundo plano (eventos_reconocimiento)
+        self.event_sink = RecognitionEventSink()
+        # Volcado periódico de métricas si FACE_METRICS=1
+        self.metrics_exporter = metrics.start_exporter_from_env()
 
-        # Cámara
-        self.cap = cv2.VideoCapture(0)
-        if not self.cap.isOpened():
+        # Cámara en su propio hilo; interfaz y procesamiento leen el último cuadro sin copiarlo
+        self.capture = FrameCapture(0)
+        if not self.capture.isOpened():
             print("Error: No se pudo abrir la cámara")
+        self.capture.start()
+        self.last_drawn_seq = 0
 
         # Interfaz
         self.canvas = tk.Canvas(self.root, width=640, height=480)
         self.canvas.pack()
+        # Un solo ítem y un solo PhotoImage en el Canvas, actualizados con paste()
+        self.preview = PreviewRenderer(self.canvas)
         self.name_label = tk.Label(self.root, text="Nombre: No reconocido", font=("Arial", 16))
         self.name_label.pack(pady=10)
 
         # Variables compartidas
         self.lock = threading.Lock()
-        self.frame = None
-        self.processing_frame = None
-        self.detected_face = None
-        self.recognized_name = None
-        self.recognition_distance = None
+        # Lista de (caja, nombre, distancia) por cada rostro del cuadro
+        self.detections = []
 
         self.running = True
-        self.last_recognition_time = 0
+        # Seguimiento de rostros: el descriptor solo se recalcula para tracks
+        # nuevos, con baja confianza o al vencer la re-verificación
+        self.tracker = FaceTracker()
+        # Cada cuánto detectar y re-verificar se decide según la escena y la
+        # carga medida (FACE_TARGET_FPS, FACE_TARGET_LATENCY, FACE_CPU_BUDGET)
+        self.scheduler = AdaptiveScheduler(self.tracker)
+        self._retinaface_busy = 0.0  # Último total leído de retinaface_busy_seconds()
         self.processing_face = False  # Variable para controlar si está procesando reconocimiento
 
         # Hilos
@@ -51,125 +84,180 @@ class FaceRecognitionApp:
         norm = np.linalg.norm(v)
         return v / norm if norm > 0 else v
 
+    def _pad_box(self, box, frame_shape, padding=10):
+        x, y, w, h = box
+        x = max(0, x - padding)
+        y = max(0, y - padding)
+        w = min(frame_shape[1] - x, w + 2 * padding)
+        h = min(frame_shape[0] - y, h + 2 * padding)
+        return x, y, w, h
+
     def processing_loop(self):
-        frame_count = 0
+        last_seq = 0
         while self.running:
-            with self.lock:
-                frame = self.processing_frame.copy() if self.processing_frame is not None else None
-
-            if frame is None:
-                time.sleep(0.01)
+            ref = self.capture.acquire(after_seq=last_seq, timeout=0.1)
+            if ref is None:
                 continue
+            if metrics.enabled():
+                # Cuadros capturados que se perdieron mientras se procesaba el anterior
+                for seq in range(last_seq + 1, ref.seq):
+                    metrics.drop_frame(seq, "procesamiento_ocupado")
+            last_seq = ref.seq
+            metrics.begin_frame(ref.seq, ref.timestamp)
+            drop_reason = None
+            try:
+                drop_reason = self.process_frame(ref.frame, ref.timestamp)
+            finally:
+                self.capture.release(ref)
+                metrics.end_frame(ref.seq, drop_reason)
 
-            frame_count += 1
+    def process_frame(self, frame, current_time):
+        """
+        Detecta, sigue y reconoce los rostros de un cuadro (vista de solo lectura).
 
-            if frame_count % 6 == 0:
-                faces = detect_faces(frame)
+        Returns:
+            None si se procesó completo, o el motivo por el que se omitió la
+            detección (para la traza de métricas).
+        """
+        if self.tracker.use_optical_flow:
+            self.tracker.propagate(frame)
 
-                if faces:
-                    x, y, w, h = faces[0]
+        self.scheduler.observe_frame(frame)
+        if self.scheduler.should_detect(current_time):
+            detect_start = time.perf_counter()
+            detection = get_detector().detect(frame)
+            detect_seconds = time.perf_counter() - detect_start
+            boxes = [self._pad_box(face, frame.shape) for face in detection.boxes]
+            tracks = self.tracker.update(boxes, current_time)
 
-                    padding = 10
-                    x = max(0, x - padding)
-                    y = max(0, y - padding)
-                    w = min(frame.shape[1] - x, w + 2 * padding)
-                    h = min(frame.shape[0] - y, h + 2 * padding)
+            # Solo los recortes con calidad suficiente gastan una inferencia;
+            # los demás cuentan como intento y se reintentan con el mismo
+            # espaciado que los desconocidos
+            pending, crops = [], []
+            for i, track in enumerate(tracks):
+                if not self.tracker.needs_embedding(track, current_time):
+                    continue
+                x, y, w, h = track.box
+                crop = frame[y:y+h, x:x+w]
+                quality = assess_face(crop, landmarks_for(detection, i))
+                if quality.reason is not None:
+                    metrics.inc(f"calidad_descartados_{quality.reason}")
+                    self.tracker.defer(track, current_time)
+                    continue
+                pending.append(track)
+                crops.append(crop)
 
-                    current_time = time.time()
-                    if current_time - self.last_recognition_time > 1.5:
-                        self.processing_face = True
+            if pending:
+                self.processing_face = True
 
-                        face_img = frame[y:y+h, x:x+w]
-                        descriptor = get_face_descriptor(face_img)
-                        descriptor = self.normalize(descriptor)
-                        recognized_name, min_distance = self.recognize_face_with_distance(descriptor)
-
-                        with self.lock:
-                            self.detected_face = (x, y, w, h)
-                            self.recognized_name = recognized_name
-                            self.recognition_distance = min_distance
-
-                        self.last_recognition_time = current_time
-                        self.processing_face = False
+                # Todos los rostros pendientes en una sola inferencia por lote
+                embed_start = time.perf_counter()
+                batch = get_face_descriptors(crops)
+                self.scheduler.record_embedding(time.perf_counter() - embed_start, len(crops), current_time)
+                for i, track in enumerate(pending):
+                    match = None
+                    if batch.valid[i]:
+                        match = self.recognize_face(batch.embeddings[i])
                     else:
-                        with self.lock:
-                            self.detected_face = (x, y, w, h)
-                else:
-                    with self.lock:
-                        self.detected_face = None
-                        self.recognized_name = None
-                        self.recognition_distance = None
-                        self.processing_face = False
+                        print(f"[Error processing_loop] track {track.track_id}: {batch.errors.get(i)}")
+                    if match is None:
+                        self.tracker.set_identity(track, None, None, current_time)
+                        continue
+                    self.tracker.set_identity(track, match.name, match.distance, current_time, match.persona_id)
+                    self.event_sink.record(match.persona_id, match.score, crops[i], current_time)
+                    mark_startup("primer_reconocimiento")
 
-            time.sleep(0.01)
+                self.processing_face = False
 
-    def recognize_face_with_distance(self, descriptor):
-        recognized_name = None
-        min_distance = float('inf')
+            waiting = self.scheduler.pending_tracks(tracks, current_time)
+            busy = get_detector().retinaface_busy_seconds()
+            self.scheduler.record_background(busy - self._retinaface_busy, current_time)
+            self._retinaface_busy = busy
+            self.scheduler.record_detection(detect_seconds, len(tracks), waiting, current_time)
+            with self.lock:
+                self.detections = [(t.box, t.name, t.distance) for t in tracks]
+            return None
 
-        for full_name, saved_descriptor in self.face_db:
-            distance = np.linalg.norm(saved_descriptor - descriptor)
-            if distance < min_distance:
-                min_distance = distance
-                recognized_name = full_name
+        if self.tracker.use_optical_flow:
+            with self.lock:
+                self.detections = [(t.box, t.name, t.distance) for t in self.tracker.tracks if t.misses == 0]
+        return "intervalo_deteccion"
 
-        if min_distance < 0.75:  # Umbral de reconocimiento
-            return recognized_name, min_distance
-        else:
+    def recognize_face(self, descriptor):
+        # Un solo producto matricial contra toda la galería; varias plantillas
+        # de la misma persona se combinan tomando el máximo puntaje
+        with metrics.timed("matching"):
+            return self.face_db.best_match(descriptor, threshold=0.75)  # Umbral de reconocimiento
+
+    def recognize_face_with_distance(self, descriptor):
+        match = self.recognize_face(descriptor)
+        if match is None:
             return None, None
+        return match.name, match.distance
+
+    def short_name(self, full_name):
+        parts = full_name.strip().split()
+        return f"{parts[0]} {parts[1]}" if len(parts) > 1 else parts[0]
 
     def update_frame(self):
-        ret, frame = self.cap.read()
-        if not ret:
+        # Solo se redibuja cuando hay un cuadro nuevo
+        ref = self.capture.acquire(after_seq=self.last_drawn_seq, timeout=0)
+        if ref is None:
             self.root.after(10, self.update_frame)
             return
 
-        frame = cv2.flip(frame, 1)
+        render_start = time.perf_counter()
+        try:
+            self.last_drawn_seq = ref.seq
+            # La conversión a RGB escribe en un buffer propio; el cuadro compartido no se toca
+            frame = self.preview.prepare(ref.frame)
+        finally:
+            self.capture.release(ref)
 
         with self.lock:
-            self.frame = frame.copy()
-            self.processing_frame = frame.copy()
-            detected_face = self.detected_face
-            recognized_name = self.recognized_name
-            recognition_distance = self.recognition_distance
-
-        if detected_face:
-            x, y, w, h = detected_face
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+            detections = self.detections
+
+        # Colores en RGB: el cuadro ya está convertido
+        font_scale = 0.7 * self.preview.scale
+        thickness = max(1, int(round(2 * self.preview.scale)))
+        for box, recognized_name, recognition_distance in detections:
+            x, y, w, h = self.preview.scale_box(box)
+            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), thickness)
             if recognized_name and recognition_distance is not None:
-                parts = recognized_name.strip().split()
-                name = f"{parts[0]} {parts[1]}" if len(parts) > 1 else parts[0]
-                text = f"{name} ({recognition_distance:.2f})"
+                text = f"{self.short_name(recognized_name)} ({recognition_distance:.2f})"
                 cv2.putText(frame, text, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX,
-                            0.7, (0, 255, 0), 2)
+                            font_scale, (0, 255, 0), thickness)
             else:
                 cv2.putText(frame, "No reconocido", (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX,
-                            0.7, (0, 0, 255), 2)
-
-        if recognized_name:
-            parts = recognized_name.strip().split()
-            name = f"{parts[0]} {parts[1]}" if len(parts) > 1 else parts[0]
-            self.name_label.config(text=f"Nombre: {name}")
-        else:
-            self.name_label.config(text="Nombre: No reconocido")
+                            font_scale, (255, 0, 0), thickness)
 
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(frame_rgb)
-        imgtk = ImageTk.PhotoImage(image=img)
+        recognized = [name for _, name, _ in detections if name]
+        label = "Nombre: " + (", ".join(self.short_name(n) for n in recognized) if recognized else "No reconocido")
+        # Cambiar el texto de un Label fuerza un relayout: solo si cambió
+        if label != self.name_label.cget("text"):
+            self.name_label.config(text=label)
 
-        self.canvas.imgtk = imgtk
-        self.canvas.create_image(0, 0, anchor=tk.NW, image=imgtk)
+        self.preview.show()
+        metrics.observe("render", time.perf_counter() - render_start)
         self.root.after(15, self.update_frame)
 
     def quit(self):
         self.running = False
-        if self.cap.isOpened():
-            self.cap.release()
-        self.conn.close()
+        self.capture.stop()
+        print(f"[INFO] Detector: {get_detector().stats()}")
+        print(f"[INFO] Planificador: {self.scheduler.report()}")
+        marks = {event: round(seconds, 3) for event, seconds in startup_marks().items()}
+        print(f"[INFO] Arranque: {marks}")
+        self.event_sink.close()
+        if self.gallery_listener is not None:
+            self.gallery_listener.stop()
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+        release_db(self.conn)
         self.root.quit()
 
 if __name__ == "__main__":
+    warm_up()
     root = tk.Tk()
     app = FaceRecognitionApp(root)
-    root.protocol("WM_DELETE_WINDOW", app.quit)
     root.mainloop()
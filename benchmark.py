@@ -0,0 +1,299 @@
+# benchmark.py
+"""
+Benchmarks reproducibles de cada etapa del reconocimiento.
+
+Uso:
+    python benchmark.py                                  # entradas sintéticas, FakeEmbedder
+    python benchmark.py --frames grabacion.avi --embedder arcface --retinaface
+    python benchmark.py --save-baseline                  # guarda benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json --tolerance 0.2
+
+Etapas:
+    detect_haar / detect_haar_movimiento / detect_retinaface: detección en
+        cuadros grabados (video o directorio de imágenes) o sintéticos.
+    embed_1 / embed_lote: descriptores de un recorte y por lotes.
+    match_<n> / match_lote_<n> / match_ivf_<n>: búsqueda del mejor candidato
+        (lo que hace recognize_face_with_distance) en galerías sintéticas.
+    db_decode_<n>: decodificación BYTEA -> FaceGallery como en
+        load_faces_from_db, sin base de datos.
+    db_load: load_faces_from_db contra PostgreSQL local (con --db).
+
+El resultado se escribe en JSON. Con --baseline se compara la mediana de
+cada etapa y el proceso termina con código 1 si alguna empeoró más que
+--tolerance.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from gallery import FaceGallery
+
+DEFAULT_GALLERY_SIZES = (1000, 10000, 100000)
+DEFAULT_BASELINE_PATH = "benchmark_baseline.json"
+TEMPLATES_PER_PERSON = 3
+
+
+def measure(fn, repeat=20, warmup=2, items=1):
+    """
+    Ejecuta fn repeat veces (después de warmup llamadas sin medir).
+
+    Returns:
+        Dict con mediana, p90 y mínimo en milisegundos, y el costo por
+        elemento en microsegundos si cada llamada procesa items elementos.
+    """
+    # Los print de progreso de las funciones medidas no van a la consola
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            fn()
+        times = np.empty(repeat)
+        for i in range(repeat):
+            start = time.perf_counter()
+            fn()
+            times[i] = time.perf_counter() - start
+    median = float(np.median(times))
+    return {
+        "mediana_ms": round(median * 1000, 4),
+        "p90_ms": round(float(np.percentile(times, 90)) * 1000, 4),
+        "min_ms": round(float(times.min()) * 1000, 4),
+        "repeticiones": repeat,
+        "elementos": items,
+        "por_elemento_us": round(median / items * 1e6, 3),
+    }
+
+
+def load_frames(path=None, count=30, size=(640, 480), seed=0):
+    """
+    Cuadros de entrada: los primeros count de un video o de un directorio
+    de imágenes, o cuadros sintéticos reproducibles si no hay grabación.
+    """
+    if path is None:
+        rng = np.random.default_rng(seed)
+        width, height = size
+        background = cv2.resize(rng.integers(0, 256, (12, 16, 3), dtype=np.uint8), size)
+        frames = []
+        for i in range(count):
+            frame = background.copy()
+            # Un bloque que se desplaza para que haya movimiento entre cuadros
+            x = (40 + 8 * i) % (width - 160)
+            frame[160:320, x:x + 160] = cv2.resize(rng.integers(0, 256, (6, 6, 3), dtype=np.uint8), (160, 160))
+            frames.append(frame)
+        return frames
+
+    if os.path.isdir(path):
+        names = sorted(n for n in os.listdir(path) if n.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")))
+        frames = [cv2.imread(os.path.join(path, n)) for n in names[:count]]
+        return [f for f in frames if f is not None]
+
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < count:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def synthetic_gallery(size, dim=512, seed=0):
+    """Galería de size plantillas aleatorias normalizadas, TEMPLATES_PER_PERSON por persona."""
+    rng = np.random.default_rng(seed)
+    matrix = rng.standard_normal((size, dim), dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    persona_ids = np.arange(size, dtype=np.int64) // TEMPLATES_PER_PERSON
+    names = np.asarray([f"Persona {pid}" for pid in persona_ids], dtype=object)
+    return FaceGallery.from_arrays(matrix, persona_ids, names, np.arange(size, dtype=np.int64))
+
+
+def synthetic_queries(gallery, count=64, noise=0.3, seed=1):
+    """Consultas cercanas a plantillas existentes (con ruido) y normalizadas."""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(gallery), count)
+    queries = gallery.matrix[rows] + noise * rng.standard_normal((count, gallery.matrix.shape[1]), dtype=np.float32) / np.sqrt(gallery.matrix.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def get_embedder(name):
+    """Extractor de descriptores: "fake" (sin modelos) o "arcface"."""
+    from face_recognition import FakeEmbedder, get_face_descriptors, warm_up
+    if name == "fake":
+        return FakeEmbedder()
+    warm_up()
+    return get_face_descriptors
+
+
+def bench_detection(results, frames, retinaface=False, repeat=5):
+    from face_recognition import MixedFaceDetector, detect_faces_still
+
+    n = len(frames)
+    results["detect_haar"] = measure(lambda: [detect_faces_still(f) for f in frames], repeat, 1, n)
+
+    def motion_sequence():
+        detector = MixedFaceDetector()
+        # Cuadros espaciados 1/30 s como en la cámara
+        for i, frame in enumerate(frames):
+            detector.detect(frame, mode="fast", frame_time=i / 30.0)
+    results["detect_haar_movimiento"] = measure(motion_sequence, repeat, 1, n)
+
+    if retinaface:
+        results["detect_retinaface"] = measure(lambda: [detect_faces_still(f, accurate=True) for f in frames], repeat, 1, n)
+
+
+def bench_embedding(results, embed, frames, batch_size=32, repeat=10):
+    crops = [frame[160:320, 240:400] for frame in frames]
+    crops = (crops * (batch_size // len(crops) + 1))[:batch_size]
+    results["embed_1"] = measure(lambda: embed(crops[:1]), repeat, 2, 1)
+    results["embed_lote"] = measure(lambda: embed(crops, batch_size), repeat, 2, len(crops))
+
+
+def bench_matching(results, sizes, repeat=20, threshold=0.75):
+    from ann_index import ANN_MIN_GALLERY_SIZE, IVFIndex
+
+    for size in sizes:
+        gallery = synthetic_gallery(size)
+        queries = synthetic_queries(gallery)
+        results[f"match_{size}"] = measure(
+            lambda: [gallery.best_match(q, threshold=threshold) for q in queries], repeat, 2, len(queries))
+        results[f"match_lote_{size}"] = measure(lambda: gallery.search_batch(queries, k=1), repeat, 2, len(queries))
+
+        if size >= ANN_MIN_GALLERY_SIZE:
+            index = IVFIndex(gallery.matrix.shape[1])
+            start = time.perf_counter()
+            index.train(gallery.matrix)
+            index.add(gallery.matrix, gallery.template_ids)
+            build = time.perf_counter() - start
+            gallery.attach_index(index)
+            results[f"match_ivf_{size}"] = measure(
+                lambda: [gallery.best_match(q, threshold=threshold) for q in queries], repeat, 2, len(queries))
+            results[f"match_ivf_{size}"]["construccion_s"] = round(build, 3)
+
+
+def bench_db_decode(results, sizes, repeat=5):
+    """Decodificación de las columnas BYTEA y armado de la galería, sin servidor."""
+    from database import STORAGE_DTYPES, decode_embeddings
+
+    for size in sizes:
+        gallery = synthetic_gallery(size)
+        binaries = [row.astype(STORAGE_DTYPES["f32"]).tobytes() for row in gallery.matrix]
+        formats = ["f32"] * size
+        arrays = [None] * size
+
+        def load():
+            matrix = decode_embeddings(binaries, formats, arrays)
+            return FaceGallery.from_arrays(matrix, gallery.persona_ids, gallery.names, gallery.template_ids,
+                                           normalized=False)
+        results[f"db_decode_{size}"] = measure(load, repeat, 1, size)
+
+
+def bench_db(results, repeat=5):
+    """load_faces_from_db contra la base de datos configurada en DB_CONFIG."""
+    from database import connect_db, release_db, load_faces_from_db
+
+    conn, c = connect_db()
+    try:
+        size = len(load_faces_from_db(c, snapshot_dir=None))
+        results["db_load"] = measure(lambda: load_faces_from_db(c, snapshot_dir=None), repeat, 1, max(size, 1))
+        results["db_load_snapshot"] = measure(lambda: load_faces_from_db(c), repeat, 1, max(size, 1))
+    finally:
+        release_db(conn)
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compara medianas con la línea base.
+
+    Returns:
+        Lista de (etapa, mediana_base_ms, mediana_ms, cambio) de las etapas
+        que empeoraron más que tolerance (0.2 = 20 %).
+    """
+    regressions = []
+    for name, base in baseline.get("resultados", {}).items():
+        current = results.get(name)
+        if current is None or base["mediana_ms"] <= 0:
+            continue
+        change = current["mediana_ms"] / base["mediana_ms"] - 1.0
+        if change > tolerance:
+            regressions.append((name, base["mediana_ms"], current["mediana_ms"], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de detección, descriptores, búsqueda y carga de la BD")
+    parser.add_argument("--frames", default=None, help="Video o directorio de imágenes grabadas (por defecto, sintéticos)")
+    parser.add_argument("--frame-count", type=int, default=30)
+    parser.add_argument("--embedder", choices=("fake", "arcface"), default="fake")
+    parser.add_argument("--retinaface", action="store_true", help="Incluir RetinaFace (descarga el modelo)")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_GALLERY_SIZES),
+                        help="Tamaños de galería sintética separados por comas")
+    parser.add_argument("--db", action="store_true", help="Medir load_faces_from_db contra PostgreSQL local")
+    parser.add_argument("--stages", default="detect,embed,match,db",
+                        help="Etapas a correr, separadas por comas")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None, help="JSON de una corrida anterior para comparar")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Guardar también en {DEFAULT_BASELINE_PATH}")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    stages = set(args.stages.split(","))
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    frames = load_frames(args.frames, args.frame_count)
+    if not frames:
+        print(f"[ERROR] No se pudieron leer cuadros de {args.frames}")
+        sys.exit(2)
+
+    results = {}
+    if "detect" in stages:
+        bench_detection(results, frames, args.retinaface)
+    if "embed" in stages:
+        bench_embedding(results, get_embedder(args.embedder), frames)
+    if "match" in stages:
+        bench_matching(results, sizes)
+    if "db" in stages:
+        bench_db_decode(results, sizes)
+        if args.db:
+            bench_db(results)
+
+    report = {
+        "entorno": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+            "embedder": args.embedder,
+            "cuadros": args.frames or "sinteticos",
+            "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "resultados": results,
+    }
+    for name, result in results.items():
+        print(f"[INFO] {name:28s} mediana = {result['mediana_ms']:10.3f} ms  "
+              f"({result['por_elemento_us']:.1f} us por elemento)")
+
+    paths = [args.output] + ([DEFAULT_BASELINE_PATH] if args.save_baseline else [])
+    for path in paths:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"[INFO] Resultados en {', '.join(paths)}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after, change in regressions:
+            print(f"[ERROR] Regresión en {name}: {before:.3f} ms -> {after:.3f} ms (+{change:.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"[INFO] Sin regresiones mayores a {args.tolerance:.0%} respecto de {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
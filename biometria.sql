@@ -45,6 +45,57 @@ ALTER COLUMN apellido1 SET NOT NULL,
 ALTER COLUMN apellido2 SET DATA TYPE VARCHAR(25),
 ALTER COLUMN apellido2 SET NOT NULL;
 
+-- Almacenamiento binario de codificaciones: float32/float16 en BYTEA, que se
+-- decodifica directo con numpy.frombuffer. Las filas existentes se pasan con
+-- database.migrate_embeddings_to_binary(c, conn) y quedan con codificacion NULL.
+ALTER TABLE codificaciones_faciales
+ADD COLUMN IF NOT EXISTS codificacion_bin BYTEA,
+ADD COLUMN IF NOT EXISTS formato VARCHAR(8) CHECK (formato IN ('f32', 'f16')),
+ALTER COLUMN codificacion DROP NOT NULL;
+
+ALTER TABLE codificaciones_faciales
+ADD CONSTRAINT codificacion_presente CHECK (codificacion IS NOT NULL OR codificacion_bin IS NOT NULL);
+
 SELECT * from codificaciones_faciales;
 SELECT * FROM personas;
 
+
+-- Aviso de cambios para los procesos que tienen la galería en memoria:
+-- gallery_listener.GalleryListener escucha el canal galeria_cambios y aplica
+-- altas, bajas y cambios de nombre sin recargar toda la galería.
+CREATE OR REPLACE FUNCTION notificar_cambio_galeria() RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'personas' THEN
+        PERFORM pg_notify('galeria_cambios', json_build_object(
+            'tabla', 'personas', 'op', TG_OP, 'id', NEW.id)::text);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('galeria_cambios', json_build_object(
+            'tabla', 'codificaciones_faciales', 'op', TG_OP, 'id', OLD.id, 'persona_id', OLD.persona_id)::text);
+    ELSE
+        PERFORM pg_notify('galeria_cambios', json_build_object(
+            'tabla', 'codificaciones_faciales', 'op', TG_OP, 'id', NEW.id, 'persona_id', NEW.persona_id)::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS galeria_codificaciones ON codificaciones_faciales;
+CREATE TRIGGER galeria_codificaciones
+AFTER INSERT OR DELETE ON codificaciones_faciales
+FOR EACH ROW EXECUTE FUNCTION notificar_cambio_galeria();
+
+DROP TRIGGER IF EXISTS galeria_personas ON personas;
+CREATE TRIGGER galeria_personas
+AFTER UPDATE OF nombre ON personas
+FOR EACH ROW WHEN (OLD.nombre IS DISTINCT FROM NEW.nombre)
+EXECUTE FUNCTION notificar_cambio_galeria();
+
+-- Imágenes ya registradas por bulk_enroll.py. Se escriben en la misma
+-- transacción que las codificaciones: al retomar tras una caída no se vuelve
+-- a registrar ninguna foto que ya quedó guardada.
+CREATE TABLE IF NOT EXISTS registro_masivo (
+    imagen TEXT PRIMARY KEY,
+    persona_id INTEGER REFERENCES personas(id) ON DELETE CASCADE,
+    codificacion_id INTEGER REFERENCES codificaciones_faciales(id) ON DELETE CASCADE,
+    fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,320 @@
+# bulk_enroll.py
+"""
+Registro masivo sin interfaz gráfica.
+
+Uso:
+    python bulk_enroll.py fotos/                 # archivos <cedula>_<nombre>_<apellido1>[_<apellido2>].jpg
+    python bulk_enroll.py alumnos.csv            # columnas cedula,nombre,nombre2,apellido1,apellido2,correo,imagen
+    python bulk_enroll.py fotos/ --workers 4 --batch-size 16 --accurate
+
+La detección y la extracción de descriptores corren en un pool de procesos
+(cada uno con su propio ArcFace). El proceso principal descarta
+casi-duplicados contra la galería, inserta cada lote en una transacción (si
+falla, fila por fila con SAVEPOINT) y anota lo hecho en un archivo de avance
+para poder retomar si se interrumpe; al retomar se reintentan los errores.
+Las fotos registradas quedan además en la tabla registro_masivo, dentro de
+la misma transacción: si el proceso cae entre el commit y el archivo de
+avance, al retomar no se registran de nuevo.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+from psycopg2.extras import execute_values
+
+from duplicate_audit import DUPLICATE_THRESHOLD
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def read_records(source):
+    """Lee los registros a importar desde un directorio de fotos o un CSV."""
+    records = []
+    if os.path.isdir(source):
+        for filename in sorted(os.listdir(source)):
+            stem, ext = os.path.splitext(filename)
+            if ext.lower() not in IMAGE_EXTENSIONS:
+                continue
+            parts = stem.split("_")
+            if len(parts) < 3:
+                print(f"[ERROR] Nombre de archivo sin cedula_nombre_apellido: {filename}")
+                continue
+            records.append({
+                "cedula": parts[0], "nombre": parts[1], "nombre2": "",
+                "apellido1": parts[2], "apellido2": parts[3] if len(parts) > 3 else "",
+                "correo": None, "imagen": os.path.join(source, filename),
+            })
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                image = row["imagen"]
+                records.append({
+                    "cedula": row["cedula"], "nombre": row["nombre"], "nombre2": row.get("nombre2") or "",
+                    "apellido1": row["apellido1"], "apellido2": row.get("apellido2") or "",
+                    "correo": row.get("correo") or None,
+                    "imagen": image if os.path.isabs(image) else os.path.join(base, image),
+                })
+    return records
+
+
+def read_checkpoint(path):
+    """
+    Imágenes ya resueltas en corridas anteriores (registradas o descartadas
+    por duplicado). Las que terminaron en error se vuelven a intentar.
+    """
+    done = set()
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    outcome = json.loads(line)
+                    if outcome["estado"] != "error":
+                        done.add(outcome["imagen"])
+    return done
+
+
+def read_enrolled(c, records):
+    """
+    Imágenes de records que ya están en registro_masivo: guardadas en una
+    corrida que cayó antes de anotarlas en el archivo de avance.
+    """
+    c.execute("SELECT imagen FROM registro_masivo WHERE imagen = ANY(%s)", ([r["imagen"] for r in records],))
+    return {row[0] for row in c.fetchall()}
+
+
+_accurate = False
+
+
+def _init_worker(accurate):
+    global _accurate
+    _accurate = accurate
+    from face_recognition import warm_up
+    warm_up()
+
+
+def _extract_batch(records):
+    """
+    Corre en un proceso del pool: detecta el rostro más grande de cada foto
+    y extrae todos los descriptores del lote en una sola inferencia.
+    """
+    from face_recognition import detect_faces_still, get_face_descriptors
+
+    crops, positions, results = [], [], []
+    for record in records:
+        image = cv2.imread(record["imagen"])
+        if image is None:
+            results.append((record, None, "no se pudo leer la imagen"))
+            continue
+        boxes = detect_faces_still(image, accurate=_accurate)
+        if not boxes:
+            results.append((record, None, "no se detectó ningún rostro"))
+            continue
+        x, y, w, h = boxes[0]
+        crops.append(image[max(0, y):y + h, max(0, x):x + w])
+        positions.append(len(results))
+        results.append((record, None, None))
+
+    if crops:
+        batch = get_face_descriptors(crops)
+        for i, pos in enumerate(positions):
+            record = results[pos][0]
+            if batch.valid[i]:
+                results[pos] = (record, batch.embeddings[i], None)
+            else:
+                results[pos] = (record, None, batch.errors.get(i))
+    return results
+
+
+class BulkEnroller:
+    """Inserta en la base de datos los resultados de los procesos del pool."""
+
+    def __init__(self, conn, c, gallery, checkpoint_path, duplicate_threshold=DUPLICATE_THRESHOLD):
+        self.conn = conn
+        self.c = c
+        self.gallery = gallery
+        self.checkpoint_path = checkpoint_path
+        self.duplicate_threshold = duplicate_threshold
+        self.persona_by_cedula = {}
+        self.counts = {"registrados": 0, "plantillas_extra": 0, "duplicados": 0, "errores": 0}
+
+    def load_existing_cedulas(self, records):
+        cedulas = list({r["cedula"] for r in records})
+        self.c.execute("SELECT cedula, id FROM personas WHERE cedula = ANY(%s)", (cedulas,))
+        self.persona_by_cedula.update(dict(self.c.fetchall()))
+
+    def process(self, results):
+        """
+        Filtra duplicados e inserta el lote en una sola transacción. Si el
+        lote falla se reintenta fila por fila (_insert_rows), para que una
+        fila inválida no arrastre a las demás.
+        """
+        from database import save_face_descriptors
+
+        outcomes = []
+        new_people = []
+        ok = [(record, emb) for record, emb, error in results if error is None]
+        for record, _, error in results:
+            if error is not None:
+                outcomes.append({"imagen": record["imagen"], "estado": "error", "detalle": error})
+                self.counts["errores"] += 1
+
+        matches = self.gallery.search_batch(np.asarray([emb for _, emb in ok]), k=1) if ok else []
+        accepted = []
+        for (record, emb), candidates in zip(ok, matches):
+            persona_id = self.persona_by_cedula.get(record["cedula"])
+            # Casi-duplicado de otra persona ya registrada (en la BD o en este lote)
+            duplicate_of = None
+            if candidates and candidates[0].distance < self.duplicate_threshold and candidates[0].persona_id != persona_id:
+                duplicate_of = f"persona_id {candidates[0].persona_id} (distancia {candidates[0].distance:.2f})"
+            if duplicate_of is None:
+                for other, other_emb in accepted:
+                    if other["cedula"] != record["cedula"] and np.linalg.norm(other_emb - emb) < self.duplicate_threshold:
+                        duplicate_of = f"cédula {other['cedula']} del mismo lote"
+                        break
+            if duplicate_of is not None:
+                outcomes.append({"imagen": record["imagen"], "estado": "duplicado", "detalle": duplicate_of})
+                self.counts["duplicados"] += 1
+                continue
+            accepted.append((record, emb))
+            if persona_id is None and record["cedula"] not in {r["cedula"] for r in new_people}:
+                new_people.append(record)
+
+        try:
+            inserted = {}
+            if new_people:
+                rows = [(r["cedula"], r["nombre"], r["nombre2"], r["apellido1"], r["apellido2"], r["correo"])
+                        for r in new_people]
+                inserted = dict(execute_values(self.c, """
+                    INSERT INTO personas (cedula, nombre, nombre2, apellido1, apellido2, correo_electronico)
+                    VALUES %s RETURNING cedula, id
+                """, rows, fetch=True))
+
+            persona_ids = [self.persona_by_cedula.get(r["cedula"]) or inserted[r["cedula"]] for r, _ in accepted]
+            template_ids = save_face_descriptors(self.c, self.conn, persona_ids, [e for _, e in accepted], commit=False)
+            execute_values(self.c, "INSERT INTO registro_masivo (imagen, persona_id, codificacion_id) VALUES %s",
+                           [(r["imagen"], pid, tid) for (r, _), pid, tid in zip(accepted, persona_ids, template_ids)])
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            print(f"[ERROR] Lote no guardado en bloque ({e}); reintentando fila por fila")
+            accepted, persona_ids, template_ids, inserted, failed = self._insert_rows(accepted)
+            self.counts["errores"] += len(failed)
+            outcomes.extend(failed)
+
+        self.persona_by_cedula.update(inserted)
+        for (record, emb), persona_id, template_id in zip(accepted, persona_ids, template_ids):
+            self.gallery.add(persona_id, record["nombre"], emb, template_id)
+            # La primera foto de una cédula nueva registra a la persona; las demás son plantillas extra
+            new = inserted.pop(record["cedula"], None) is not None
+            self.counts["registrados" if new else "plantillas_extra"] += 1
+            outcomes.append({"imagen": record["imagen"], "estado": "registrado", "persona_id": persona_id})
+
+        # El avance se anota solo después del commit
+        with open(self.checkpoint_path, "a", encoding="utf-8") as f:
+            for outcome in outcomes:
+                f.write(json.dumps(outcome, ensure_ascii=False) + "\n")
+
+    def _insert_rows(self, accepted):
+        """
+        Inserta cada fila en su propio SAVEPOINT: una fila inválida (por
+        ejemplo, una cédula repetida) solo deshace esa fila.
+
+        Returns:
+            (guardadas, persona_ids, template_ids, personas_nuevas, fallidas).
+            Si falla la transacción entera (p. ej. se perdió la conexión) no
+            se devuelve nada: esas filas no se anotan y se reintentan al retomar.
+        """
+        from database import save_face_descriptor, save_person
+
+        saved, persona_ids, template_ids, inserted, failed = [], [], [], {}, []
+        try:
+            for record, emb in accepted:
+                persona_id = self.persona_by_cedula.get(record["cedula"]) or inserted.get(record["cedula"])
+                self.c.execute("SAVEPOINT fila")
+                try:
+                    new_id = None
+                    if persona_id is None:
+                        new_id = save_person(self.c, record["cedula"], record["nombre"], record["nombre2"],
+                                             record["apellido1"], record["apellido2"], record["correo"])
+                    template_id = save_face_descriptor(self.c, self.conn, persona_id or new_id, emb, commit=False)
+                    self.c.execute("INSERT INTO registro_masivo (imagen, persona_id, codificacion_id) VALUES (%s, %s, %s)",
+                                   (record["imagen"], persona_id or new_id, template_id))
+                    self.c.execute("RELEASE SAVEPOINT fila")
+                except Exception as e:
+                    self.c.execute("ROLLBACK TO SAVEPOINT fila")
+                    failed.append({"imagen": record["imagen"], "estado": "error", "detalle": str(e)})
+                    continue
+                if new_id is not None:
+                    inserted[record["cedula"]] = new_id
+                saved.append((record, emb))
+                persona_ids.append(persona_id or new_id)
+                template_ids.append(template_id)
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            print(f"[ERROR] Lote no guardado: {e}; se reintentará al retomar")
+            self.counts["errores"] += len(accepted)
+            return [], [], [], {}, []
+        return saved, persona_ids, template_ids, inserted, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registro masivo de rostros desde fotos")
+    parser.add_argument("source", help="Directorio de fotos o CSV con cedula,nombre,...,imagen")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--checkpoint", default="bulk_enroll.checkpoint.jsonl")
+    parser.add_argument("--threshold", type=float, default=DUPLICATE_THRESHOLD,
+                        help="Distancia L2 bajo la cual se considera duplicado")
+    parser.add_argument("--accurate", action="store_true", help="Detectar con RetinaFace en lugar de Haar")
+    args = parser.parse_args()
+
+    from database import connect_db, release_db, load_faces_from_db
+
+    records = read_records(args.source)
+    done = read_checkpoint(args.checkpoint)
+    pending = [r for r in records if r["imagen"] not in done]
+    if not pending:
+        print(f"[INFO] {len(records)} imágenes, todas ya procesadas")
+        return
+
+    conn, c = connect_db()
+    try:
+        enrolled = read_enrolled(c, pending)
+        pending = [r for r in pending if r["imagen"] not in enrolled]
+        print(f"[INFO] {len(records)} imágenes, {len(records) - len(pending)} ya procesadas, {len(pending)} pendientes")
+        if not pending:
+            return
+        enroller = BulkEnroller(conn, c, load_faces_from_db(c), args.checkpoint, args.threshold)
+        enroller.load_existing_cedulas(pending)
+
+        start = time.time()
+        batches = [pending[i:i + args.batch_size] for i in range(0, len(pending), args.batch_size)]
+        # spawn: TensorFlow no tolera bien heredar el estado con fork
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(args.workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(args.accurate,)) as pool:
+            futures = [pool.submit(_extract_batch, batch) for batch in batches]
+            processed = 0
+            for future in as_completed(futures):
+                results = future.result()
+                enroller.process(results)
+                processed += len(results)
+                elapsed = time.time() - start
+                print(f"[INFO] {processed}/{len(pending)} imágenes ({processed / elapsed:.2f} img/s)")
+
+        elapsed = time.time() - start
+        print(f"[INFO] Terminado en {elapsed:.1f}s: {len(pending) / elapsed:.2f} img/s, {enroller.counts}")
+    finally:
+        release_db(conn)
+
+
+if __name__ == "__main__":
+    main()
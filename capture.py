@@ -0,0 +1,144 @@
+# capture.py
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+import metrics
+
+# Cuadro prestado por FrameCapture.acquire(); frame es una vista de solo lectura
+FrameRef = namedtuple("FrameRef", ["seq", "timestamp", "frame", "slot"])
+
+
+class FrameCapture:
+    """
+    Captura de cámara en su propio hilo con un anillo de buffers preasignados.
+
+    El hilo de captura es el único escritor: lee cada cuadro en un buffer fijo,
+    lo voltea directamente sobre un slot libre del anillo y lo publica como
+    "último cuadro". Los lectores (interfaz y procesamiento) lo toman prestado
+    con acquire()/release() sin copiarlo; un slot prestado nunca se sobrescribe.
+    Los cuadros publicados que nadie llegó a leer se cuentan como descartados.
+    """
+
+    def __init__(self, source=0, ring_size=4, flip=True):
+        self.source = source
+        self.ring_size = ring_size
+        self.flip = flip
+        self.cap = cv2.VideoCapture(source)
+        self._cond = threading.Condition()
+        self._raw = None
+        self._ring = None
+        self._refs = [0] * ring_size
+        self._latest = None  # (seq, timestamp, slot)
+        self._latest_consumed = True
+        self._thread = None
+        self.running = False
+
+        self.frames_captured = 0
+        self.frames_dropped = 0  # Publicados y reemplazados sin que nadie los leyera
+        self.frames_skipped = 0  # Sin slot libre: todos prestados
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def start(self):
+        if self._thread is None:
+            self.running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        if self.cap.isOpened():
+            self.cap.release()
+        with self._cond:
+            self._cond.notify_all()
+
+    def _free_slot(self):
+        latest_slot = self._latest[2] if self._latest is not None else None
+        for slot in range(self.ring_size):
+            if slot != latest_slot and self._refs[slot] == 0:
+                return slot
+        return None
+
+    def _run(self):
+        while self.running:
+            with metrics.timed("captura"):
+                ok, raw = self.cap.read(self._raw)
+            if not ok:
+                time.sleep(0.01)
+                continue
+            self._raw = raw
+
+            if self._ring is None:
+                self._ring = np.empty((self.ring_size,) + raw.shape, dtype=raw.dtype)
+
+            with self._cond:
+                slot = self._free_slot()
+            if slot is None:
+                self.frames_skipped += 1
+                metrics.inc("cuadros_sin_slot")
+                continue
+
+            # Escritura fuera del lock: el slot no es el último ni está prestado
+            if self.flip:
+                cv2.flip(raw, 1, dst=self._ring[slot])
+            else:
+                np.copyto(self._ring[slot], raw)
+
+            with self._cond:
+                if not self._latest_consumed:
+                    self.frames_dropped += 1
+                    metrics.inc("cuadros_sin_leer")
+                self.frames_captured += 1
+                self._latest = (self.frames_captured, time.time(), slot)
+                self._latest_consumed = False
+                self._cond.notify_all()
+
+    @property
+    def latest_seq(self):
+        latest = self._latest
+        return latest[0] if latest is not None else 0
+
+    def acquire(self, after_seq=0, timeout=None):
+        """
+        Toma prestado el último cuadro si es más nuevo que after_seq.
+
+        Args:
+            after_seq: Número del último cuadro que ya procesó quien llama.
+            timeout: Segundos a esperar un cuadro nuevo (None espera sin
+                límite, 0 no espera).
+
+        Returns:
+            FrameRef o None si no llegó un cuadro nuevo. Hay que devolverlo
+            con release() en cuanto se deje de usar.
+        """
+        with self._cond:
+            if timeout != 0:
+                self._cond.wait_for(lambda: not self.running or self.latest_seq > after_seq, timeout)
+            if self._latest is None or self._latest[0] <= after_seq:
+                return None
+            seq, timestamp, slot = self._latest
+            self._refs[slot] += 1
+            self._latest_consumed = True
+        view = self._ring[slot].view()
+        view.flags.writeable = False
+        return FrameRef(seq, timestamp, view, slot)
+
+    def release(self, ref):
+        with self._cond:
+            self._refs[ref.slot] -= 1
+
+    def stats(self):
+        return {
+            "capturados": self.frames_captured,
+            "descartados": self.frames_dropped,
+            "sin_slot": self.frames_skipped,
+        }
@@ -0,0 +1,162 @@
+# compare_backends.py
+"""
+Compara los backends de descriptores de face_recognition.py.
+
+Uso:
+    python compare_backends.py --export --quantize          # genera arcface.onnx y arcface.int8.onnx
+    python compare_backends.py --images recortes/ --backends tf,onnx,onnx-int8
+
+Cada backend corre en un proceso aparte sobre el mismo conjunto de
+referencia, para que el RSS de uno (por ejemplo TensorFlow) no se sume al
+de otro. Se informa el tiempo de carga, la latencia por rostro (lote de 1 y
+lote completo), el RSS máximo y la similitud coseno de cada descriptor
+contra el del backend de referencia (tf por defecto).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def reference_crops(images=None, count=64):
+    """Recortes del directorio images, o rostros sintéticos reproducibles."""
+    if images:
+        names = sorted(n for n in os.listdir(images) if n.lower().endswith(IMAGE_EXTENSIONS))
+        crops = [cv2.imread(os.path.join(images, n)) for n in names[:count]]
+        return [c for c in crops if c is not None]
+    from verification_service import synthetic_face
+    return [synthetic_face(seed) for seed in range(count)]
+
+
+def _rss_mb():
+    """RSS máximo del proceso en MB, o None si no se puede medir en esta plataforma."""
+    try:
+        import resource  # No existe en Windows
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        # peak_wset es el pico en Windows; en otras plataformas, el RSS actual
+        return getattr(info, "peak_wset", info.rss) / (1024.0 * 1024.0)
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en bytes en macOS y en KB en Linux
+    return maxrss / (1024.0 * 1024.0) if sys.platform == "darwin" else maxrss / 1024.0
+
+
+def _round_mb(value):
+    return None if value is None else round(value, 1)
+
+
+def run_worker(backend_name, images, count, repeat, output):
+    """Corre en el proceso hijo: mide un backend y guarda sus descriptores."""
+    from face_recognition import _embed_crops, create_embedding_backend
+
+    crops = reference_crops(images, count)
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    backend = create_embedding_backend(backend_name)
+    height, width = backend.input_size
+    backend.run(np.zeros((1, height, width, 3), dtype=np.float32))
+    load_time = time.perf_counter() - start
+
+    single, batched = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for crop in crops[:8]:
+            _embed_crops(backend, [crop])
+        single.append((time.perf_counter() - start) / min(8, len(crops)))
+        start = time.perf_counter()
+        result = _embed_crops(backend, crops)
+        batched.append((time.perf_counter() - start) / len(crops))
+
+    np.save(output, result.embeddings)
+    rss_after = _rss_mb()
+    print(json.dumps({
+        "backend": backend_name,
+        "carga_s": round(load_time, 3),
+        "ms_por_rostro_lote_1": round(float(np.median(single)) * 1000, 3),
+        "ms_por_rostro_lote": round(float(np.median(batched)) * 1000, 3),
+        "rss_max_mb": _round_mb(rss_after),
+        "rss_modelo_mb": _round_mb(None if rss_after is None else rss_after - rss_before),
+        "validos": int(result.valid.sum()),
+    }))
+
+
+def compare(backends, reference, images, count, repeat):
+    """Lanza un proceso por backend y compara sus descriptores con los de reference."""
+    results, embeddings = {}, {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in backends:
+            output = os.path.join(tmp, f"{name}.npy")
+            command = [sys.executable, os.path.abspath(__file__), "--worker", name,
+                       "--count", str(count), "--repeat", str(repeat), "--embeddings", output]
+            if images:
+                command += ["--images", images]
+            proc = subprocess.run(command, capture_output=True, text=True)
+            lines = [l for l in proc.stdout.splitlines() if l.startswith("{")]
+            if proc.returncode != 0 or not lines:
+                print(f"[ERROR] Backend {name} falló: {proc.stderr.strip().splitlines()[-1:] or proc.stdout}")
+                continue
+            results[name] = json.loads(lines[-1])
+            embeddings[name] = np.load(output)
+
+    if reference in embeddings:
+        base = embeddings[reference]
+        for name, emb in embeddings.items():
+            # Descriptores normalizados: el producto punto es la similitud coseno
+            cosine = np.sum(base * emb, axis=1)
+            results[name]["coseno_media"] = round(float(cosine.mean()), 5)
+            results[name]["coseno_min"] = round(float(cosine.min()), 5)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara los backends de descriptores (acuerdo, velocidad, RSS)")
+    parser.add_argument("--backends", default="tf,onnx,onnx-int8")
+    parser.add_argument("--reference", default="tf", help="Backend contra el que se mide el acuerdo")
+    parser.add_argument("--images", default=None, help="Directorio de recortes de rostro (por defecto, sintéticos)")
+    parser.add_argument("--count", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--export", action="store_true", help="Exportar ArcFace a ONNX")
+    parser.add_argument("--quantize", action="store_true", help="Generar el modelo int8")
+    parser.add_argument("--output", default=None, help="Guardar el informe en JSON")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--embeddings", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.images, args.count, args.repeat, args.embeddings)
+        return
+
+    from face_recognition import ONNX_INT8_MODEL_PATH, ONNX_MODEL_PATH, export_arcface_onnx, quantize_onnx
+    if args.export:
+        export_arcface_onnx(ONNX_MODEL_PATH)
+    if args.quantize:
+        quantize_onnx(ONNX_MODEL_PATH, ONNX_INT8_MODEL_PATH)
+    if args.export or args.quantize:
+        return
+
+    results = compare(args.backends.split(","), args.reference, args.images, args.count, args.repeat)
+    for name, r in results.items():
+        rss = "n/d" if r["rss_max_mb"] is None else f"{r['rss_max_mb']:.0f} MB"
+        agreement = f"coseno vs {args.reference}: media {r['coseno_media']:.4f}, mín {r['coseno_min']:.4f}" \
+            if "coseno_media" in r else "sin referencia"
+        print(f"[INFO] {name:10s} carga {r['carga_s']:.2f}s, {r['ms_por_rostro_lote_1']:.2f} ms/rostro (lote 1), "
+              f"{r['ms_por_rostro_lote']:.2f} ms/rostro (lote), RSS {rss}, {agreement}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
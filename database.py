@@ -1,64 +1,348 @@
 # database.py
+import re
+import threading
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 import numpy as np
 
+import metrics
+from gallery import FaceGallery
+from gallery_snapshot import DEFAULT_SNAPSHOT_DIR, load_gallery_snapshot
+
+DB_CONFIG = {
+    "dbname": "biometria", "user": "postgres", "password": "admin", "host": "localhost", "port": "5433"
+}
+POOL_MIN_CONNECTIONS = 1
+POOL_MAX_CONNECTIONS = 8
+
+# Formatos binarios de codificaciones_faciales.codificacion_bin
+STORAGE_DTYPES = {"f32": np.float32, "f16": np.float16}
+# Formato para nuevas plantillas si la tabla ya tiene la columna binaria
+EMBEDDING_STORAGE = "f32"
+EMBEDDING_DIM = 512
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """Conexión que recuerda qué sentencias preparadas ya creó en su sesión."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.has_binary_embeddings = None
+
+
+def get_pool():
+    """Pool de conexiones compartido por todo el proceso (se crea al primer uso)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS,
+                                           connection_factory=PreparedConnection, **DB_CONFIG)
+        return _pool
+
+
 def connect_db():
-    conn = psycopg2.connect(
-        dbname="biometria", user="postgres", password="admin", host="localhost", port="5433"
-    )
+    """
+    Toma una conexión del pool. Hay que devolverla con release_db(conn).
+
+    Returns:
+        (conn, c): conexión y un cursor sobre ella.
+    """
+    conn = get_pool().getconn()
     c = conn.cursor()
     return conn, c
 
-def save_face_descriptor(c, conn, persona_id, descriptor):
+
+def release_db(conn, broken=False):
+    """Devuelve una conexión al pool; si quedó inutilizable se cierra."""
+    if conn is None:
+        return
+    if not conn.closed and not broken:
+        conn.rollback()
+    get_pool().putconn(conn, close=broken or bool(conn.closed))
+
+
+@contextmanager
+def pooled_connection():
+    """Conexión del pool para una operación corta: commit al salir, rollback si falla."""
+    conn, c = connect_db()
+    try:
+        yield conn, c
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        c.close()
+        release_db(conn)
+
+
+def execute_prepared(c, name, sql, args):
     """
-    Guarda un descriptor facial normalizado en la base de datos.
+    Ejecuta una sentencia preparada en el servidor. La primera vez en cada
+    conexión se hace PREPARE; luego solo EXECUTE, sin volver a planificar.
 
     Args:
         c: Cursor de la base de datos.
-        conn: Conexión a la base de datos.
-        persona_id: ID de la persona en la tabla personas.
-        descriptor: Vector numpy con la codificación facial.
+        name: Nombre de la sentencia preparada.
+        sql: Sentencia con parámetros $1, $2, ...
+        args: Valores de los parámetros.
     """
-    # Normalizar el descriptor (norma 1)
+    prepared = getattr(c.connection, "prepared", None)
+    if prepared is None:
+        # Conexión fuera del pool: se ejecuta sin preparar
+        c.execute(re.sub(r"\$\d+", "%s", sql), args)
+        return
+    if name not in prepared:
+        c.execute(f"PREPARE {name} AS {sql}")
+        prepared.add(name)
+    c.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(args))})", args)
+
+
+def has_binary_embeddings(c):
+    """Indica si codificaciones_faciales ya tiene la columna codificacion_bin."""
+    conn = c.connection
+    cached = getattr(conn, "has_binary_embeddings", None)
+    if cached is not None:
+        return cached
+    c.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'codificaciones_faciales' AND column_name = 'codificacion_bin'
+    """)
+    result = c.fetchone() is not None
+    if isinstance(conn, PreparedConnection):
+        conn.has_binary_embeddings = result
+    return result
+
+
+def encode_embedding(descriptor, fmt=EMBEDDING_STORAGE):
+    """Descriptor normalizado como bytes compactos (float32 o float16)."""
+    descriptor = np.asarray(descriptor, dtype=np.float32).reshape(-1)
     norm = np.linalg.norm(descriptor)
     if norm > 0:
         descriptor = descriptor / norm
-    
+    return psycopg2.Binary(descriptor.astype(STORAGE_DTYPES[fmt]).tobytes())
+
+
+def decode_embeddings(binaries, formats, arrays, dim=EMBEDDING_DIM):
+    """
+    Convierte las columnas de codificaciones_faciales en una matriz float32.
+    Las filas binarias del mismo formato se decodifican juntas con frombuffer;
+    las que siguen en FLOAT8[] se convierten desde la lista de Python.
+    """
+    n = len(binaries)
+    matrix = np.empty((n, dim), dtype=np.float32)
+    by_format = {}
+    for i, (binary, fmt) in enumerate(zip(binaries, formats)):
+        by_format.setdefault(fmt if binary is not None else None, []).append(i)
+    for fmt, rows in by_format.items():
+        if fmt is None:
+            matrix[rows] = np.asarray([arrays[i] for i in rows], dtype=np.float32)
+        else:
+            data = b"".join(bytes(binaries[i]) for i in rows)
+            matrix[rows] = np.frombuffer(data, dtype=STORAGE_DTYPES[fmt]).reshape(len(rows), dim)
+    return matrix
+
+
+def fetch_templates(c, after_id=0, ids=None):
+    """
+    Trae las plantillas con codificaciones_faciales.id > after_id (o, si se
+    da ids, solo esas), en orden de id.
+
+    Returns:
+        (template_ids, persona_ids, names, matrix) con la matriz en float32
+        todavía sin normalizar.
+    """
+    binary = has_binary_embeddings(c)
+    columns = "cf.codificacion_bin, cf.formato, cf.codificacion" if binary else "NULL, NULL, cf.codificacion"
+    if ids is None:
+        condition, args = "cf.id > %s", (after_id,)
+    else:
+        condition, args = "cf.id = ANY(%s)", ([int(i) for i in ids],)
+    c.execute(f"""
+        SELECT cf.id, p.id, p.nombre, {columns}
+        FROM codificaciones_faciales cf
+        JOIN personas p ON p.id = cf.persona_id
+        WHERE {condition}
+        ORDER BY cf.id
+    """, args)
+    rows = c.fetchall()
+    if not rows:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, dtype=object), np.zeros((0, EMBEDDING_DIM), np.float32)
+    template_ids, persona_ids, names, binaries, formats, arrays = zip(*rows)
+    matrix = decode_embeddings(binaries, formats, arrays)
+    return (np.asarray(template_ids, dtype=np.int64), np.asarray(persona_ids, dtype=np.int64),
+            np.asarray(names, dtype=object), matrix)
+
+
+def fetch_template_ids(c):
+    """Todos los codificaciones_faciales.id, sin los vectores."""
+    c.execute("SELECT id FROM codificaciones_faciales")
+    return np.asarray([row[0] for row in c.fetchall()], dtype=np.int64)
+
+
+def fetch_person_names(c, persona_ids):
+    """Lista de (persona_id, nombre) de esas personas."""
+    c.execute("SELECT id, nombre FROM personas WHERE id = ANY(%s)", ([int(i) for i in persona_ids],))
+    return c.fetchall()
+
+
+def _insert_descriptor_sql(c):
+    if has_binary_embeddings(c):
+        return ("insertar_codificacion_bin",
+                "INSERT INTO codificaciones_faciales (persona_id, codificacion_bin, formato) "
+                "VALUES ($1, $2, $3) RETURNING id")
+    return ("insertar_codificacion",
+            "INSERT INTO codificaciones_faciales (persona_id, codificacion) VALUES ($1, $2) RETURNING id")
+
+
+def _descriptor_args(c, persona_id, descriptor):
+    if has_binary_embeddings(c):
+        return (persona_id, encode_embedding(descriptor), EMBEDDING_STORAGE)
     # Convertir a lista de floats para PostgreSQL FLOAT8[]
-    desc_list = descriptor.astype(np.float64).tolist()
-    
-    # Insertar en la tabla codificaciones_faciales
-    c.execute(
-        "INSERT INTO codificaciones_faciales (persona_id, codificacion) VALUES (%s, %s)",
-        (persona_id, desc_list)
-    )
-    conn.commit()
+    descriptor = np.asarray(descriptor, dtype=np.float64)
+    norm = np.linalg.norm(descriptor)
+    if norm > 0:
+        descriptor = descriptor / norm
+    return (persona_id, descriptor.tolist())
+
 
-def load_faces_from_db(c):
+def save_face_descriptor(c, conn, persona_id, descriptor, commit=True):
     """
-    Carga las codificaciones faciales desde la base de datos y las normaliza.
+    Guarda un descriptor facial normalizado en la base de datos.
 
     Args:
         c: Cursor de la base de datos.
+        conn: Conexión a la base de datos.
+        persona_id: ID de la persona en la tabla personas.
+        descriptor: Vector numpy con la codificación facial.
+        commit: Si es False, el llamador agrupa varias operaciones en una transacción.
 
     Returns:
-        face_db: Lista de tuplas (nombre_completo, descriptor_normalizado)
+        ID de la fila insertada en codificaciones_faciales.
     """
-    c.execute("""
-        SELECT p.id, p.nombre, p.correo_electronico, cf.codificacion 
-        FROM personas p
-        JOIN codificaciones_faciales cf ON p.id = cf.persona_id
-    """)
-    faces = c.fetchall()
-    face_db = []
-    for pid, nombre, correo, codificacion in faces:
-        full_name = nombre
-        desc = np.array(codificacion, dtype=np.float32)
-        
-        # Normalizar descriptor
-        norm = np.linalg.norm(desc)
-        if norm > 0:
-            desc = desc / norm
-        
-        face_db.append((full_name, desc))
-    return face_db
+    name, sql = _insert_descriptor_sql(c)
+    execute_prepared(c, name, sql, _descriptor_args(c, persona_id, descriptor))
+    template_id = c.fetchone()[0]
+    if commit:
+        conn.commit()
+    return template_id
+
+
+def save_face_descriptors(c, conn, persona_ids, descriptors, commit=True):
+    """
+    Guarda varios descriptores con un solo INSERT de varias filas.
+
+    Returns:
+        IDs de las filas insertadas, en el mismo orden.
+    """
+    rows = [_descriptor_args(c, pid, desc) for pid, desc in zip(persona_ids, descriptors)]
+    if not rows:
+        return []
+    if has_binary_embeddings(c):
+        sql = "INSERT INTO codificaciones_faciales (persona_id, codificacion_bin, formato) VALUES %s RETURNING id"
+    else:
+        sql = "INSERT INTO codificaciones_faciales (persona_id, codificacion) VALUES %s RETURNING id"
+    template_ids = [row[0] for row in execute_values(c, sql, rows, fetch=True)]
+    if commit:
+        conn.commit()
+    return template_ids
+
+
+def save_person(c, cedula, nombre, nombre2, apellido1, apellido2, correo):
+    """Inserta una persona (sin commit) y devuelve su id."""
+    execute_prepared(c, "insertar_persona", """
+        INSERT INTO personas (cedula, nombre, nombre2, apellido1, apellido2, correo_electronico)
+        VALUES ($1, $2, $3, $4, $5, $6) RETURNING id
+    """, (cedula, nombre, nombre2, apellido1, apellido2, correo))
+    return c.fetchone()[0]
+
+
+def register_person(c, conn, person, descriptor):
+    """
+    Registra una persona y su plantilla en una sola transacción.
+
+    Args:
+        person: Tupla (cedula, nombre, nombre2, apellido1, apellido2, correo).
+        descriptor: Codificación facial.
+
+    Returns:
+        (persona_id, template_id)
+    """
+    try:
+        persona_id = save_person(c, *person)
+        template_id = save_face_descriptor(c, conn, persona_id, descriptor, commit=False)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return persona_id, template_id
+
+
+def migrate_embeddings_to_binary(c, conn, fmt=EMBEDDING_STORAGE, batch_size=1000):
+    """
+    Pasa las plantillas existentes de FLOAT8[] a codificacion_bin por lotes.
+    Requiere haber aplicado la migración de biometria.sql.
+
+    Returns:
+        Número de filas migradas.
+    """
+    if not has_binary_embeddings(c):
+        raise RuntimeError("Falta la columna codificacion_bin: aplicar la migración de biometria.sql")
+    migrated = 0
+    while True:
+        c.execute("""
+            SELECT id, codificacion FROM codificaciones_faciales
+            WHERE codificacion_bin IS NULL AND codificacion IS NOT NULL
+            ORDER BY id LIMIT %s
+        """, (batch_size,))
+        rows = c.fetchall()
+        if not rows:
+            break
+        values = [(row_id, encode_embedding(codificacion, fmt), fmt) for row_id, codificacion in rows]
+        execute_values(c, """
+            UPDATE codificaciones_faciales AS cf
+            SET codificacion_bin = v.bin, formato = v.formato, codificacion = NULL
+            FROM (VALUES %s) AS v(id, bin, formato)
+            WHERE cf.id = v.id
+        """, values)
+        conn.commit()
+        migrated += len(rows)
+        print(f"[INFO] Migradas {migrated} codificaciones a {fmt}")
+    return migrated
+
+
+def load_faces_from_db(c, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+    """
+    Carga las codificaciones faciales desde la base de datos en una FaceGallery.
+
+    Por defecto usa el snapshot local memory-mapped y solo trae de la base de
+    datos las filas nuevas. Con snapshot_dir=None hace la consulta completa.
+
+    Args:
+        c: Cursor de la base de datos.
+        snapshot_dir: Directorio del snapshot local, o None para no usarlo.
+
+    Returns:
+        face_db: FaceGallery con una fila normalizada por plantilla, junto al
+            id de la plantilla, el persona_id y el nombre.
+    """
+    if snapshot_dir is not None:
+        try:
+            with metrics.timed("db"):
+                return load_gallery_snapshot(c, snapshot_dir)
+        except Exception as e:
+            print(f"[ERROR] No se pudo usar el snapshot de galería: {e}")
+            c.connection.rollback()
+
+    with metrics.timed("db"):
+        template_ids, persona_ids, names, matrix = fetch_templates(c)
+    # from_arrays normaliza todas las filas de una vez
+    return FaceGallery.from_arrays(matrix, persona_ids, names, template_ids, normalized=False)
@@ -0,0 +1,158 @@
+# duplicate_audit.py
+"""
+Auditoría de casi-duplicados en toda la galería.
+
+Uso:
+    python duplicate_audit.py --threshold 0.9 --output duplicados.csv
+
+Busca todos los pares de plantillas de personas distintas con distancia L2
+menor al umbral. La matriz de similitudes se calcula por bloques
+(block_size x block_size), así que la memoria no depende del tamaño de la
+galería; los bloques se reparten entre hilos porque el producto matricial
+de NumPy libera el GIL.
+"""
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from gallery import Match, distance_to_score, score_to_distance
+
+DUPLICATE_THRESHOLD = 0.9  # Distancia L2 entre descriptores normalizados
+
+
+def find_near_duplicates(gallery, descriptor, threshold=DUPLICATE_THRESHOLD, exclude_persona=None):
+    """
+    Personas de la galería con alguna plantilla a menos de threshold del
+    descriptor, de la más parecida a la menos. Un solo producto matricial.
+
+    Args:
+        gallery: FaceGallery.
+        descriptor: Descriptor a verificar.
+        threshold: Distancia L2 máxima para considerarlo duplicado.
+        exclude_persona: persona_id que no cuenta como duplicado (la misma persona).
+
+    Returns:
+        Lista de Match, uno por persona.
+    """
+    with gallery.lock:
+        if len(gallery) == 0:
+            return []
+        scores = gallery.scores(descriptor)[0]
+        hits = np.flatnonzero(scores >= distance_to_score(threshold))
+        if exclude_persona is not None:
+            hits = hits[gallery.persona_ids[hits] != exclude_persona]
+        hits = hits[np.argsort(-scores[hits])]
+        persona_ids, names = gallery.persona_ids, gallery.names
+
+    matches, seen = [], set()
+    for i in hits:
+        pid = int(persona_ids[i])
+        if pid not in seen:
+            seen.add(pid)
+            matches.append(Match(pid, names[i], float(scores[i]), float(score_to_distance(scores[i]))))
+    return matches
+
+
+def _scan_block(matrix, persona_ids, row_start, block_size, min_score):
+    """Pares (i, j, score) con i en el bloque de filas y j >= i, de personas distintas."""
+    n = len(matrix)
+    row_end = min(n, row_start + block_size)
+    rows = np.asarray(matrix[row_start:row_end], dtype=np.float32)
+    found_i, found_j, found_s = [], [], []
+    for col_start in range(row_start, n, block_size):
+        col_end = min(n, col_start + block_size)
+        scores = rows @ np.asarray(matrix[col_start:col_end], dtype=np.float32).T
+        if col_start == row_start:
+            # Bloque diagonal: solo el triángulo superior, sin la diagonal
+            scores = np.triu(scores, k=1) + np.tril(np.full_like(scores, -np.inf))
+        ii, jj = np.nonzero(scores >= min_score)
+        if len(ii) == 0:
+            continue
+        ii, jj = ii + row_start, jj + col_start
+        different = persona_ids[ii] != persona_ids[jj]
+        found_i.append(ii[different])
+        found_j.append(jj[different])
+        found_s.append(scores[ii[different] - row_start, jj[different] - col_start])
+    if not found_i:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.float32)
+    return np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_s)
+
+
+def find_duplicate_pairs(gallery, threshold=DUPLICATE_THRESHOLD, block_size=2048, workers=None):
+    """
+    Todos los pares de plantillas de personas distintas bajo el umbral.
+
+    Returns:
+        (i, j, scores): índices de fila en la galería y similitud de cada par.
+    """
+    matrix, persona_ids = gallery.matrix, gallery.persona_ids
+    min_score = distance_to_score(threshold)
+    workers = workers or os.cpu_count() or 1
+    starts = range(0, len(matrix), block_size)
+    with ThreadPoolExecutor(workers) as pool:
+        parts = list(pool.map(lambda s: _scan_block(matrix, persona_ids, s, block_size, min_score), starts))
+    if not parts:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.float32)
+    return tuple(np.concatenate(values) for values in zip(*parts))
+
+
+def duplicate_report(gallery, i, j, scores):
+    """
+    Agrupa los pares por pareja de personas y los ordena de más a menos parecidos.
+
+    Returns:
+        Lista de dicts con persona_a, nombre_a, persona_b, nombre_b,
+        distancia_min y pares (cantidad de pares de plantillas bajo el umbral).
+    """
+    pids, names = gallery.persona_ids, gallery.names
+    pairs = {}
+    for a, b, score in zip(i, j, scores):
+        pa, pb = int(pids[a]), int(pids[b])
+        key = (pa, pb, a, b) if pa < pb else (pb, pa, b, a)
+        entry = pairs.get(key[:2])
+        if entry is None:
+            pairs[key[:2]] = entry = {"persona_a": key[0], "nombre_a": names[key[2]],
+                                      "persona_b": key[1], "nombre_b": names[key[3]],
+                                      "score": float(score), "pares": 0}
+        entry["pares"] += 1
+        entry["score"] = max(entry["score"], float(score))
+    report = sorted(pairs.values(), key=lambda e: -e["score"])
+    for entry in report:
+        entry["distancia_min"] = round(float(score_to_distance(entry.pop("score"))), 4)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Busca casi-duplicados entre personas distintas")
+    parser.add_argument("--threshold", type=float, default=DUPLICATE_THRESHOLD)
+    parser.add_argument("--block-size", type=int, default=2048)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default="duplicados.csv")
+    args = parser.parse_args()
+
+    from database import connect_db, release_db, load_faces_from_db
+    conn, c = connect_db()
+    try:
+        gallery = load_faces_from_db(c)
+    finally:
+        release_db(conn)
+
+    start = time.time()
+    i, j, scores = find_duplicate_pairs(gallery, args.threshold, args.block_size, args.workers)
+    report = duplicate_report(gallery, i, j, scores)
+    elapsed = time.time() - start
+
+    with open(args.output, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["persona_a", "nombre_a", "persona_b", "nombre_b", "distancia_min", "pares"])
+        writer.writeheader()
+        writer.writerows(report)
+    print(f"[INFO] {len(gallery)} plantillas auditadas en {elapsed:.1f}s: "
+          f"{len(report)} parejas de personas bajo {args.threshold} -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# event_sink.py
+import queue
+import threading
+import time
+from datetime import datetime
+
+import cv2
+import psycopg2
+from psycopg2.extras import execute_values
+
+import metrics
+from database import connect_db, release_db
+
+
+class RecognitionEventSink:
+    """
+    Escritor en segundo plano para la tabla eventos_reconocimiento.
+
+    record() se llama desde el hilo de reconocimiento y nunca toca la base
+    de datos: descarta repeticiones de la misma persona dentro de
+    dedup_window segundos, reduce el recorte a una miniatura y lo encola en
+    una cola acotada. Si la cola está llena el evento se descarta y se
+    cuenta (la memoria no crece aunque la base de datos sea lenta).
+
+    Un hilo propio codifica las miniaturas a JPEG y escribe los eventos en
+    lotes con un INSERT de varias filas. Un lote que falla se reintenta una
+    vez en la siguiente escritura; si vuelve a fallar se cuenta en fallidos.
+    """
+
+    def __init__(self, ubicacion="principal", connect=connect_db, release=release_db, max_queue=256, dedup_window=30.0,
+                 batch_size=50, flush_interval=2.0, thumb_size=96, jpeg_quality=70):
+        self.ubicacion = ubicacion
+        self.connect = connect
+        self.release = release
+        self.dedup_window = dedup_window
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.thumb_size = thumb_size
+        self.jpeg_quality = jpeg_quality
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._last_seen = {}
+        self._conn = None
+        self._retry = None  # Filas de un lote fallido, para la siguiente escritura
+        self._running = True
+
+        self.recorded = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.written = 0
+        self.retried = 0
+        self.failed = 0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def record(self, persona_id, confianza, face_img=None, now=None):
+        """
+        Registra un reconocimiento. Devuelve False si se descartó por
+        repetido o por cola llena.
+
+        Args:
+            persona_id: ID de la persona reconocida.
+            confianza: Similitud del reconocimiento (0 a 1).
+            face_img: Recorte BGR del rostro (opcional).
+            now: Marca de tiempo del evento (por defecto, ahora).
+        """
+        now = time.time() if now is None else now
+        last = self._last_seen.get(persona_id)
+        if last is not None and now - last < self.dedup_window:
+            self.deduplicated += 1
+            return False
+
+        thumb = None
+        if face_img is not None and face_img.size:
+            # Reducir aquí crea una copia pequeña: el recorte puede ser una
+            # vista de un buffer de captura que se va a reutilizar
+            scale = self.thumb_size / max(face_img.shape[:2])
+            size = (max(1, int(face_img.shape[1] * scale)), max(1, int(face_img.shape[0] * scale)))
+            thumb = cv2.resize(face_img, size, interpolation=cv2.INTER_AREA)
+
+        try:
+            self._queue.put_nowait((persona_id, float(confianza), datetime.fromtimestamp(now), thumb))
+        except queue.Full:
+            self.dropped += 1
+            metrics.inc("eventos_descartados")
+            return False
+        self._last_seen[persona_id] = now
+        if len(self._last_seen) > 10000:
+            self._last_seen = {k: t for k, t in self._last_seen.items() if now - t < self.dedup_window}
+        self.recorded += 1
+        return True
+
+    def _next_batch(self):
+        batch = []
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            while self._running or not self._queue.empty() or self._retry:
+                batch = self._next_batch()
+                if self._retry:
+                    rows, self._retry = self._retry, None
+                    self.retried += len(rows)
+                    if not self._insert(rows):
+                        self.failed += len(rows)
+                        metrics.inc("eventos_fallidos", len(rows))
+                if batch:
+                    rows = [(persona_id, confianza, fecha, self._encode(thumb), self.ubicacion)
+                            for persona_id, confianza, fecha, thumb in batch]
+                    if not self._insert(rows):
+                        self._retry = rows
+        finally:
+            # La conexión la devuelve el hilo al terminar, nunca a mitad de un INSERT
+            if self._conn is not None:
+                self.release(self._conn)
+                self._conn = None
+
+    def _encode(self, thumb):
+        if thumb is None:
+            return None
+        ok, buffer = cv2.imencode(".jpg", thumb, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        return psycopg2.Binary(buffer.tobytes()) if ok else None
+
+    def _insert(self, rows):
+        """Escribe las filas en una transacción. Devuelve False si falló."""
+        try:
+            if self._conn is None or self._conn.closed:
+                self._conn, _ = self.connect()
+            with metrics.timed("db"), self._conn.cursor() as c:
+                execute_values(c, """
+                    INSERT INTO eventos_reconocimiento (persona_id, confianza, fecha_evento, imagen, ubicacion)
+                    VALUES %s
+                """, rows)
+                self._conn.commit()
+            self.written += len(rows)
+            metrics.inc("eventos_escritos", len(rows))
+            return True
+        except Exception as e:
+            print(f"[ERROR] No se pudieron guardar {len(rows)} eventos: {e}")
+            if self._conn is not None:
+                try:
+                    self._conn.rollback()
+                except Exception:
+                    self.release(self._conn, broken=True)
+                    self._conn = None
+            return False
+
+    def close(self, timeout=5.0):
+        """Escribe lo pendiente y detiene el hilo (que devuelve su conexión al pool)."""
+        self._running = False
+        self._thread.join(timeout=timeout)
+        if self._thread.is_alive():
+            print(f"[ERROR] El escritor de eventos sigue trabajando tras {timeout:.0f}s; "
+                  f"{self._queue.qsize()} eventos en cola")
+        print(f"[INFO] Eventos: {self.stats()}")
+
+    def stats(self):
+        return {
+            "registrados": self.recorded,
+            "repetidos": self.deduplicated,
+            "descartados": self.dropped,
+            "escritos": self.written,
+            "reintentados": self.retried,
+            "fallidos": self.failed,
+            "en_cola": self._queue.qsize(),
+        }
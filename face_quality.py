@@ -0,0 +1,111 @@
+# face_quality.py
+"""
+Calidad de un recorte de rostro antes de calcular su descriptor.
+
+assess_face() mide, sobre el recorte reducido a 112x112 en gris:
+nitidez (varianza del Laplaciano), tamaño, brillo y contraste, y, si hay
+landmarks de RetinaFace, el giro horizontal (yaw) estimado con la posición
+de la nariz respecto de los ojos. Cuesta menos de un milisegundo, muy
+poco al lado de una inferencia de ArcFace.
+"""
+import math
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# score en [0, 1] (producto de las componentes); reason es None si el
+# recorte vale la pena, o el primer criterio que no cumple (clave ASCII:
+# también se usa en nombres de métricas)
+FaceQuality = namedtuple("FaceQuality", ["score", "sharpness", "size", "brightness", "contrast", "yaw", "reason"])
+
+MIN_FACE_SIZE = 60  # Lado menor del recorte, en píxeles
+MIN_SHARPNESS = 40.0  # Varianza del Laplaciano en 112x112
+MIN_BRIGHTNESS = 50.0
+MAX_BRIGHTNESS = 210.0
+MIN_CONTRAST = 20.0  # Desviación estándar del gris
+MAX_YAW = 35.0  # Grados
+
+# Mensajes para quien se está registrando
+QUALITY_MESSAGES = {
+    "pequeno": "Acércate más a la cámara.",
+    "borroso": "La imagen salió borrosa; quédate quieto un momento.",
+    "oscuro": "Hay muy poca luz sobre el rostro.",
+    "sobreexpuesto": "Hay demasiada luz sobre el rostro.",
+    "bajo_contraste": "El rostro tiene muy poco contraste; revisa la iluminación.",
+    "perfil": "Mira de frente a la cámara.",
+}
+
+
+def estimate_yaw(landmarks):
+    """
+    Giro horizontal aproximado (grados) a partir de los landmarks de
+    RetinaFace: desplazamiento de la nariz respecto del punto medio de los
+    ojos, relativo a media distancia entre ojos. None si faltan puntos.
+    """
+    if not landmarks:
+        return None
+    try:
+        right_eye, left_eye, nose = landmarks["right_eye"], landmarks["left_eye"], landmarks["nose"]
+    except KeyError:
+        return None
+    half_eyes = abs(left_eye[0] - right_eye[0]) / 2.0
+    if half_eyes <= 0:
+        return None
+    offset = (nose[0] - (left_eye[0] + right_eye[0]) / 2.0) / half_eyes
+    return math.degrees(math.asin(max(-1.0, min(1.0, offset))))
+
+
+def assess_face(crop, landmarks=None):
+    """
+    Evalúa si un recorte vale una inferencia de ArcFace.
+
+    Args:
+        crop: Recorte BGR del rostro.
+        landmarks: Dict de landmarks de RetinaFace (opcional).
+
+    Returns:
+        FaceQuality.
+    """
+    if crop is None or crop.ndim != 3 or crop.shape[0] == 0 or crop.shape[1] == 0:
+        return FaceQuality(0.0, 0.0, 0, 0.0, 0.0, None, "pequeno")
+
+    size = min(crop.shape[:2])
+    gray = cv2.resize(cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY), (112, 112), interpolation=cv2.INTER_AREA)
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+    brightness = float(gray.mean())
+    contrast = float(gray.std())
+    yaw = estimate_yaw(landmarks)
+
+    reason = None
+    if size < MIN_FACE_SIZE:
+        reason = "pequeno"
+    elif sharpness < MIN_SHARPNESS:
+        reason = "borroso"
+    elif brightness < MIN_BRIGHTNESS:
+        reason = "oscuro"
+    elif brightness > MAX_BRIGHTNESS:
+        reason = "sobreexpuesto"
+    elif contrast < MIN_CONTRAST:
+        reason = "bajo_contraste"
+    elif yaw is not None and abs(yaw) > MAX_YAW:
+        reason = "perfil"
+
+    # Cada componente vale 1 a partir del doble de su mínimo
+    components = [
+        min(1.0, size / (2.0 * MIN_FACE_SIZE)),
+        min(1.0, sharpness / (2.0 * MIN_SHARPNESS)),
+        min(1.0, contrast / (2.0 * MIN_CONTRAST)),
+        1.0 - min(1.0, abs(brightness - 128.0) / 128.0),
+    ]
+    if yaw is not None:
+        components.append(max(0.0, 1.0 - abs(yaw) / 90.0))
+    score = float(np.prod(components))
+    return FaceQuality(score, sharpness, size, brightness, contrast, yaw, reason)
+
+
+def landmarks_for(result, index):
+    """Landmarks de la caja index de un DetectionResult, si RetinaFace la aportó."""
+    if not result.landmarks or index >= len(result.landmarks):
+        return None
+    return result.landmarks[index]
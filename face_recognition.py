@@ -1,126 +1,745 @@
 # face_recognition.py
+import os
 import cv2
 import numpy as np
-from deepface import DeepFace
-from retinaface import RetinaFace
 import time
 import threading
+import queue
+from collections import namedtuple
+
+import metrics
+from tracker import iou_matrix
+from motion import MotionGate, padded_roi
+
+# Momento de referencia para medir el arranque (ventana y primer reconocimiento)
+STARTUP_TIME = time.time()
+_startup_marks = {}
+
+
+def mark_startup(event):
+    """Registra una sola vez cuánto tardó en ocurrir un evento desde el arranque."""
+    if event not in _startup_marks:
+        _startup_marks[event] = time.time() - STARTUP_TIME
+        print(f"[INFO] Arranque: {event} = {_startup_marks[event]:.3f}s")
+    return _startup_marks[event]
+
+
+def startup_marks():
+    """Segundos desde el arranque hasta cada evento registrado con mark_startup."""
+    return dict(_startup_marks)
+
+
+# Backends de descriptores. Todos reciben el lote ya preprocesado
+# (N x alto x ancho x 3, float32 en [0, 1]) y devuelven N x 512 sin normalizar.
+EMBEDDING_BACKENDS = ("tf", "onnx", "onnx-int8", "fake")
+EMBEDDING_BACKEND = os.environ.get("FACE_EMBEDDING_BACKEND", "tf")
+ONNX_MODEL_PATH = "arcface.onnx"
+ONNX_INT8_MODEL_PATH = "arcface.int8.onnx"
+
+
+class ModelLoader:
+    """
+    Carga diferida del backend de descriptores (ArcFace), RetinaFace y sus
+    dependencias.
+
+    start() lanza la carga en un hilo de fondo apenas arranca el proceso,
+    así la interfaz aparece sin esperar a TensorFlow. Primero se prepara
+    ArcFace en el backend elegido (con una inferencia de calentamiento); con
+    el backend "tf" también se construye RetinaFace, que usa el mismo
+    TensorFlow ya importado. Con los backends ONNX, RetinaFace (y con él
+    TensorFlow) se carga recién en el primer get_retinaface(), así que el
+    modo de detección "fast" nunca lo importa.
+    """
+
+    def __init__(self, backend_name=None):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._arcface_ready = threading.Event()
+        self._retinaface_ready = threading.Event()
+        self._arcface_error = None
+        self._retinaface_error = None
+        self.backend_name = backend_name or EMBEDDING_BACKEND
+        self.backend = None
+        self.retinaface = None
+        self._retinaface_lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load, daemon=True)
+                self._thread.start()
+
+    def _load(self):
+        try:
+            print(f"[INFO] Cargando modelo ArcFace (backend {self.backend_name})...")
+            backend = create_embedding_backend(self.backend_name)
+            # La primera inferencia construye el grafo; se hace aquí y no en el primer rostro
+            height, width = backend.input_size
+            backend.run(np.zeros((1, height, width, 3), dtype=np.float32))
+            self.backend = backend
+            mark_startup("arcface_listo")
+            print("[INFO] Modelo cargado.")
+        except Exception as e:
+            print(f"[ERROR] No se pudo cargar ArcFace: {e}")
+            self._arcface_error = e
+        finally:
+            self._arcface_ready.set()
+
+        if self.backend_name == "tf":
+            self._load_retinaface()
+
+    def _load_retinaface(self):
+        with self._retinaface_lock:
+            if self._retinaface_ready.is_set():
+                return
+            try:
+                from retinaface import RetinaFace
+                RetinaFace.build_model()
+                self.retinaface = RetinaFace
+                mark_startup("retinaface_listo")
+            except Exception as e:
+                print(f"[ERROR] No se pudo cargar RetinaFace: {e}")
+                self._retinaface_error = e
+            finally:
+                self._retinaface_ready.set()
+
+    def get_backend(self):
+        """Backend de descriptores; bloquea solo si todavía se está cargando."""
+        self.start()
+        self._arcface_ready.wait()
+        if self._arcface_error is not None:
+            raise RuntimeError(f"ArcFace no disponible: {self._arcface_error}")
+        return self.backend
+
+    def set_backend(self, name):
+        """
+        Cambia el backend de descriptores. Antes de start() solo cambia qué
+        se va a cargar; después carga el nuevo en el hilo que llama y lo
+        reemplaza al terminar.
+        """
+        with self._lock:
+            if self._thread is None:
+                self.backend_name = name
+                return
+        self._arcface_ready.wait()
+        backend = create_embedding_backend(name)
+        with self._lock:
+            self.backend, self.backend_name, self._arcface_error = backend, name, None
+
+    def get_retinaface(self):
+        """Módulo RetinaFace con el modelo ya construido (lo carga si hace falta)."""
+        self.start()
+        if self.backend_name == "tf":
+            # Lo está construyendo el hilo de carga, después de ArcFace
+            self._retinaface_ready.wait()
+        else:
+            self._load_retinaface()
+        if self._retinaface_error is not None:
+            raise RuntimeError(f"RetinaFace no disponible: {self._retinaface_error}")
+        return self.retinaface
+
+
+_loader = ModelLoader()
+
+
+def warm_up():
+    """Empieza a cargar los modelos en segundo plano. Se puede llamar varias veces."""
+    _loader.start()
+
+
+def _build_arcface():
+    from deepface import DeepFace
+    mark_startup("import_deepface")
+    return DeepFace.build_model("ArcFace")
+
+
+class KerasBackend:
+    """ArcFace de DeepFace sobre TensorFlow."""
+
+    name = "tf"
+
+    def __init__(self, model=None):
+        self.model = model if model is not None else _build_arcface()
+        self.keras_model = getattr(self.model, "model", self.model)
+        self.input_size = _model_input_size(self.model)
+
+    def run(self, batch):
+        return np.asarray(self.keras_model(batch, training=False), dtype=np.float32)
+
+
+class OnnxBackend:
+    """ArcFace exportado a ONNX (float32 o int8) sobre ONNX Runtime en CPU."""
+
+    def __init__(self, path, name="onnx", threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_size = (int(model_input.shape[1]), int(model_input.shape[2]))
+        self.name = name
+        self.path = path
+
+    def run(self, batch):
+        return self.session.run(None, {self.input_name: np.ascontiguousarray(batch, dtype=np.float32)})[0]
+
+
+def export_arcface_onnx(path=ONNX_MODEL_PATH, opset=13):
+    """Exporta el ArcFace de DeepFace a ONNX con tf2onnx (requiere TensorFlow)."""
+    import tensorflow as tf
+    import tf2onnx
+
+    model = _build_arcface()
+    keras_model = getattr(model, "model", model)
+    height, width = _model_input_size(model)
+    signature = (tf.TensorSpec((None, height, width, 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(keras_model, input_signature=signature, opset=opset, output_path=path)
+    print(f"[INFO] ArcFace exportado a {path}")
+    return path
+
+
+def quantize_onnx(source=ONNX_MODEL_PATH, target=ONNX_INT8_MODEL_PATH):
+    """Cuantización dinámica a int8 de los pesos del modelo ONNX."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+    print(f"[INFO] Modelo int8 en {target}")
+    return target
+
+
+def create_embedding_backend(name):
+    """
+    Crea un backend de descriptores: "tf", "onnx", "onnx-int8" o "fake".
+    Los modelos ONNX se exportan o cuantizan la primera vez si no existen.
+    """
+    if name == "tf":
+        return KerasBackend()
+    if name == "onnx":
+        if not os.path.exists(ONNX_MODEL_PATH):
+            export_arcface_onnx(ONNX_MODEL_PATH)
+        return OnnxBackend(ONNX_MODEL_PATH, name)
+    if name == "onnx-int8":
+        if not os.path.exists(ONNX_INT8_MODEL_PATH):
+            if not os.path.exists(ONNX_MODEL_PATH):
+                export_arcface_onnx(ONNX_MODEL_PATH)
+            quantize_onnx(ONNX_MODEL_PATH, ONNX_INT8_MODEL_PATH)
+        return OnnxBackend(ONNX_INT8_MODEL_PATH, name)
+    if name == "fake":
+        return FakeEmbedder()
+    raise ValueError(f"Backend de descriptores no soportado: {name} (opciones: {', '.join(EMBEDDING_BACKENDS)})")
+
+
+def set_embedding_backend(name):
+    """Elige el backend de descriptores (ver ModelLoader.set_backend)."""
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Backend de descriptores no soportado: {name}")
+    _loader.set_backend(name)
+
+
+# Resultado versionado de una detección: version crece con cada resultado
+# publicado, frame_time es la marca de tiempo del cuadro analizado
+DetectionResult = namedtuple("DetectionResult", ["version", "frame_time", "boxes", "source", "landmarks"])
+
+DETECTION_MODES = ("fast", "accurate", "fused")
+DEFAULT_DETECTION_MODE = "fused"
+
+
+class RetinaFaceWorker:
+    """
+    Hilo persistente que corre RetinaFace sobre el cuadro más reciente.
+
+    La cola tiene tamaño 1 y descarta el cuadro más viejo: si llega uno nuevo
+    mientras RetinaFace trabaja, el pendiente se reemplaza. Solo se encola
+    la porción superior del cuadro ya reducida a 320 px de ancho, así que
+    la copia es pequeña.
+    """
+
+    def __init__(self, input_width=320, top_fraction=0.6):
+        self.input_width = input_width
+        self.top_fraction = top_fraction
+        self._queue = queue.Queue(maxsize=1)
+        self._lock = threading.Lock()
+        self._result = None
+        self._version = 0
+        self.submitted = 0
+        self.dropped = 0
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0  # Tiempo acumulado procesando cuadros
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, frame_time):
+        height, width = frame.shape[:2]
+        top_portion_height = int(height * self.top_fraction)
+        new_height = int(self.input_width * top_portion_height / width)
+        small_frame = cv2.resize(frame[0:top_portion_height, :], (self.input_width, new_height))
+        item = (small_frame, frame_time, width / self.input_width, top_portion_height / new_height)
+
+        self.submitted += 1
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                    metrics.inc("retinaface_descartados")
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        while True:
+            small_frame, frame_time, scale_x, scale_y = self._queue.get()
+            start = time.perf_counter()
+            try:
+                img_rgb = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+                with metrics.timed("retinaface"):
+                    faces = _loader.get_retinaface().detect_faces(img_rgb)
+                boxes, landmarks = [], []
+                if isinstance(faces, dict):
+                    for key, face in faces.items():
+                        x1, y1, x2, y2 = face['facial_area']
+                        x1, x2 = int(x1 * scale_x), int(x2 * scale_x)
+                        y1, y2 = int(y1 * scale_y), int(y2 * scale_y)
+                        boxes.append((x1, y1, x2 - x1, y2 - y1))
+                        landmarks.append({name: (point[0] * scale_x, point[1] * scale_y)
+                                          for name, point in face.get('landmarks', {}).items()})
+                with self._lock:
+                    self._version += 1
+                    self._result = DetectionResult(self._version, frame_time, boxes, "retinaface", landmarks)
+                    self.processed += 1
+            except Exception as e:
+                print(f"[ERROR] RetinaFace worker: {e}")
+                self.errors += 1
+                metrics.inc("retinaface_errores")
+            finally:
+                with self._lock:
+                    self.busy_seconds += time.perf_counter() - start
+
+    def latest(self):
+        with self._lock:
+            return self._result
 
-print("[INFO] Cargando modelo ArcFace...")
-model = DeepFace.build_model("ArcFace")
-print("[INFO] Modelo cargado.")
 
 class MixedFaceDetector:
+    """
+    Detector combinado: Haar Cascade rápido en el hilo que llama y RetinaFace
+    preciso en un RetinaFaceWorker persistente.
+
+    Modos de detect():
+        "fast": solo Haar (con caché de cache_time segundos).
+        "accurate": último resultado de RetinaFace (Haar mientras no haya uno).
+        "fused": cajas de Haar corregidas con las de RetinaFace si el
+            resultado de RetinaFace no tiene más de max_retinaface_age segundos.
+    """
+
     def __init__(self):
         self._last_detection = None
         self._last_detection_time = 0
         self.cache_time = 1.0  # segundos para cachear detecciones
+        self.max_retinaface_age = 0.5
+        # RetinaFace no recibe cada cuadro: como mucho uno cada
+        # retinaface_interval si Haar volvió a correr (la escena cambió) y uno
+        # cada cache_time si se reutilizaron las cajas
+        self.retinaface_interval = 0.25
+        self._last_submit_time = None
+        self._last_submit_version = None
+        self.retinaface_skipped = 0
+        self.fusion_iou = 0.3
         self.frame_count = 0
         self.lock = threading.Lock()
+        self._version = 0
 
         # Detector rápido Haar Cascade
         self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
         if self.face_cascade.empty():
             raise IOError("No se pudo cargar haarcascade_frontalface_default.xml")
 
-        self._retinaface_thread = None
-        self._retinaface_result = None
-        self._retinaface_running = False
+        # Detección guiada por movimiento: sin movimiento se reutilizan las
+        # cajas, con cajas previas se busca solo en una ROI ampliada y cada
+        # full_scan_interval segundos se hace una pasada completa
+        self.motion_aware = True
+        self.motion_gate = MotionGate()
+        self.motion_threshold = 0.002  # Fracción de píxeles reducidos que cambiaron
+        self.roi_padding = 0.5
+        self.full_scan_interval = 2.0
+        self._last_full_scan_time = 0
+        self.haar_passes = {"completa": 0, "roi": 0, "sin_movimiento": 0}
 
-    def _detect_retinaface_async(self, frame):
-        """Función que corre RetinaFace en segundo plano"""
-        try:
-            height, width = frame.shape[:2]
-            top_portion_height = int(height * 0.6)
-            top_frame = frame[0:top_portion_height, :]
+        self._retinaface_worker = None
+        # Cuántas veces cada detector aportó la caja final en modo "fused"
+        self.wins = {"haar": 0, "retinaface": 0, "ambos": 0}
 
-            new_width = 320
-            new_height = int(new_width * top_portion_height / width)
-            small_frame = cv2.resize(top_frame, (new_width, new_height))
-            img_rgb = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+    def _get_worker(self):
+        if self._retinaface_worker is None:
+            self._retinaface_worker = RetinaFaceWorker()
+        return self._retinaface_worker
 
-            faces = RetinaFace.detect_faces(img_rgb)
-            boxes = []
-            if isinstance(faces, dict):
-                for key, face in faces.items():
-                    x1, y1, x2, y2 = face['facial_area']
-                    scale_x = width / new_width
-                    scale_y = top_portion_height / new_height
-
-                    x1 = int(x1 * scale_x)
-                    y1 = int(y1 * scale_y)
-                    x2 = int(x2 * scale_x)
-                    y2 = int(y2 * scale_y)
-
-                    boxes.append((x1, y1, x2 - x1, y2 - y1))
-            with self.lock:
-                self._retinaface_result = boxes
-                self._retinaface_running = False
-                self._last_detection = boxes
-                self._last_detection_time = time.time()
-            print(f"[INFO] RetinaFace async: detectadas {len(boxes)} caras.")
-        except Exception as e:
-            print(f"[ERROR] RetinaFace async detection: {e}")
-            with self.lock:
-                self._retinaface_running = False
+    def retinaface_busy_seconds(self):
+        """Segundos acumulados del hilo de RetinaFace (para el presupuesto de CPU)."""
+        worker = self._retinaface_worker
+        if worker is None:
+            return 0.0
+        with worker._lock:
+            return worker.busy_seconds
+
+    def _haar(self, gray):
+        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(40, 40))
+        return [(int(x), int(y), int(w), int(h)) for (x, y, w, h) in faces]
+
+    def _detect_haar(self, frame, frame_time):
+        if self.motion_aware:
+            return self._detect_haar_motion(frame, frame_time)
+
+        with self.lock:
+            cached = self._last_detection
+            if cached is not None and (frame_time - self._last_detection_time) < self.cache_time:
+                # Retornar cache inmediatamente
+                return cached
+
+        self.frame_count += 1
+        with metrics.timed("haar"):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            boxes = self._haar(gray)
+        self.haar_passes["completa"] += 1
+        metrics.inc("haar_completa")
+        return self._publish_haar(boxes, frame_time)
 
-    def detect_faces(self, frame):
-        current_time = time.time()
+    def _detect_haar_motion(self, frame, frame_time):
+        """
+        Haar guiado por movimiento sobre el cuadro reducido:
+        - sin movimiento y con pasada completa reciente: se reutilizan las cajas;
+        - movimiento solo cerca de las cajas previas: se busca en sus ROI;
+        - movimiento en otra zona, sin cajas previas o vencido
+          full_scan_interval: pasada completa.
+        """
+        mask = self.motion_gate.update(frame)
         with self.lock:
-            cache_valid = (self._last_detection is not None) and ((current_time - self._last_detection_time) < self.cache_time)
+            previous = self._last_detection
+        scan_due = previous is None or mask is None or (frame_time - self._last_full_scan_time) >= self.full_scan_interval
 
-        if cache_valid:
-            # Retornar cache inmediatamente
-            return self._last_detection
+        if not scan_due and float(mask.mean()) < self.motion_threshold:
+            self.haar_passes["sin_movimiento"] += 1
+            metrics.inc("haar_sin_movimiento")
+            return previous
 
         self.frame_count += 1
-        start = time.time()
+        start = time.perf_counter()
+        wall = time.time()
+        outside = 1.0
+        if not scan_due and previous.boxes:
+            outside = self.motion_gate.motion_outside(mask, previous.boxes, self.roi_padding)
 
-        # Siempre detectar rápido con Haar Cascade y devolverlo rápido
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(40, 40))
-        boxes = [(x, y, w, h) for (x, y, w, h) in faces]
-        method = "Haar Cascade"
+        if scan_due or outside >= self.motion_threshold:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            boxes = self._haar(gray)
+            self._last_full_scan_time = frame_time
+            method = "completa"
+        else:
+            boxes = []
+            for box in previous.boxes:
+                x, y, w, h = padded_roi(box, self.roi_padding, frame.shape)
+                gray = cv2.cvtColor(frame[y:y + h, x:x + w], cv2.COLOR_BGR2GRAY)
+                boxes.extend((bx + x, by + y, bw, bh) for (bx, by, bw, bh) in self._haar(gray))
+            boxes = _dedupe_boxes(boxes)
+            method = "roi"
+        self.haar_passes[method] += 1
 
-        elapsed = time.time() - start
-        print(f"[INFO] detect_faces ({method}): tiempo = {elapsed:.3f}s, faces detectadas: {len(boxes)}")
+        metrics.observe("haar", time.perf_counter() - start, wall)
+        metrics.inc(f"haar_{method}")
+        return self._publish_haar(boxes, frame_time)
 
-        # Lanzar RetinaFace async solo si no está ya corriendo
+    def _publish_haar(self, boxes, frame_time):
         with self.lock:
-            if not self._retinaface_running:
-                self._retinaface_running = True
-                frame_copy = frame.copy()
-                self._retinaface_thread = threading.Thread(target=self._detect_retinaface_async, args=(frame_copy,))
-                self._retinaface_thread.daemon = True
-                self._retinaface_thread.start()
-
-            # Actualizar cache con detección rápida para respuestas rápidas
-            self._last_detection = boxes
-            self._last_detection_time = current_time
-
-        return boxes
-
-def get_face_descriptor(image):
-    try:
-        start = time.time()
-        result = DeepFace.represent(
-            img_path=image,
-            model_name="ArcFace",
-            detector_backend="skip",
-            enforce_detection=False
-        )
-        embedding = result[0]['embedding']
-        embedding = np.array(embedding)
-        embedding_norm = embedding / np.linalg.norm(embedding)
-        elapsed = time.time() - start
-        print(f"[INFO] get_face_descriptor: tiempo de extracción = {elapsed:.3f} segundos")
-        return embedding_norm
-    except Exception as e:
-        print(f"[Error get_face_descriptor] {e}")
-        return np.zeros(512)
-
-# Instancia global
-_detector_instance = MixedFaceDetector()
-
-def detect_faces(frame):
-    return _detector_instance.detect_faces(frame)
+            self._version += 1
+            result = DetectionResult(self._version, frame_time, boxes, "haar", None)
+            self._last_detection = result
+            self._last_detection_time = frame_time
+        return result
+
+    def detect(self, frame, mode=DEFAULT_DETECTION_MODE, frame_time=None):
+        """
+        Detecta rostros en el cuadro.
+
+        Args:
+            frame: Imagen BGR.
+            mode: "fast", "accurate" o "fused".
+            frame_time: Marca de tiempo del cuadro (por defecto, ahora).
+
+        Returns:
+            DetectionResult con las cajas (x, y, w, h) y el detector de origen.
+        """
+        if mode not in DETECTION_MODES:
+            raise ValueError(f"Modo de detección no soportado: {mode}")
+        frame_time = time.time() if frame_time is None else frame_time
+
+        haar = self._detect_haar(frame, frame_time)
+        if mode == "fast":
+            return haar
+
+        worker = self._get_worker()
+        if self._should_submit(haar, frame_time):
+            # El cuadro nuevo reemplaza al pendiente si RetinaFace sigue ocupado
+            worker.submit(frame, frame_time)
+            self._last_submit_time = frame_time
+            self._last_submit_version = haar.version
+        else:
+            self.retinaface_skipped += 1
+        retina = worker.latest()
+
+        if mode == "accurate":
+            return retina if retina is not None else haar
+
+        if retina is None or frame_time - retina.frame_time > self.max_retinaface_age:
+            self.wins["haar"] += len(haar.boxes)
+            return haar
+        return self._fuse(haar, retina)
+
+    def _should_submit(self, haar, frame_time):
+        if self._last_submit_time is None:
+            return True
+        elapsed = frame_time - self._last_submit_time
+        if haar.version != self._last_submit_version:
+            return elapsed >= self.retinaface_interval
+        return elapsed >= self.cache_time
+
+    def _fuse(self, haar, retina):
+        """
+        Une ambas detecciones: si se solapan gana la caja de RetinaFace.
+        Las cajas de RetinaFace van primero, alineadas con sus landmarks.
+        """
+        boxes = list(retina.boxes)
+        matched_retina = set()
+        if haar.boxes and retina.boxes:
+            ious = iou_matrix(haar.boxes, retina.boxes)
+            for hi, box in enumerate(haar.boxes):
+                ri = int(np.argmax(ious[hi]))
+                if ious[hi, ri] >= self.fusion_iou:
+                    matched_retina.add(ri)
+                else:
+                    boxes.append(box)
+                    self.wins["haar"] += 1
+        else:
+            boxes.extend(haar.boxes)
+            self.wins["haar"] += len(haar.boxes)
+        self.wins["ambos"] += len(matched_retina)
+        self.wins["retinaface"] += len(retina.boxes) - len(matched_retina)
+        version = max(haar.version, retina.version)
+        return DetectionResult(version, haar.frame_time, boxes, "fused", retina.landmarks)
+
+    def detect_faces(self, frame, mode=DEFAULT_DETECTION_MODE):
+        return self.detect(frame, mode).boxes
+
+    def stats(self):
+        worker = self._retinaface_worker
+        return {
+            "ganadores": dict(self.wins),
+            "pasadas_haar": dict(self.haar_passes),
+            "retinaface_enviados": worker.submitted if worker else 0,
+            "retinaface_omitidos": self.retinaface_skipped,
+            "retinaface_descartados": worker.dropped if worker else 0,
+            "retinaface_procesados": worker.processed if worker else 0,
+            "retinaface_errores": worker.errors if worker else 0,
+            "retinaface_ocupado_s": round(self.retinaface_busy_seconds(), 2),
+        }
+
+def _dedupe_boxes(boxes, iou_threshold=0.5):
+    """Elimina cajas repetidas (ROI solapadas encuentran el mismo rostro)."""
+    kept = []
+    for box in boxes:
+        if not kept or iou_matrix([box], kept).max() < iou_threshold:
+            kept.append(box)
+    return kept
+
+
+# Resultado de get_face_descriptors: matriz (N x 512) normalizada, máscara de
+# filas válidas y {índice: mensaje} para los recortes que fallaron
+DescriptorBatch = namedtuple("DescriptorBatch", ["embeddings", "valid", "errors"])
+
+EMBEDDING_DIM = 512
+EMBEDDING_BATCH_SIZE = 32
+
+
+def _model_input_size(model):
+    """Tamaño (alto, ancho) de entrada de ArcFace según el modelo cargado."""
+    shape = getattr(model, "input_shape", None) or getattr(model.model, "input_shape")
+    if len(shape) == 4:
+        shape = shape[1:3]
+    return int(shape[0]), int(shape[1])
+
+
+def _preprocess_crop(image, target_size):
+    """
+    Mismo preprocesamiento que DeepFace.represent con detector "skip":
+    redimensiona manteniendo la proporción, rellena con ceros hasta el
+    tamaño del modelo y escala a [0, 1].
+    """
+    if image is None or image.ndim != 3 or image.shape[0] == 0 or image.shape[1] == 0:
+        raise ValueError("recorte vacío o sin 3 canales")
+    factor = min(target_size[0] / image.shape[0], target_size[1] / image.shape[1])
+    dsize = (max(1, int(image.shape[1] * factor)), max(1, int(image.shape[0] * factor)))
+    resized = cv2.resize(image, dsize)
+    diff_0 = target_size[0] - resized.shape[0]
+    diff_1 = target_size[1] - resized.shape[1]
+    padded = np.pad(resized, ((diff_0 // 2, diff_0 - diff_0 // 2), (diff_1 // 2, diff_1 - diff_1 // 2), (0, 0)), "constant")
+    if padded.shape[0:2] != target_size:
+        padded = cv2.resize(padded, (target_size[1], target_size[0]))
+    padded = padded.astype(np.float32)
+    if padded.max() > 1:
+        padded /= 255.0
+    return padded
+
+
+def _embed_crops(backend, crops, batch_size=EMBEDDING_BATCH_SIZE):
+    """
+    Preprocesa los recortes y los pasa por backend.run() en lotes. La
+    normalización final es la misma para todos los backends, así que el
+    matcher no distingue cuál produjo cada descriptor.
+    """
+    start = time.perf_counter()
+    wall = time.time()
+    n = len(crops)
+    embeddings = np.zeros((n, EMBEDDING_DIM), dtype=np.float32)
+    valid = np.zeros(n, dtype=bool)
+    errors = {}
+    target_size = backend.input_size
+
+    for batch_start in range(0, n, batch_size):
+        indices, tensors = [], []
+        for i in range(batch_start, min(n, batch_start + batch_size)):
+            try:
+                tensors.append(_preprocess_crop(crops[i], target_size))
+                indices.append(i)
+            except Exception as e:
+                errors[i] = f"preprocesamiento: {e}"
+        if not tensors:
+            continue
+
+        try:
+            output = np.asarray(backend.run(np.stack(tensors)), dtype=np.float32)
+        except Exception as e:
+            for i in indices:
+                errors[i] = f"inferencia: {e}"
+            continue
+
+        norms = np.linalg.norm(output, axis=1)
+        for row, i in enumerate(indices):
+            if norms[row] > 0 and np.isfinite(norms[row]):
+                embeddings[i] = output[row] / norms[row]
+                valid[i] = True
+            else:
+                errors[i] = "descriptor con norma nula"
+
+    metrics.observe("embedding", time.perf_counter() - start, wall)
+    metrics.inc("descriptores", n)
+    metrics.inc("descriptores_fallidos", len(errors))
+    return DescriptorBatch(embeddings, valid, errors)
+
+
+def get_face_descriptors(crops, batch_size=EMBEDDING_BATCH_SIZE):
+    """
+    Extrae los descriptores de varios recortes con una sola inferencia por lote
+    sobre el backend de descriptores ya cargado (ver set_embedding_backend).
+
+    Args:
+        crops: Lista de imágenes BGR (recortes de rostro).
+        batch_size: Máximo de recortes por pasada del modelo.
+
+    Returns:
+        DescriptorBatch con los descriptores normalizados; las filas que
+        fallaron quedan en cero, con valid=False y su error en errors.
+    """
+    return _embed_crops(_loader.get_backend(), crops, batch_size)
+
+
+class FakeEmbedder:
+    """
+    Sustituto de ArcFace para pruebas y benchmarks sin descargar modelos.
+
+    Reduce cada recorte a 16x16 en gris y lo proyecta a 512 dimensiones con
+    una matriz aleatoria fija: el mismo recorte da siempre el mismo
+    descriptor e imágenes parecidas dan descriptores parecidos. Se puede
+    llamar con la misma interfaz que get_face_descriptors o usar como
+    backend "fake".
+    """
+
+    name = "fake"
+    input_size = (112, 112)
+
+    def __init__(self, dim=EMBEDDING_DIM, seed=0, delay=0.0):
+        self.dim = dim
+        self.delay = delay  # Segundos simulados de inferencia por lote
+        self.projection = np.random.default_rng(seed).standard_normal((256, dim)).astype(np.float32)
+
+    def run(self, batch):
+        small = np.stack([cv2.resize(image.mean(axis=2), (16, 16), interpolation=cv2.INTER_AREA) for image in batch])
+        if self.delay:
+            time.sleep(self.delay)
+        return (small.reshape(len(batch), -1) - 0.5) @ self.projection
+
+    def __call__(self, crops, batch_size=EMBEDDING_BATCH_SIZE):
+        return _embed_crops(self, crops, batch_size)
+
+
+# Instancia global, creada en la primera detección
+_detector_instance = None
+_detector_lock = threading.Lock()
+
+
+def get_detector():
+    global _detector_instance
+    with _detector_lock:
+        if _detector_instance is None:
+            _detector_instance = MixedFaceDetector()
+        return _detector_instance
+
+
+def detect_faces(frame, mode=DEFAULT_DETECTION_MODE):
+    return get_detector().detect_faces(frame, mode)
+
+
+# Un CascadeClassifier por hilo: OpenCV no garantiza que sea seguro usar el
+# mismo desde varios a la vez (p. ej. los hilos de verification_service)
+_still_local = threading.local()
+
+
+def _still_cascade():
+    cascade = getattr(_still_local, "cascade", None)
+    if cascade is None:
+        cascade = _still_local.cascade = cv2.CascadeClassifier(
+            cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    return cascade
+
+
+def detect_faces_still(image, accurate=False):
+    """
+    Detección para imágenes sueltas (fotos, cuadros de video no consecutivos):
+    sin caché, sin filtro de movimiento y, con accurate=True, con RetinaFace
+    síncrono sobre la imagen completa.
+
+    Returns:
+        Lista de cajas (x, y, w, h), la más grande primero.
+    """
+    if accurate:
+        height, width = image.shape[:2]
+        scale = min(1.0, 640 / max(height, width))
+        small = cv2.resize(image, (int(width * scale), int(height * scale))) if scale < 1.0 else image
+        with metrics.timed("retinaface"):
+            faces = _loader.get_retinaface().detect_faces(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        boxes = []
+        if isinstance(faces, dict):
+            for face in faces.values():
+                x1, y1, x2, y2 = (int(v / scale) for v in face['facial_area'])
+                boxes.append((x1, y1, x2 - x1, y2 - y1))
+    else:
+        cascade = _still_cascade()
+        with metrics.timed("haar"):
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            faces = cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(40, 40))
+        boxes = [(int(x), int(y), int(w), int(h)) for (x, y, w, h) in faces]
+    return sorted(boxes, key=lambda b: b[2] * b[3], reverse=True)
@@ -0,0 +1,338 @@
+# gallery.py
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# Resultado de una búsqueda en la galería
+Match = namedtuple("Match", ["persona_id", "name", "score", "distance"])
+
+
+def score_to_distance(score):
+    """
+    Convierte similitud coseno en distancia L2 entre vectores de norma 1.
+    Permite seguir usando los umbrales históricos (0.75, 0.9) sobre distancias.
+    """
+    return np.sqrt(np.maximum(0.0, 2.0 - 2.0 * np.asarray(score, dtype=np.float32)))
+
+
+def distance_to_score(distance):
+    """Inversa de score_to_distance: d = sqrt(2 - 2s) -> s = 1 - d²/2."""
+    return 1.0 - (float(distance) ** 2) / 2.0
+
+
+class FaceGallery:
+    """
+    Galería de descriptores faciales en una matriz float32 contigua.
+
+    Cada fila es un descriptor normalizado (norma 1) y tiene en paralelo el id
+    de la plantilla (codificaciones_faciales.id), el persona_id y el nombre.
+    La comparación es un único producto matricial: al ser vectores unitarios,
+    la similitud coseno equivale al producto punto.
+    """
+
+    def __init__(self, dim=512, capacity=0):
+        self.dim = dim
+        self.lock = threading.RLock()
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._template_ids = np.full(capacity, -1, dtype=np.int64)
+        self._persona_ids = np.zeros(capacity, dtype=np.int64)
+        self._names = np.empty(capacity, dtype=object)
+        self._size = 0
+        self._groups = None  # Caché de agrupación por persona_id
+        self.index = None  # Índice ANN opcional (ann_index.IVFIndex)
+        self.index_path = None
+
+    @classmethod
+    def from_rows(cls, rows, dim=512):
+        """
+        Construye la galería a partir de filas (template_id, persona_id, nombre, descriptor).
+        """
+        rows = list(rows)
+        gallery = cls(dim=dim, capacity=len(rows))
+        if rows:
+            template_ids, persona_ids, names, descriptors = zip(*rows)
+            gallery.add_many(np.asarray(descriptors, dtype=np.float32), persona_ids, names, template_ids)
+        return gallery
+
+    @classmethod
+    def from_arrays(cls, matrix, persona_ids, names, template_ids=None, normalized=True):
+        """
+        Envuelve matrices ya existentes sin copiarlas (por ejemplo un np.memmap).
+        Solo se copian si luego se agregan filas y hace falta crecer.
+        """
+        gallery = cls(dim=matrix.shape[1], capacity=0)
+        if not normalized:
+            matrix = _normalize_rows(np.asarray(matrix, dtype=np.float32))
+        gallery._matrix = matrix
+        gallery._persona_ids = np.asarray(persona_ids, dtype=np.int64)
+        gallery._names = np.asarray(names, dtype=object)
+        if template_ids is None:
+            template_ids = np.full(len(matrix), -1, dtype=np.int64)
+        gallery._template_ids = np.asarray(template_ids, dtype=np.int64)
+        gallery._size = len(matrix)
+        return gallery
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def matrix(self):
+        return self._matrix[:self._size]
+
+    @property
+    def persona_ids(self):
+        return self._persona_ids[:self._size]
+
+    @property
+    def names(self):
+        return self._names[:self._size]
+
+    @property
+    def template_ids(self):
+        return self._template_ids[:self._size]
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        capacity = len(self._matrix)
+        if needed <= capacity and self._matrix.flags.writeable:
+            return
+        new_capacity = max(needed, 2 * capacity, 64)
+        matrix = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        template_ids = np.full(new_capacity, -1, dtype=np.int64)
+        template_ids[:self._size] = self._template_ids[:self._size]
+        persona_ids = np.zeros(new_capacity, dtype=np.int64)
+        persona_ids[:self._size] = self._persona_ids[:self._size]
+        names = np.empty(new_capacity, dtype=object)
+        names[:self._size] = self._names[:self._size]
+        self._matrix, self._template_ids = matrix, template_ids
+        self._persona_ids, self._names = persona_ids, names
+
+    def add(self, persona_id, name, descriptor, template_id=-1):
+        """Agrega una plantilla. El descriptor se normaliza antes de guardarse."""
+        descriptor = np.asarray(descriptor, dtype=np.float32).reshape(1, self.dim)
+        self.add_many(descriptor, [persona_id], [name], [template_id])
+
+    def add_many(self, descriptors, persona_ids, names, template_ids=None):
+        """
+        Agrega varias plantillas de una vez. Las que traen un template_id que
+        ya está en la galería (o repetido en el mismo lote) se omiten, así el
+        alta local y la notificación de la BD pueden llegar en cualquier orden.
+
+        Returns:
+            Cantidad de plantillas agregadas.
+        """
+        descriptors = _normalize_rows(np.asarray(descriptors, dtype=np.float32).reshape(-1, self.dim))
+        n = len(descriptors)
+        if n == 0:
+            return 0
+        template_ids = np.full(n, -1, dtype=np.int64) if template_ids is None else np.asarray(template_ids, dtype=np.int64)
+        persona_ids = np.asarray(persona_ids)
+        names = list(names)
+        with self.lock:
+            _, first = np.unique(template_ids, return_index=True)
+            unique = np.zeros(n, dtype=bool)
+            unique[first] = True
+            # Las plantillas sin id (-1) siempre se agregan
+            keep = (template_ids < 0) | (unique & ~np.isin(template_ids, self.template_ids))
+            if not keep.all():
+                descriptors, persona_ids, template_ids = descriptors[keep], persona_ids[keep], template_ids[keep]
+                names = [name for name, k in zip(names, keep) if k]
+                n = len(descriptors)
+                if n == 0:
+                    return 0
+            self._reserve(n)
+            start, end = self._size, self._size + n
+            self._matrix[start:end] = descriptors
+            self._persona_ids[start:end] = persona_ids
+            self._names[start:end] = list(names)
+            self._template_ids[start:end] = template_ids
+            self._size = end
+            self._groups = None
+            if self.index is not None:
+                self.index.add(descriptors, template_ids)
+        return n
+
+    def remove(self, template_ids):
+        """
+        Quita las plantillas con esos ids (y sus filas del índice ANN).
+
+        Returns:
+            Cantidad de filas quitadas.
+        """
+        template_ids = np.fromiter(template_ids, dtype=np.int64)
+        with self.lock:
+            keep = ~np.isin(self.template_ids, template_ids)
+            removed = int(self._size - keep.sum())
+            if removed == 0:
+                return 0
+            # La indexación con máscara copia: también sirve si la matriz era un memmap
+            self._matrix = self.matrix[keep]
+            self._template_ids = self.template_ids[keep]
+            self._persona_ids = self.persona_ids[keep]
+            self._names = self.names[keep]
+            self._size = len(self._matrix)
+            self._groups = None
+            if self.index is not None:
+                self.index.remove_rows(keep)
+        return removed
+
+    def rename(self, persona_id, name):
+        """Actualiza el nombre de todas las plantillas de una persona."""
+        with self.lock:
+            rows = np.flatnonzero(self.persona_ids == persona_id)
+            if len(rows):
+                if not self._names.flags.writeable:
+                    self._names = self._names.copy()
+                self._names[rows] = name
+                self._groups = None
+
+    def attach_index(self, index, path=None):
+        """
+        Usa un índice ANN para las búsquedas. El índice debe cubrir exactamente
+        las filas actuales; las filas que se agreguen luego se insertan en él.
+        """
+        with self.lock:
+            if len(index) != self._size:
+                raise ValueError("El índice ANN no corresponde a la galería")
+            self.index = index
+            self.index_path = path
+
+    def save_index(self):
+        """Persiste el índice ANN adjunto, si existe."""
+        with self.lock:
+            if self.index is not None and self.index_path:
+                self.index.save(self.index_path)
+
+    def _get_groups(self):
+        """
+        Agrupa las filas por persona_id. Se calcula una vez y se invalida al
+        modificar la galería.
+        """
+        if self._groups is None:
+            pids = self.persona_ids
+            order = np.argsort(pids, kind="stable")
+            sorted_pids = pids[order]
+            starts = np.flatnonzero(np.r_[True, sorted_pids[1:] != sorted_pids[:-1]]) if len(pids) else np.array([], dtype=np.int64)
+            counts = np.diff(np.r_[starts, len(pids)])
+            unique_pids = sorted_pids[starts]
+            group_names = self.names[order[starts]] if len(pids) else np.empty(0, dtype=object)
+            self._groups = (order, starts, counts, unique_pids, group_names)
+        return self._groups
+
+    def scores(self, descriptors):
+        """Similitud coseno (N consultas x M plantillas) con un solo producto matricial."""
+        queries = _normalize_rows(np.asarray(descriptors, dtype=np.float32).reshape(-1, self.dim))
+        return queries @ self.matrix.T
+
+    def search(self, descriptor, k=5, aggregate="max"):
+        """
+        Devuelve los k mejores candidatos para un descriptor.
+
+        Args:
+            descriptor: Vector de consulta (se normaliza).
+            k: Número de candidatos a devolver.
+            aggregate: "max", "mean" o None. Con "max"/"mean" se combinan todas
+                las plantillas de una misma persona en un solo puntaje.
+
+        Returns:
+            Lista de Match ordenada de mayor a menor similitud.
+        """
+        return self.search_batch(descriptor, k=k, aggregate=aggregate)[0]
+
+    def search_batch(self, descriptors, k=5, aggregate="max"):
+        """Igual que search pero para varias consultas a la vez."""
+        with self.lock:
+            queries = np.asarray(descriptors, dtype=np.float32).reshape(-1, self.dim)
+            if self._size == 0:
+                return [[] for _ in range(len(queries))]
+            if self.index is not None:
+                return [self._search_index(q, k, aggregate) for q in queries]
+            scores = self.scores(queries)
+
+            if aggregate is None:
+                ids, names = self.persona_ids, self.names
+            else:
+                order, starts, counts, ids, names = self._get_groups()
+                sorted_scores = scores[:, order]
+                if aggregate == "max":
+                    scores = np.maximum.reduceat(sorted_scores, starts, axis=1)
+                elif aggregate == "mean":
+                    scores = np.add.reduceat(sorted_scores, starts, axis=1) / counts
+                else:
+                    raise ValueError(f"Agregación no soportada: {aggregate}")
+
+            return [_top_k(row, ids, names, k) for row in scores]
+
+    def _search_index(self, query, k, aggregate):
+        """
+        Búsqueda aproximada: solo se puntúan las filas candidatas del índice.
+        Con "mean" se puntúan todas las plantillas de cada persona candidata,
+        no solo las de las celdas exploradas, para que el promedio sea el
+        mismo que en la búsqueda exacta.
+        """
+        query = _normalize_rows(query.reshape(1, self.dim))[0]
+        rows = self.index.candidates(query)
+        if len(rows) == 0:
+            return []
+        if aggregate == "mean":
+            rows = self._person_rows(np.unique(self._persona_ids[rows]))
+        scores = self._matrix[rows] @ query
+        return _top_k_candidates(scores, self._persona_ids[rows], self._names[rows], k, aggregate)
+
+    def _person_rows(self, persona_ids):
+        """Todas las filas de esas personas (persona_ids ordenados y sin repetir)."""
+        order, starts, counts, unique_pids, _ = self._get_groups()
+        groups = np.searchsorted(unique_pids, persona_ids)
+        group_counts = counts[groups]
+        # Posición dentro de cada grupo: 0..count-1, concatenadas
+        offsets = np.arange(group_counts.sum()) - np.repeat(np.cumsum(group_counts) - group_counts, group_counts)
+        return order[np.repeat(starts[groups], group_counts) + offsets]
+
+    def best_match(self, descriptor, threshold=0.75, aggregate="max"):
+        """
+        Mejor candidato si su distancia L2 está bajo el umbral; si no, None.
+        """
+        matches = self.search(descriptor, k=1, aggregate=aggregate)
+        if matches and matches[0].distance < threshold:
+            return matches[0]
+        return None
+
+
+def _top_k(scores, ids, names, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return []
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(-scores[top])]
+    distances = score_to_distance(scores[top])
+    return [Match(int(ids[i]), names[i], float(scores[i]), float(d)) for i, d in zip(top, distances)]
+
+
+def _top_k_candidates(scores, ids, names, k, aggregate="max"):
+    """
+    _top_k sobre un subconjunto de filas candidatas, combinando antes las
+    filas de una misma persona con aggregate ("max", "mean" o None).
+    """
+    if aggregate is not None:
+        ids, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+        names = names[first]
+        if aggregate == "max":
+            grouped = np.full(len(ids), -np.inf, dtype=np.float32)
+            np.maximum.at(grouped, inverse, scores)
+        elif aggregate == "mean":
+            grouped = np.bincount(inverse, weights=scores) / np.bincount(inverse)
+        else:
+            raise ValueError(f"Agregación no soportada: {aggregate}")
+        scores = grouped
+    return _top_k(scores, ids, names, k)
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
@@ -0,0 +1,340 @@
+# gallery_compact.py
+"""
+Galería compacta para el reconocimiento.
+
+- consolidate_templates(): reduce las plantillas de cada persona a unos
+  pocos representantes: el centroide más las plantillas que quedan lejos de
+  él (otra pose, lentes, otra iluminación).
+- CompactGallery: guarda las filas en float16 o int8 (con una escala por
+  fila) y recorre toda la galería con ellas; solo los mejores candidatos se
+  vuelven a puntuar en float32 con la matriz original, que puede ser el
+  memmap del snapshot y no ocupar RAM. maybe_compact_gallery guarda la
+  matriz consolidada en un archivo (RESCORE_FILE) y la abre como memmap,
+  así en RAM solo quedan las filas compactas.
+
+Uso (informe de precisión contra la galería completa):
+    python gallery_compact.py                     # galería de la base de datos
+    python gallery_compact.py --synthetic 5000    # población sintética
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from gallery import FaceGallery, _normalize_rows, _top_k_candidates, score_to_distance
+from gallery_snapshot import DEFAULT_SNAPSHOT_DIR
+
+STORAGE_FORMATS = ("f16", "int8")
+# Formato de la galería del reconocimiento en vivo: None (float32 completa), "f16" o "int8"
+GALLERY_STORAGE = None
+MAX_REPRESENTATIVES = 3
+OUTLIER_DISTANCE = 0.6  # Distancia L2 al representante más cercano para guardar otra plantilla
+RESCORE_CANDIDATES = 32
+SCAN_BLOCK = 8192  # Filas que se convierten a float32 a la vez durante el barrido
+RESCORE_FILE = "compact_rescore.npy"  # Matriz float32 de reescritura, junto al snapshot
+
+
+def consolidate_templates(gallery, max_representatives=MAX_REPRESENTATIVES, outlier_distance=OUTLIER_DISTANCE):
+    """
+    Una galería con a lo sumo max_representatives filas por persona.
+
+    El primer representante es el centroide normalizado de sus plantillas
+    (template_id -1). Luego, mientras queden plantillas a más de
+    outlier_distance de todos los representantes elegidos, se agrega la más
+    lejana (con su template_id original).
+    """
+    with gallery.lock:
+        matrix = gallery.matrix
+        template_ids = gallery.template_ids
+        order, starts, counts, persona_ids, names = gallery._get_groups()
+
+    reps, rep_pids, rep_names, rep_tids = [], [], [], []
+    for start, count, pid, name in zip(starts, counts, persona_ids, names):
+        rows_idx = order[start:start + count]
+        rows = np.asarray(matrix[rows_idx], dtype=np.float32)
+        if count == 1:
+            chosen, chosen_ids = [rows[0]], [template_ids[rows_idx[0]]]
+        else:
+            centroid = _normalize_rows(rows.mean(axis=0, keepdims=True))[0]
+            chosen, chosen_ids = [centroid], [-1]
+            nearest = score_to_distance(rows @ centroid)
+            while len(chosen) < max_representatives:
+                far = int(np.argmax(nearest))
+                if nearest[far] < outlier_distance:
+                    break
+                chosen.append(rows[far])
+                chosen_ids.append(template_ids[rows_idx[far]])
+                nearest = np.minimum(nearest, score_to_distance(rows @ rows[far]))
+        reps.extend(chosen)
+        rep_tids.extend(chosen_ids)
+        rep_pids.extend([pid] * len(chosen))
+        rep_names.extend([name] * len(chosen))
+
+    dim = matrix.shape[1]
+    return FaceGallery.from_arrays(np.asarray(reps, dtype=np.float32).reshape(-1, dim), rep_pids,
+                                   rep_names, rep_tids)
+
+
+class CompactGallery:
+    """
+    Galería de solo lectura con las filas en float16 o int8 para el barrido
+    y reescritura en float32 de los rescore mejores candidatos. Tiene la
+    misma interfaz de búsqueda que FaceGallery (search, search_batch,
+    best_match).
+    """
+
+    def __init__(self, gallery, storage="f16", rescore=RESCORE_CANDIDATES):
+        if storage not in STORAGE_FORMATS:
+            raise ValueError(f"Formato de galería no soportado: {storage}")
+        self.lock = threading.RLock()
+        self.storage = storage
+        self.rescore = rescore
+        with gallery.lock:
+            self.full = gallery.matrix  # float32; si viene de un memmap queda en disco
+            self.persona_ids = np.array(gallery.persona_ids)
+            self.names = np.array(gallery.names, dtype=object)
+            self.template_ids = np.array(gallery.template_ids)
+        self.dim = self.full.shape[1] if self.full.ndim == 2 else gallery.dim
+
+        self.scales = None
+        if storage == "f16":
+            self.codes = np.empty(self.full.shape, dtype=np.float16)
+            for start in range(0, len(self.full), SCAN_BLOCK):
+                self.codes[start:start + SCAN_BLOCK] = self.full[start:start + SCAN_BLOCK]
+        else:
+            self.codes = np.empty(self.full.shape, dtype=np.int8)
+            self.scales = np.empty(len(self.full), dtype=np.float32)
+            for start in range(0, len(self.full), SCAN_BLOCK):
+                block = np.asarray(self.full[start:start + SCAN_BLOCK], dtype=np.float32)
+                scale = np.abs(block).max(axis=1) / 127.0
+                scale[scale == 0] = 1.0
+                self.scales[start:start + len(block)] = scale
+                self.codes[start:start + len(block)] = np.round(block / scale[:, None])
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        """Memoria de la copia compacta (sin la matriz float32 de reescritura)."""
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @property
+    def resident_nbytes(self):
+        """
+        Memoria en RAM de toda la galería: filas compactas, ids, nombres y la
+        matriz float32 de reescritura si no es un memmap (de este solo quedan
+        en RAM las páginas que se leen al reescribir).
+        """
+        total = self.nbytes + self.persona_ids.nbytes + self.template_ids.nbytes + self.names.nbytes
+        if not isinstance(self.full, np.memmap):
+            total += self.full.nbytes
+        return total
+
+    def coarse_scores(self, queries):
+        """Similitud aproximada (N consultas x M filas) a partir de las filas compactas."""
+        scores = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), SCAN_BLOCK):
+            block = self.codes[start:start + SCAN_BLOCK].astype(np.float32)
+            part = queries @ block.T
+            if self.scales is not None:
+                part *= self.scales[start:start + len(block)]
+            scores[:, start:start + len(block)] = part
+        return scores
+
+    def search(self, descriptor, k=5, aggregate="max"):
+        return self.search_batch(descriptor, k=k, aggregate=aggregate)[0]
+
+    def search_batch(self, descriptors, k=5, aggregate="max"):
+        queries = _normalize_rows(np.asarray(descriptors, dtype=np.float32).reshape(-1, self.dim))
+        if len(self.codes) == 0:
+            return [[] for _ in range(len(queries))]
+        with self.lock:
+            coarse = self.coarse_scores(queries)
+            r = min(max(self.rescore, k), len(self.codes))
+            results = []
+            for query, row in zip(queries, coarse):
+                candidates = np.argpartition(-row, r - 1)[:r] if r < len(row) else np.arange(len(row))
+                candidates.sort()  # Acceso ordenado: menos páginas del memmap
+                exact = np.asarray(self.full[candidates], dtype=np.float32) @ query
+                results.append(_top_k_candidates(exact, self.persona_ids[candidates], self.names[candidates],
+                                                 k, aggregate))
+            return results
+
+    def best_match(self, descriptor, threshold=0.75, aggregate="max"):
+        matches = self.search(descriptor, k=1, aggregate=aggregate)
+        if matches and matches[0].distance < threshold:
+            return matches[0]
+        return None
+
+
+def spill_to_memmap(gallery, path):
+    """
+    Misma galería con la matriz escrita en path y abierta como memmap de
+    solo lectura; la copia en RAM se puede liberar. Se escribe en un archivo
+    temporal y se reemplaza, así otro proceso con el archivo anterior abierto
+    no ve una matriz a medio escribir.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp.npy"
+    with gallery.lock:
+        np.save(tmp, np.ascontiguousarray(gallery.matrix, dtype=np.float32))
+        persona_ids, names, template_ids = gallery.persona_ids, gallery.names, gallery.template_ids
+    try:
+        os.replace(tmp, path)
+    except PermissionError:
+        # Windows no deja reemplazar un archivo que otro proceso tiene mapeado
+        path = tmp
+    return FaceGallery.from_arrays(np.load(path, mmap_mode="r"), persona_ids, names, template_ids)
+
+
+def maybe_compact_gallery(gallery, storage=GALLERY_STORAGE, max_representatives=MAX_REPRESENTATIVES,
+                          rescore_path=os.path.join(DEFAULT_SNAPSHOT_DIR, RESCORE_FILE)):
+    """
+    Galería para el reconocimiento según GALLERY_STORAGE: la misma si es
+    None; si no, consolidada (con max_representatives > 0) y compacta, con
+    la matriz float32 de reescritura en un memmap.
+    """
+    if storage is None:
+        return gallery
+    start = time.time()
+    original = len(gallery)
+    if max_representatives:
+        gallery = consolidate_templates(gallery, max_representatives)
+    if not isinstance(gallery.matrix, np.memmap):
+        gallery = spill_to_memmap(gallery, rescore_path)
+    compact = CompactGallery(gallery, storage)
+    print(f"[INFO] Galería compacta ({storage}): {original} plantillas -> {len(compact)} filas, "
+          f"{compact.resident_nbytes / 1e6:.1f} MB en RAM (filas compactas {compact.nbytes / 1e6:.1f} MB; "
+          f"reescritura f32 {compact.full.nbytes / 1e6:.1f} MB en memmap) en {time.time() - start:.2f}s")
+    return compact
+
+
+def holdout_split(gallery, seed=0):
+    """
+    Separa una plantilla por persona (de las que tienen al menos dos) como
+    consulta; el resto queda como galería.
+
+    Returns:
+        (galeria, consultas, persona_ids de las consultas)
+    """
+    rng = np.random.default_rng(seed)
+    order, starts, counts, persona_ids, _ = gallery._get_groups()
+    held = np.array([order[s + rng.integers(c)] for s, c in zip(starts, counts) if c > 1], dtype=np.int64)
+    keep = np.ones(len(gallery), dtype=bool)
+    keep[held] = False
+    rest = FaceGallery.from_arrays(np.asarray(gallery.matrix[keep]), gallery.persona_ids[keep],
+                                   gallery.names[keep], gallery.template_ids[keep])
+    return rest, np.asarray(gallery.matrix[held], dtype=np.float32), gallery.persona_ids[held]
+
+
+def evaluate(gallery, queries, true_ids, reference=None, threshold=0.75):
+    """
+    Precisión de una galería sobre consultas de identidad conocida.
+
+    Returns:
+        Dict con top1 (la persona más parecida es la correcta), aceptados
+        (correctos bajo el umbral), falsos (aceptados con otra persona),
+        ms por consulta y, si se da reference, acuerdo del top 1 con ella.
+    """
+    start = time.perf_counter()
+    matches = gallery.search_batch(queries, k=1)
+    elapsed = time.perf_counter() - start
+    top = np.array([m[0].persona_id if m else -1 for m in matches])
+    distances = np.array([m[0].distance if m else np.inf for m in matches])
+    accepted = distances < threshold
+    result = {
+        "top1": float(np.mean(top == true_ids)),
+        "aceptados": float(np.mean(accepted & (top == true_ids))),
+        "falsos": float(np.mean(accepted & (top != true_ids))),
+        "ms_por_consulta": elapsed / max(1, len(queries)) * 1000,
+        "_top": top,
+    }
+    if reference is not None:
+        result["acuerdo"] = float(np.mean(top == reference["_top"]))
+    return result
+
+
+def synthetic_population(people, min_templates=2, max_templates=12, noise=0.6, pose_fraction=0.2, dim=512, seed=0):
+    """
+    Población sintética: cada persona tiene un centro y plantillas ruidosas;
+    una fracción viene de una segunda "pose" desplazada, para que haya
+    plantillas atípicas.
+    """
+    rng = np.random.default_rng(seed)
+    centers = _normalize_rows(rng.standard_normal((people, dim)).astype(np.float32))
+    poses = _normalize_rows(centers + 0.8 * _normalize_rows(rng.standard_normal((people, dim)).astype(np.float32)))
+    counts = rng.integers(min_templates, max_templates + 1, people)
+    pids = np.repeat(np.arange(people), counts)
+    base = np.where((rng.random(len(pids)) < pose_fraction)[:, None], poses[pids], centers[pids])
+    matrix = base + noise * rng.standard_normal((len(pids), dim)).astype(np.float32) / np.sqrt(dim)
+    return FaceGallery.from_arrays(matrix, pids, np.asarray([f"Persona {p}" for p in pids], dtype=object),
+                                   np.arange(len(pids)), normalized=False)
+
+
+def _gallery_nbytes(gallery):
+    return gallery.matrix.nbytes + gallery.persona_ids.nbytes + gallery.template_ids.nbytes + gallery.names.nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precisión de la galería consolidada y compacta")
+    parser.add_argument("--synthetic", type=int, default=0, help="Personas sintéticas en lugar de la BD")
+    parser.add_argument("--max-representatives", type=int, default=MAX_REPRESENTATIVES)
+    parser.add_argument("--outlier-distance", type=float, default=OUTLIER_DISTANCE)
+    parser.add_argument("--rescore", type=int, default=RESCORE_CANDIDATES)
+    parser.add_argument("--threshold", type=float, default=0.75)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        gallery = synthetic_population(args.synthetic)
+    else:
+        from database import connect_db, release_db, load_faces_from_db
+        conn, c = connect_db()
+        try:
+            gallery = load_faces_from_db(c)
+        finally:
+            release_db(conn)
+
+    full, queries, true_ids = holdout_split(gallery)
+    if len(queries) == 0:
+        print("[ERROR] Ninguna persona tiene dos plantillas: no hay consultas para evaluar")
+        return
+    consolidated = consolidate_templates(full, args.max_representatives, args.outlier_distance)
+    # Memoria en RAM tal como la usaría el reconocimiento: las variantes
+    # compactas reescriben desde un memmap (ver maybe_compact_gallery)
+    variants = [
+        ("completa f32", full, _gallery_nbytes(full)),
+        ("consolidada f32", consolidated, _gallery_nbytes(consolidated)),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in STORAGE_FORMATS:
+            for label, source in (("completa", full), ("consolidada", consolidated)):
+                spilled = spill_to_memmap(source, os.path.join(tmp, f"{label}_{storage}.npy"))
+                compact = CompactGallery(spilled, storage, args.rescore)
+                variants.append((f"{label} {storage}", compact, compact.resident_nbytes))
+        _report(full, queries, true_ids, variants, args.threshold)
+
+
+def _report(full, queries, true_ids, variants, threshold):
+    """Imprime precisión y memoria en RAM de cada variante contra la primera."""
+    print(f"[INFO] {len(full)} plantillas de {len(np.unique(full.persona_ids))} personas, "
+          f"{len(queries)} consultas (una plantilla retenida por persona)")
+    reference = None
+    for label, candidate, nbytes in variants:
+        result = evaluate(candidate, queries, true_ids, reference, threshold)
+        if reference is None:
+            reference = result
+        print(f"[INFO] {label:18s} filas {len(candidate):8d}  memoria {nbytes / 1e6:8.2f} MB  "
+              f"top1 {result['top1']:.4f} ({result['top1'] - reference['top1']:+.4f})  "
+              f"aceptados {result['aceptados']:.4f} ({result['aceptados'] - reference['aceptados']:+.4f})  "
+              f"falsos {result['falsos']:.4f}  acuerdo {result.get('acuerdo', 1.0):.4f}  "
+              f"{result['ms_por_consulta']:.3f} ms/consulta")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# gallery_listener.py
+"""
+Actualización en vivo de la galería con LISTEN/NOTIFY de PostgreSQL.
+
+Los disparadores de biometria.sql avisan en el canal galeria_cambios cada
+alta o baja en codificaciones_faciales y cada cambio de nombre en personas.
+GalleryListener escucha en una conexión propia (fuera del pool, en
+autocommit) y aplica los cambios sobre la galería en memoria:
+
+- altas: trae solo esas filas (una consulta por ráfaga) y las agrega con
+  add_many, que omite las que ya están (porque este mismo proceso las
+  registró), aunque el alta local llegue después de la notificación.
+- bajas: FaceGallery.remove, que también quita las filas del índice ANN.
+- nombres: FaceGallery.rename.
+
+Al (re)conectarse compara los ids de la base con los de la galería, así que
+los cambios ocurridos sin conexión también se aplican.
+"""
+import json
+import select
+import threading
+import time
+
+import numpy as np
+import psycopg2
+
+from database import DB_CONFIG, PreparedConnection, fetch_person_names, fetch_template_ids, fetch_templates
+
+GALLERY_CHANNEL = "galeria_cambios"
+POLL_INTERVAL = 0.5  # Segundos entre revisiones de self.running
+COALESCE_WINDOW = 0.05  # Espera para juntar los avisos de una misma ráfaga
+MAX_BACKOFF = 30.0
+
+
+class GalleryListener:
+    def __init__(self, gallery, channel=GALLERY_CHANNEL, poll_interval=POLL_INTERVAL,
+                 coalesce_window=COALESCE_WINDOW, on_change=None):
+        """
+        Args:
+            gallery: FaceGallery a mantener al día.
+            channel: Canal de NOTIFY.
+            on_change: Función opcional llamada tras aplicar cada lote de cambios.
+        """
+        self.gallery = gallery
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.coalesce_window = coalesce_window
+        self.on_change = on_change
+        self.added = 0
+        self.removed = 0
+        self.renamed = 0
+        self.errors = 0
+        self.running = False
+        self._conn = None
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        return {"agregadas": self.added, "quitadas": self.removed,
+                "renombradas": self.renamed, "errores": self.errors}
+
+    def _connect(self):
+        conn = psycopg2.connect(connection_factory=PreparedConnection, **DB_CONFIG)
+        conn.autocommit = True
+        c = conn.cursor()
+        c.execute(f"LISTEN {self.channel}")
+        return conn, c
+
+    def _run(self):
+        backoff = 1.0
+        while self.running:
+            conn = None
+            try:
+                conn, c = self._connect()
+                # Lo que haya cambiado antes de empezar a escuchar
+                self._catch_up(c)
+                backoff = 1.0
+                self._listen(conn, c)
+            except Exception as e:
+                self.errors += 1
+                print(f"[ERROR] Escucha de cambios de la galería: {e}; reintento en {backoff:.0f}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _listen(self, conn, c):
+        while self.running:
+            if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                continue
+            conn.poll()
+            # Un registro masivo llega como muchos avisos: se aplican juntos
+            time.sleep(self.coalesce_window)
+            conn.poll()
+            notifies = conn.notifies[:]
+            del conn.notifies[:]
+            if notifies:
+                self._apply_notifies(c, notifies)
+
+    def _apply_notifies(self, c, notifies):
+        inserted, deleted, renamed = set(), set(), set()
+        for notify in notifies:
+            try:
+                change = json.loads(notify.payload)
+            except ValueError:
+                continue
+            if change.get("tabla") == "personas":
+                renamed.add(change["id"])
+            elif change.get("op") == "DELETE":
+                inserted.discard(change["id"])
+                deleted.add(change["id"])
+            else:
+                inserted.add(change["id"])
+        self.apply_changes(c, inserted, deleted, renamed)
+
+    def _catch_up(self, c):
+        db_ids = fetch_template_ids(c)
+        with self.gallery.lock:
+            current = self.gallery.template_ids.copy()
+        current = current[current >= 0]
+        inserted = db_ids[~np.isin(db_ids, current)]
+        deleted = current[~np.isin(current, db_ids)]
+        self.apply_changes(c, inserted.tolist(), deleted.tolist(), ())
+
+    def apply_changes(self, c, inserted, deleted, renamed):
+        """
+        Aplica altas (ids de codificaciones_faciales), bajas y cambios de
+        nombre (ids de personas). La consulta a la base se hace fuera del lock
+        de la galería; solo la copia de filas lo toma.
+        """
+        if not inserted and not deleted and not renamed:
+            return
+        start = time.perf_counter()
+        added = removed = 0
+
+        if inserted:
+            ids = np.asarray(sorted(inserted), dtype=np.int64)
+            # Filtro previo para no traer filas que ya están; add_many vuelve a
+            # comprobarlo bajo el lock por si el alta local llega entre medio
+            with self.gallery.lock:
+                ids = ids[~np.isin(ids, self.gallery.template_ids)]
+            if len(ids):
+                template_ids, persona_ids, names, matrix = fetch_templates(c, ids=ids)
+                if len(template_ids):
+                    added = self.gallery.add_many(matrix, persona_ids, names, template_ids)
+
+        if deleted:
+            removed = self.gallery.remove(deleted)
+
+        for persona_id, name in (fetch_person_names(c, renamed) if renamed else []):
+            self.gallery.rename(persona_id, name)
+
+        self.added += added
+        self.removed += removed
+        self.renamed += len(renamed)
+        if added or removed or renamed:
+            print(f"[INFO] Galería actualizada: +{added} -{removed} plantillas, "
+                  f"{len(renamed)} nombres ({(time.perf_counter() - start) * 1000:.1f} ms)")
+            if self.on_change is not None:
+                self.on_change()
@@ -0,0 +1,270 @@
+# gallery_snapshot.py
+import glob
+import os
+import time
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from gallery import FaceGallery, _normalize_rows
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Directorio local con la copia binaria de la galería
+DEFAULT_SNAPSHOT_DIR = "gallery_cache"
+EMBEDDINGS_FILE = "embeddings.{generation}.npy"
+INDEX_FILE = "index.npz"
+LOCK_FILE = ".lock"
+REPLACE_RETRIES = 20  # Intentos de os.replace mientras otro proceso lee el archivo (Windows)
+
+
+def _lock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+    lock_file.seek(0)
+    while True:
+        try:
+            # LK_LOCK reintenta durante 10 s y luego falla: se sigue esperando
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            pass
+
+
+def _unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _replace(src, dst):
+    """os.replace con reintentos: en Windows falla si otro proceso tiene dst abierto."""
+    for attempt in range(REPLACE_RETRIES):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == REPLACE_RETRIES - 1:
+                raise
+            time.sleep(0.05)
+
+
+class GallerySnapshot:
+    """
+    Copia local de codificaciones_faciales ya normalizada.
+
+    - embeddings.<generación>.npy: matriz float32 con capacidad de sobra,
+      abierta con np.load(mmap_mode="r"); varios procesos comparten las
+      mismas páginas.
+    - index.npz (el manifiesto): generación vigente, ids de plantilla,
+      persona_id, nombres, número de filas válidas y último
+      codificaciones_faciales.id sincronizado.
+
+    Al sincronizar solo se piden a PostgreSQL las filas con id mayor al
+    último guardado, y se escriben al final de la matriz. Si no caben, o hay
+    que reconstruir, se escribe una generación nueva en otro archivo: el
+    que otros procesos tienen mapeado nunca se reemplaza (en Windows no se
+    puede). index.npz se reemplaza al final, así que un lector nunca ve
+    filas a medio escribir; las generaciones viejas se borran cuando nadie
+    las tiene abiertas. Los nombres se vuelven a leer de personas en cada
+    sincronización, para que un cambio de nombre llegue al snapshot.
+    """
+
+    def __init__(self, directory=DEFAULT_SNAPSHOT_DIR, dim=512):
+        self.directory = directory
+        self.dim = dim
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.lock_path = os.path.join(directory, LOCK_FILE)
+
+    def _embeddings_path(self, generation):
+        return os.path.join(self.directory, EMBEDDINGS_FILE.format(generation=generation))
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return None
+        with np.load(self.index_path) as data:
+            # Snapshot de antes de las generaciones: se reconstruye
+            if "generation" not in data:
+                return None
+            generation = int(data["generation"])
+            if not os.path.exists(self._embeddings_path(generation)):
+                return None
+            return {
+                "generation": generation,
+                "template_ids": data["template_ids"],
+                "persona_ids": data["persona_ids"],
+                "names": data["names"],
+                "count": int(data["count"]),
+                "last_id": int(data["last_id"]),
+            }
+
+    def _write_index(self, generation, template_ids, persona_ids, names, count, last_id):
+        tmp_path = self.index_path + ".tmp.npz"
+        np.savez(tmp_path, generation=generation, template_ids=template_ids, persona_ids=persona_ids,
+                 names=np.asarray(names, dtype=str), count=count, last_id=last_id)
+        _replace(tmp_path, self.index_path)
+
+    def _write_rows(self, generation, start, rows, fresh=False):
+        """
+        Escribe filas en la matriz de esa generación. Si no caben, o con
+        fresh=True, las escribe (con las start primeras) en una generación
+        nueva con el doble de capacidad, sin tocar la que leen otros procesos.
+
+        Returns:
+            La generación que quedó con las filas.
+        """
+        needed = start + len(rows)
+        path = self._embeddings_path(generation) if generation is not None else None
+        exists = path is not None and os.path.exists(path)
+        capacity = np.load(path, mmap_mode="r").shape[0] if exists else 0
+
+        if fresh or not exists or needed > capacity:
+            new_generation = self._next_generation()
+            new_capacity = max(needed, 2 * capacity, 1024)
+            grown = open_memmap(self._embeddings_path(new_generation), mode="w+", dtype=np.float32,
+                                shape=(new_capacity, self.dim))
+            if start:
+                grown[:start] = np.load(path, mmap_mode="r")[:start]
+            grown[start:needed] = rows
+            grown.flush()
+            del grown
+            return new_generation
+        # Filas más allá de count: los lectores todavía no las ven
+        matrix = np.load(path, mmap_mode="r+")
+        matrix[start:needed] = rows
+        matrix.flush()
+        del matrix
+        return generation
+
+    def _generations(self):
+        """Generaciones con archivo en el directorio (incluidas las que no se pudieron borrar)."""
+        prefix, suffix = EMBEDDINGS_FILE.split("{generation}")
+        found = []
+        for path in glob.glob(os.path.join(self.directory, EMBEDDINGS_FILE.format(generation="*"))):
+            number = os.path.basename(path)[len(prefix):-len(suffix)]
+            if number.isdigit():
+                found.append(int(number))
+        return found
+
+    def _next_generation(self):
+        # Nunca se reutiliza un archivo que algún proceso puede tener mapeado
+        return max(self._generations(), default=-1) + 1
+
+    def _remove_old_generations(self, generation):
+        """Borra las generaciones anteriores que ya nadie tiene abiertas."""
+        for old in self._generations():
+            if old == generation:
+                continue
+            try:
+                os.remove(self._embeddings_path(old))
+            except OSError:
+                # Windows: otro proceso todavía la tiene mapeada; se borra en otra sincronización
+                pass
+
+    def sync(self, c):
+        """
+        Trae de la base de datos solo las filas nuevas y las agrega al snapshot.
+        Si se borraron plantillas desde la última sincronización, reconstruye;
+        si cambió el nombre de alguna persona, lo actualiza.
+
+        Args:
+            c: Cursor de la base de datos.
+
+        Returns:
+            Número de filas nuevas escritas.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, "a+") as lock_file:
+            _lock(lock_file)
+            try:
+                return self._sync_locked(c)
+            finally:
+                _unlock(lock_file)
+
+    def _sync_locked(self, c):
+        state = self._read_index()
+        rebuild = state is None
+        if state is not None:
+            # Si faltan filas con id <= last_id es que hubo borrados
+            c.execute("SELECT COUNT(*) FROM codificaciones_faciales WHERE id <= %s", (state["last_id"],))
+            if c.fetchone()[0] != state["count"]:
+                print("[INFO] Snapshot de galería desactualizado (borrados), se reconstruye.")
+                state = None
+                rebuild = True
+        if state is None:
+            state = {
+                "generation": None,
+                "template_ids": np.zeros(0, dtype=np.int64),
+                "persona_ids": np.zeros(0, dtype=np.int64),
+                "names": np.zeros(0, dtype=str),
+                "count": 0,
+                "last_id": 0,
+            }
+
+        # Importación diferida: database importa este módulo
+        from database import fetch_person_names, fetch_templates
+        new_ids, new_pids, new_names, descriptors = fetch_templates(c, state["last_id"])
+
+        count, generation = state["count"], state["generation"]
+        template_ids, persona_ids, names = state["template_ids"], state["persona_ids"], state["names"]
+        renamed = 0
+        if count:
+            current = dict(fetch_person_names(c, np.unique(persona_ids)))
+            latest = np.asarray([current.get(int(pid), name) for pid, name in zip(persona_ids, names)], dtype=str)
+            renamed = int((latest != names).sum())
+            names = latest
+        if not len(new_ids) and not renamed and count > 0:
+            return 0
+
+        if len(new_ids) or rebuild:
+            generation = self._write_rows(generation, count, _normalize_rows(descriptors), fresh=rebuild)
+            template_ids = np.concatenate([template_ids, new_ids])
+            persona_ids = np.concatenate([persona_ids, new_pids])
+            names = np.concatenate([names, np.asarray(new_names, dtype=str)])
+            count += len(new_ids)
+
+        last_id = int(template_ids[-1]) if count else 0
+        self._write_index(generation, template_ids, persona_ids, names, count, last_id)
+        self._remove_old_generations(generation)
+        return len(new_ids)
+
+    def load(self):
+        """
+        Abre el snapshot en solo lectura como FaceGallery, sin copiar la matriz.
+        Devuelve None si todavía no existe.
+        """
+        state = self._read_index()
+        if state is None:
+            return None
+        matrix = np.load(self._embeddings_path(state["generation"]), mmap_mode="r")[:state["count"]]
+        return FaceGallery.from_arrays(matrix, state["persona_ids"], state["names"].astype(object),
+                                       state["template_ids"])
+
+
+def load_gallery_snapshot(c, directory=DEFAULT_SNAPSHOT_DIR):
+    """
+    Sincroniza el snapshot local con la base de datos y lo devuelve como galería.
+
+    Args:
+        c: Cursor de la base de datos.
+        directory: Directorio del snapshot.
+
+    Returns:
+        FaceGallery respaldada por un memmap de solo lectura.
+    """
+    start = time.time()
+    snapshot = GallerySnapshot(directory)
+    new_rows = snapshot.sync(c)
+    gallery = snapshot.load()
+    elapsed = time.time() - start
+    print(f"[INFO] Galería cargada desde snapshot: {len(gallery)} plantillas, "
+          f"{new_rows} nuevas, tiempo = {elapsed:.3f}s")
+    return gallery
@@ -1,5 +1,8 @@
 # main.py
+import face_recognition
 from selection import SelectionWindow
 
 if __name__ == "__main__":
+    # Los modelos se cargan en segundo plano mientras aparece la ventana
+    face_recognition.warm_up()
     SelectionWindow()
@@ -0,0 +1,351 @@
+# metrics.py
+"""
+Métricas por etapa del pipeline de reconocimiento.
+
+- Contadores: inc("nombre").
+- Histogramas de latencia por etapa (captura, haar, retinaface, embedding,
+  matching, db, render): observe(etapa, segundos) o with timed(etapa).
+- Traza por cuadro: begin_frame(id) ... end_frame(id, motivo_descarte);
+  las etapas medidas en el mismo hilo entre ambas llamadas quedan
+  anotadas con su inicio y fin. Se guardan las últimas TRACE_SIZE.
+
+Está apagado por defecto: con FACE_METRICS=1 (o enable()) empieza a
+registrar. Apagado, cada llamada retorna enseguida sin tomar locks ni
+reservar memoria.
+
+MetricsExporter escribe periódicamente un volcado JSON o en formato de
+texto de Prometheus a un archivo y, opcionalmente, lo sirve por HTTP.
+"""
+import bisect
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Límites superiores de los buckets de latencia, en segundos
+BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+TRACE_SIZE = 500
+
+_enabled = os.environ.get("FACE_METRICS", "0") not in ("", "0")
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_open_frames = {}
+_traces = deque(maxlen=TRACE_SIZE)
+_local = threading.local()
+
+
+class Histogram:
+    """Histograma de latencias con buckets fijos (BUCKETS) más uno de desborde."""
+
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Cuantil aproximado: límite superior del bucket que lo contiene, o
+        None si cae en el de desborde (más de BUCKETS[-1] segundos).
+        """
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            cumulative += n
+            if cumulative >= target:
+                return BUCKETS[i] if i < len(BUCKETS) else None
+        return None
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _open_frames.clear()
+        _traces.clear()
+
+
+def inc(name, n=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def observe(stage, seconds, start=None, frame_id=None):
+    """
+    Registra la duración de una etapa. Si hay un cuadro abierto (el de
+    frame_id o el que abrió este hilo con begin_frame) se anota en su traza.
+    """
+    if not _enabled:
+        return
+    if frame_id is None:
+        frame_id = getattr(_local, "frame_id", None)
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.observe(seconds)
+        trace = _open_frames.get(frame_id) if frame_id is not None else None
+        if trace is not None:
+            end = time.time() if start is None else start + seconds
+            trace["etapas"].append((stage, round(end - seconds, 6), round(end, 6)))
+
+
+class _Timer:
+    __slots__ = ("stage", "frame_id", "start", "wall")
+
+    def __init__(self, stage, frame_id):
+        self.stage = stage
+        self.frame_id = frame_id
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start, self.wall, self.frame_id)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(stage, frame_id=None):
+    """Context manager que mide una etapa; apagado no hace nada."""
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(stage, frame_id)
+
+
+def begin_frame(frame_id, captured_at=None):
+    """Abre la traza de un cuadro; las etapas medidas en este hilo se le anotan."""
+    if not _enabled:
+        return
+    _local.frame_id = frame_id
+    with _lock:
+        _open_frames[frame_id] = {"cuadro": frame_id, "captura": captured_at, "inicio": time.time(),
+                                  "etapas": [], "descartado": None}
+
+
+def end_frame(frame_id, drop_reason=None):
+    """
+    Cierra la traza de un cuadro. drop_reason indica por qué no se procesó
+    completo (por ejemplo "intervalo_deteccion"); se cuenta como
+    cuadros_descartados_<motivo>.
+    """
+    if not _enabled:
+        return
+    if getattr(_local, "frame_id", None) == frame_id:
+        _local.frame_id = None
+    now = time.time()
+    with _lock:
+        trace = _open_frames.pop(frame_id, None)
+        if trace is None:
+            trace = {"cuadro": frame_id, "captura": None, "inicio": now, "etapas": [], "descartado": None}
+        trace["fin"] = now
+        if trace["captura"] is not None:
+            trace["latencia_ms"] = round((now - trace["captura"]) * 1000, 3)
+        if drop_reason is not None:
+            trace["descartado"] = drop_reason
+            key = f"cuadros_descartados_{drop_reason}"
+            _counters[key] = _counters.get(key, 0) + 1
+        else:
+            _counters["cuadros_procesados"] = _counters.get("cuadros_procesados", 0) + 1
+        _traces.append(trace)
+
+
+def drop_frame(frame_id, reason):
+    """Traza de un cuadro que no llegó a procesarse."""
+    end_frame(frame_id, reason)
+
+
+def snapshot(traces=True):
+    """Estado actual como dict serializable a JSON."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {stage: (list(h.counts), h.total, h.count, h.quantile(0.5), h.quantile(0.99))
+                      for stage, h in _histograms.items()}
+        frames = list(_traces) if traces else []
+    return {
+        "fecha": time.time(),
+        "contadores": counters,
+        "etapas": {
+            stage: {
+                "cantidad": count,
+                "total_s": round(total, 6),
+                "media_ms": round(total / count * 1000, 3) if count else 0.0,
+                "p50_ms": None if p50 is None else p50 * 1000,
+                "p99_ms": None if p99 is None else p99 * 1000,
+                "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], counts)),
+            }
+            for stage, (counts, total, count, p50, p99) in histograms.items()
+        },
+        "cuadros": frames,
+    }
+
+
+def snapshot_json():
+    """snapshot() como JSON estricto: un NaN o infinito falla en lugar de escribir Infinity."""
+    return json.dumps(snapshot(), ensure_ascii=False, allow_nan=False)
+
+
+def _metric_name(name):
+    """Nombre válido para Prometheus: sin tildes y solo [a-zA-Z0-9_:]."""
+    ascii_name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", ascii_name)
+
+
+def prometheus_text():
+    """Volcado en formato de texto de Prometheus."""
+    data = snapshot(traces=False)
+    lines = []
+    counters = {}
+    for name, value in data["contadores"].items():
+        # Dos nombres pueden quedar iguales al sanearlos: se suman
+        name = _metric_name(name)
+        counters[name] = counters.get(name, 0) + value
+    for name, value in sorted(counters.items()):
+        lines.append(f"# TYPE face_{name}_total counter")
+        lines.append(f"face_{name}_total {value}")
+    lines.append("# TYPE face_stage_seconds histogram")
+    for stage, h in sorted(data["etapas"].items()):
+        cumulative = 0
+        for le, n in h["buckets"].items():
+            cumulative += n
+            lines.append(f'face_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+        lines.append(f'face_stage_seconds_sum{{stage="{stage}"}} {h["total_s"]}')
+        lines.append(f'face_stage_seconds_count{{stage="{stage}"}} {h["cantidad"]}')
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """
+    Vuelca las métricas cada interval segundos a path (JSON o texto de
+    Prometheus según fmt) y, si se indica port, las sirve por HTTP en
+    /metrics (Prometheus) y /metrics.json.
+    """
+
+    def __init__(self, path="metrics.json", interval=10.0, fmt="json", port=None, host="127.0.0.1"):
+        self.path = path
+        self.interval = interval
+        self.fmt = fmt
+        self.port = port
+        self.host = host
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        if self.port:
+            self._server = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def dump(self):
+        if not self.path:
+            return
+        text = prometheus_text() if self.fmt == "prometheus" else snapshot_json()
+        # Escritura atómica: quien lea el archivo nunca ve un volcado a medias
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.dump()
+            except Exception as e:
+                print(f"[ERROR] No se pudieron volcar las métricas: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        self.dump()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = prometheus_text(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = snapshot_json(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_exporter_from_env():
+    """
+    Arranca un MetricsExporter según las variables de entorno si las
+    métricas están encendidas:
+        FACE_METRICS_FILE (metrics.json), FACE_METRICS_FORMAT (json|prometheus),
+        FACE_METRICS_INTERVAL (10 s), FACE_METRICS_PORT (sin HTTP si no se define).
+
+    Returns:
+        El exportador, o None si las métricas están apagadas.
+    """
+    if not _enabled:
+        return None
+    port = os.environ.get("FACE_METRICS_PORT")
+    return MetricsExporter(
+        path=os.environ.get("FACE_METRICS_FILE", "metrics.json"),
+        interval=float(os.environ.get("FACE_METRICS_INTERVAL", "10")),
+        fmt=os.environ.get("FACE_METRICS_FORMAT", "json"),
+        port=int(port) if port else None,
+    ).start()
@@ -0,0 +1,73 @@
+# motion.py
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    Detector de movimiento barato por diferencia de cuadros.
+
+    Trabaja sobre una versión reducida y en gris del cuadro (160 px de ancho
+    por defecto) y devuelve la máscara de píxeles que cambiaron respecto al
+    cuadro anterior. Sirve para decidir si hace falta volver a detectar.
+    """
+
+    def __init__(self, width=160, pixel_threshold=25, blur=5):
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.blur = blur
+        self._prev = None
+        self._diff = None
+        self.scale = 1.0
+
+    def update(self, frame):
+        """
+        Calcula la máscara de movimiento del cuadro actual.
+
+        Returns:
+            Máscara booleana en la resolución reducida, o None en el primer cuadro.
+        """
+        height, width = frame.shape[:2]
+        self.scale = self.width / width
+        size = (self.width, max(1, int(round(height * self.scale))))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if self.blur:
+            small = cv2.GaussianBlur(small, (self.blur, self.blur), 0)
+
+        prev, self._prev = self._prev, small
+        if prev is None or prev.shape != small.shape:
+            return None
+        self._diff = cv2.absdiff(small, prev, dst=self._diff)
+        return self._diff > self.pixel_threshold
+
+    def motion_outside(self, mask, boxes, padding=0.5):
+        """
+        Fracción de píxeles con movimiento fuera de las cajas (en coordenadas
+        del cuadro original) ampliadas por padding.
+        """
+        outside = mask.copy()
+        for box in boxes:
+            x, y, w, h = _pad_box(box, padding, None)
+            x0, y0 = int(x * self.scale), int(y * self.scale)
+            x1, y1 = int(np.ceil((x + w) * self.scale)), int(np.ceil((y + h) * self.scale))
+            outside[max(0, y0):max(0, y1), max(0, x0):max(0, x1)] = False
+        return float(outside.mean())
+
+
+def _pad_box(box, padding, frame_shape):
+    """Amplía una caja (x, y, w, h) en padding * tamaño por cada lado."""
+    x, y, w, h = box
+    pad_x, pad_y = int(w * padding), int(h * padding)
+    x0, y0 = x - pad_x, y - pad_y
+    x1, y1 = x + w + pad_x, y + h + pad_y
+    if frame_shape is not None:
+        x0, y0 = max(0, x0), max(0, y0)
+        x1, y1 = min(frame_shape[1], x1), min(frame_shape[0], y1)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def padded_roi(box, padding, frame_shape):
+    """ROI (x, y, w, h) alrededor de una caja, recortada a los bordes del cuadro."""
+    return _pad_box(box, padding, frame_shape)
@@ -0,0 +1,371 @@
+# multicam.py
+"""
+Reconocimiento en varias cámaras desde un solo equipo.
+
+Uso:
+    python multicam.py 0 1 rtsp://10.0.0.5/stream entrada.mp4
+    python multicam.py puerta_a.mp4 puerta_b.mp4 --embed-workers 2 --realtime
+    python multicam.py a.mp4 b.mp4 --fake --detector none     # sin modelos ni BD
+
+Cada fuente (índice de cámara, URL RTSP o archivo de video) corre en su
+propio proceso con captura, detección Haar y seguimiento. Los recortes que
+necesitan descriptor van a una cola común atendida por un pool de procesos
+de descriptores (cada uno con su modelo), que los agrupan en lotes y los
+comparan contra la galería. La matriz de la galería está una sola vez en
+multiprocessing.shared_memory y todos los procesos la leen sin copiarla.
+
+El proceso principal muestra FPS y latencias por cámara y escribe los
+reconocimientos en eventos_reconocimiento con la fuente como ubicación.
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from gallery import FaceGallery
+
+RECOGNITION_THRESHOLD = 0.75
+STATS_INTERVAL = 1.0
+
+
+class SharedGallery:
+    """
+    Copia de una FaceGallery en bloques de shared_memory (matriz, persona_ids
+    y template_ids). spec es pequeño y se puede pasar a otros procesos, que
+    llaman a attach(spec) para ver la misma memoria como FaceGallery de solo
+    lectura.
+    """
+
+    def __init__(self, gallery):
+        arrays = {
+            "matrix": np.ascontiguousarray(gallery.matrix, dtype=np.float32),
+            "persona_ids": np.ascontiguousarray(gallery.persona_ids, dtype=np.int64),
+            "template_ids": np.ascontiguousarray(gallery.template_ids, dtype=np.int64),
+        }
+        self._blocks = []
+        self.spec = {"names": list(gallery.names)}
+        for key, array in arrays.items():
+            block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[:] = array
+            self._blocks.append(block)
+            self.spec[key] = (block.name, array.shape, array.dtype.str)
+
+    @staticmethod
+    def attach(spec):
+        """
+        Returns:
+            (gallery, blocks): FaceGallery sobre la memoria compartida y los
+            bloques abiertos, que hay que mantener vivos mientras se use.
+        """
+        blocks, arrays = [], {}
+        for key in ("matrix", "persona_ids", "template_ids"):
+            name, shape, dtype = spec[key]
+            block = shared_memory.SharedMemory(name=name)
+            array = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+            array.flags.writeable = False
+            blocks.append(block)
+            arrays[key] = array
+        gallery = FaceGallery.from_arrays(arrays["matrix"], arrays["persona_ids"], spec["names"],
+                                          arrays["template_ids"])
+        return gallery, blocks
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def parse_source(source):
+    """"0" -> índice de cámara 0; cualquier otra cosa es URL o archivo."""
+    return int(source) if source.isdigit() else source
+
+
+def _is_file(source):
+    return isinstance(source, str) and os.path.exists(source)
+
+
+def _frames(source, realtime):
+    """
+    Cuadros (seq, timestamp, frame) de una fuente. Las cámaras y URL pasan
+    por FrameCapture (siempre el último cuadro); los archivos se leen
+    completos, en orden y, con realtime, al ritmo de su FPS.
+    """
+    if not _is_file(source):
+        from capture import FrameCapture
+        capture = FrameCapture(source, flip=isinstance(source, int)).start()
+        last_seq = 0
+        try:
+            while capture.isOpened() or capture.latest_seq > last_seq:
+                ref = capture.acquire(after_seq=last_seq, timeout=1.0)
+                if ref is None:
+                    continue
+                last_seq = ref.seq
+                try:
+                    yield ref.seq, ref.timestamp, ref.frame
+                finally:
+                    capture.release(ref)
+        finally:
+            capture.stop()
+        return
+
+    cap = cv2.VideoCapture(source)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    start = time.time()
+    seq = 0
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                return
+            seq += 1
+            if realtime:
+                delay = start + seq / fps - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            yield seq, time.time(), frame
+    finally:
+        cap.release()
+
+
+def camera_worker(cam, source, detector_mode, detect_every, realtime, embed_queue, result_queue, stats_queue):
+    """
+    Proceso de una cámara: captura, detección cada detect_every cuadros,
+    seguimiento y envío de recortes al pool de descriptores.
+    """
+    from tracker import FaceTracker
+
+    detector = None
+    if detector_mode != "none":
+        from face_recognition import MixedFaceDetector
+        detector = MixedFaceDetector()
+    tracker = FaceTracker()
+    in_flight = set()
+    frames = recognized = queue_full = 0
+    detect_times, latencies = [], []
+    window_start, window_frames = time.time(), 0
+
+    def apply_results():
+        nonlocal recognized
+        while True:
+            try:
+                track_id, persona_id, name, distance, score, submitted = result_queue.get_nowait()
+            except queue.Empty:
+                return
+            in_flight.discard(track_id)
+            latencies.append(time.time() - submitted)
+            track = next((t for t in tracker.tracks if t.track_id == track_id), None)
+            if track is None:
+                continue
+            tracker.set_identity(track, name, distance, time.time(), persona_id)
+            if persona_id is not None:
+                recognized += 1
+                stats_queue.put(("evento", cam, persona_id, score, time.time()))
+
+    for seq, timestamp, frame in _frames(source, realtime):
+        apply_results()
+        frames += 1
+        window_frames += 1
+        if (frames - 1) % detect_every == 0:
+            start = time.perf_counter()
+            if detector is None:
+                boxes = [(0, 0, frame.shape[1], frame.shape[0])]
+            else:
+                boxes = detector.detect(frame, mode=detector_mode, frame_time=timestamp).boxes
+            detect_times.append(time.perf_counter() - start)
+
+            now = time.time()
+            for track in tracker.update(boxes, now):
+                if track.track_id in in_flight or not tracker.needs_embedding(track, now):
+                    continue
+                x, y, w, h = track.box
+                # Copia: el cuadro puede ser un buffer de captura que se reutiliza
+                crop = np.ascontiguousarray(frame[max(0, y):y + h, max(0, x):x + w])
+                try:
+                    embed_queue.put_nowait((cam, track.track_id, crop, now))
+                    in_flight.add(track.track_id)
+                except queue.Full:
+                    queue_full += 1
+
+        elapsed = time.time() - window_start
+        if elapsed >= STATS_INTERVAL:
+            stats_queue.put(("stats", cam, _camera_stats(frames, window_frames / elapsed, detect_times,
+                                                          latencies, recognized, queue_full, len(tracker.tracks))))
+            window_start, window_frames = time.time(), 0
+            detect_times, latencies = detect_times[-100:], latencies[-100:]
+
+    # Esperar los descriptores pendientes antes de cerrar
+    deadline = time.time() + 5.0
+    while in_flight and time.time() < deadline:
+        time.sleep(0.01)
+        apply_results()
+    stats_queue.put(("fin", cam, _camera_stats(frames, 0.0, detect_times, latencies, recognized,
+                                               queue_full, len(tracker.tracks))))
+
+
+def _camera_stats(frames, fps, detect_times, latencies, recognized, queue_full, tracks):
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000 if latencies else (0.0, 0.0)
+    return {
+        "cuadros": frames,
+        "fps": round(fps, 1),
+        "deteccion_ms": round(float(np.mean(detect_times)) * 1000, 2) if detect_times else 0.0,
+        "descriptor_p50_ms": round(float(p50), 1),
+        "descriptor_p99_ms": round(float(p99), 1),
+        "reconocidos": recognized,
+        "cola_llena": queue_full,
+        "tracks": tracks,
+    }
+
+
+def embed_worker(spec, backend_name, embed_queue, result_queues, max_batch, max_wait, threshold):
+    """Proceso del pool: agrupa recortes de todas las cámaras, extrae descriptores y busca en la galería."""
+    from face_recognition import _embed_crops, create_embedding_backend
+
+    gallery, blocks = SharedGallery.attach(spec)
+    backend = create_embedding_backend(backend_name)
+    while True:
+        item = embed_queue.get()
+        if item is None:
+            break
+        batch = [item]
+        deadline = time.time() + max_wait
+        while len(batch) < max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                item = embed_queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                embed_queue.put(None)  # Que lo vea otro proceso del pool
+                break
+            batch.append(item)
+
+        result = _embed_crops(backend, [crop for _, _, crop, _ in batch])
+        for i, (cam, track_id, _, submitted) in enumerate(batch):
+            match = gallery.best_match(result.embeddings[i], threshold=threshold) if result.valid[i] else None
+            if match is None:
+                result_queues[cam].put((track_id, None, None, None, None, submitted))
+            else:
+                result_queues[cam].put((track_id, match.persona_id, match.name, match.distance, match.score, submitted))
+    for block in blocks:
+        block.close()
+
+
+def load_gallery(fake_people=0):
+    """Galería desde la base de datos, o sintética (fake_people > 0) para pruebas."""
+    if fake_people:
+        from verification_service import synthetic_gallery
+        return synthetic_gallery(fake_people)
+    from database import connect_db, release_db, load_faces_from_db
+    conn, c = connect_db()
+    try:
+        return load_faces_from_db(c)
+    finally:
+        release_db(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconocimiento facial en varias cámaras")
+    parser.add_argument("sources", nargs="+", help="Índices de cámara, URL RTSP o archivos de video")
+    parser.add_argument("--embed-workers", type=int, default=max(1, (os.cpu_count() or 2) // 4))
+    parser.add_argument("--backend", default=None, help="Backend de descriptores (tf, onnx, onnx-int8, fake)")
+    parser.add_argument("--detector", choices=("fast", "fused", "accurate", "none"), default="fast",
+                        help="Modo de MixedFaceDetector; none usa el cuadro entero como rostro")
+    parser.add_argument("--detect-every", type=int, default=6)
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--realtime", action="store_true", help="Leer los archivos de video al ritmo de su FPS")
+    parser.add_argument("--fake", action="store_true", help="FakeEmbedder y galería sintética, sin BD ni modelos")
+    parser.add_argument("--no-events", action="store_true", help="No escribir en eventos_reconocimiento")
+    args = parser.parse_args()
+
+    from face_recognition import EMBEDDING_BACKEND
+    backend = "fake" if args.fake else (args.backend or EMBEDDING_BACKEND)
+    sources = [parse_source(s) for s in args.sources]
+
+    gallery = load_gallery(fake_people=1000 if args.fake else 0)
+    shared = SharedGallery(gallery)
+    print(f"[INFO] Galería compartida: {len(gallery)} plantillas ({gallery.matrix.nbytes / 1e6:.1f} MB)")
+
+    sinks = {}
+    if not (args.fake or args.no_events):
+        from event_sink import RecognitionEventSink
+        sinks = {cam: RecognitionEventSink(ubicacion=str(source)) for cam, source in enumerate(sources)}
+
+    # spawn: TensorFlow no tolera bien heredar el estado con fork
+    context = multiprocessing.get_context("spawn")
+    embed_queue = context.Queue(maxsize=args.max_queue)
+    result_queues = [context.Queue() for _ in sources]
+    stats_queue = context.Queue()
+
+    embedders = [context.Process(target=embed_worker, daemon=True,
+                                 args=(shared.spec, backend, embed_queue, result_queues, args.max_batch,
+                                       args.max_wait_ms / 1000.0, RECOGNITION_THRESHOLD))
+                 for _ in range(args.embed_workers)]
+    cameras = [context.Process(target=camera_worker, daemon=True,
+                               args=(cam, source, args.detector, args.detect_every, args.realtime,
+                                     embed_queue, result_queues[cam], stats_queue))
+               for cam, source in enumerate(sources)]
+    for process in embedders + cameras:
+        process.start()
+
+    start = time.time()
+    latest, finished = {}, set()
+    last_print = time.time()
+    try:
+        while len(finished) < len(cameras):
+            try:
+                message = stats_queue.get(timeout=STATS_INTERVAL)
+            except queue.Empty:
+                if not any(p.is_alive() for p in cameras):
+                    break
+                continue
+            kind, cam = message[0], message[1]
+            if kind == "evento":
+                _, _, persona_id, score, timestamp = message
+                if cam in sinks:
+                    sinks[cam].record(persona_id, score, None, timestamp)
+                continue
+            latest[cam] = message[2]
+            if kind == "fin":
+                finished.add(cam)
+            if time.time() - last_print >= STATS_INTERVAL * 5:
+                last_print = time.time()
+                for c in sorted(latest):
+                    print(f"[INFO] Cámara {c} ({sources[c]}): {latest[c]}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        elapsed = time.time() - start
+        for process in cameras:
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.terminate()
+        for _ in embedders:
+            embed_queue.put(None)
+        for process in embedders:
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.terminate()
+        for sink in sinks.values():
+            sink.close()
+        shared.close()
+
+    for cam in sorted(latest):
+        stats = latest[cam]
+        print(f"[INFO] Cámara {cam} ({sources[cam]}): {stats['cuadros']} cuadros, "
+              f"{stats['cuadros'] / elapsed:.1f} FPS promedio, detección {stats['deteccion_ms']:.1f} ms, "
+              f"descriptor p50 {stats['descriptor_p50_ms']:.0f} ms / p99 {stats['descriptor_p99_ms']:.0f} ms, "
+              f"{stats['reconocidos']} reconocidos")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# preview.py
+"""
+Vista previa de la cámara en un Canvas de Tk.
+
+PreviewRenderer crea un solo ítem de imagen en el Canvas y un solo
+PhotoImage, y en cada cuadro nuevo copia los píxeles con paste(): el Canvas
+no acumula ítems y Tk no reserva una imagen nueva por cuadro. La conversión
+a RGB (y la reducción, si scale < 1) escribe en buffers propios que se
+reutilizan. Los trazos fijos, como la silueta del registro, son
+CachedOverlay: sus píxeles se calculan una vez por tamaño de cuadro y en
+cada cuadro solo se mezclan esos píxeles, no la imagen completa.
+
+Quien llama decide cuándo dibujar; la idea es hacerlo solo cuando
+FrameCapture entrega un cuadro nuevo.
+"""
+import os
+
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+import tkinter as tk
+
+# Escala de la vista previa respecto del cuadro de la cámara (0.5 = mitad de ancho y alto)
+PREVIEW_SCALE = float(os.environ.get("FACE_PREVIEW_SCALE", "1.0"))
+
+
+class CachedOverlay:
+    """
+    Trazo fijo mezclado con alpha sobre el cuadro.
+
+    draw(mask, scale) dibuja el trazo con valor 255 sobre una máscara de un
+    canal del tamaño de la vista previa; se llama solo cuando cambia ese
+    tamaño o la escala.
+    """
+
+    def __init__(self, draw, color, alpha):
+        self.draw = draw
+        self.color = np.asarray(color, dtype=np.float32)
+        self.alpha = alpha
+        self._key = None
+        self._pixels = None
+
+    def apply(self, image, scale=1.0):
+        key = (image.shape[:2], scale)
+        if key != self._key:
+            mask = np.zeros(image.shape[:2], dtype=np.uint8)
+            self.draw(mask, scale)
+            self._pixels = np.nonzero(mask)
+            self._key = key
+        # Igual que addWeighted del trazo sobre el cuadro, pero solo en los píxeles del trazo
+        blended = image[self._pixels] * (1 - self.alpha) + self.color * self.alpha
+        image[self._pixels] = np.round(blended).astype(np.uint8)
+
+
+def silhouette_overlay(axes=(150, 200), color=(128, 128, 128), thickness=2, alpha=0.3):
+    """Elipse centrada que guía dónde poner el rostro al registrarse."""
+    def draw(mask, scale):
+        height, width = mask.shape
+        scaled_axes = (int(axes[0] * scale), int(axes[1] * scale))
+        cv2.ellipse(mask, (width // 2, height // 2), scaled_axes, 0, 0, 360, 255, max(1, int(round(thickness * scale))))
+    return CachedOverlay(draw, color, alpha)
+
+
+class PreviewRenderer:
+    def __init__(self, canvas, scale=PREVIEW_SCALE, overlays=()):
+        """
+        Args:
+            canvas: Canvas de Tk donde se muestra la vista previa.
+            scale: Escala de la vista previa respecto del cuadro.
+            overlays: CachedOverlay a mezclar en cada cuadro.
+        """
+        self.canvas = canvas
+        self.scale = scale
+        self.overlays = list(overlays)
+        self.frames_drawn = 0
+        self._small = None
+        self._rgb = None
+        self._photo = None
+        self._item = None
+
+    def prepare(self, frame):
+        """
+        Convierte el cuadro BGR (y lo reduce, según scale) al buffer RGB de
+        la vista previa, con los overlays ya mezclados. El cuadro original no
+        se modifica.
+
+        Returns:
+            El buffer RGB, para dibujar encima antes de show().
+        """
+        height, width = frame.shape[:2]
+        if self.scale != 1.0:
+            size = (max(1, int(width * self.scale)), max(1, int(height * self.scale)))
+            if self._small is None or self._small.shape[:2] != (size[1], size[0]):
+                self._small = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            cv2.resize(frame, size, dst=self._small, interpolation=cv2.INTER_AREA)
+            frame = self._small
+        if self._rgb is None or self._rgb.shape != frame.shape:
+            self._rgb = np.empty_like(frame)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self._rgb)
+        for overlay in self.overlays:
+            overlay.apply(self._rgb, self.scale)
+        return self._rgb
+
+    def scale_box(self, box):
+        """Caja (x, y, w, h) del cuadro original en coordenadas de la vista previa."""
+        if self.scale == 1.0:
+            return box
+        return tuple(int(v * self.scale) for v in box)
+
+    def show(self):
+        """Pasa el buffer preparado al PhotoImage del Canvas."""
+        image = Image.fromarray(self._rgb)
+        if self._photo is None or (self._photo.width(), self._photo.height()) != image.size:
+            # Primer cuadro o cambio de tamaño: el único momento en que se crea un PhotoImage
+            self._photo = ImageTk.PhotoImage(image=image)
+            if self._item is None:
+                self._item = self.canvas.create_image(0, 0, anchor=tk.NW, image=self._photo)
+            else:
+                self.canvas.itemconfigure(self._item, image=self._photo)
+            self.canvas.config(width=image.size[0], height=image.size[1])
+        else:
+            self._photo.paste(image)
+        self.frames_drawn += 1
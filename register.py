@@ -1,11 +1,17 @@
 # register.py
 import cv2
-import numpy as np
-from PIL import Image, ImageTk
 import tkinter as tk
 from tkinter import messagebox
-from face_recognition import detect_faces, get_face_descriptor
+from face_recognition import get_detector, get_face_descriptors
+from face_quality import assess_face, landmarks_for, QUALITY_MESSAGES
 from registerform import show_registration_form
+from database import release_db
+from gallery_listener import GalleryListener
+from capture import FrameCapture
+from preview import PreviewRenderer, silhouette_overlay
+from duplicate_audit import find_near_duplicates, DUPLICATE_THRESHOLD
+
+REGISTRATION_FRAMES = 8  # Cuadros consecutivos entre los que se elige el mejor rostro
 
 class FaceRegister:
     def __init__(self, root, face_db, c, conn):
@@ -13,10 +19,15 @@ class FaceRegister:
         self.face_db = face_db
         self.c = c
         self.conn = conn
+        # Altas hechas desde otras estaciones entran en la verificación de duplicados
+        self.gallery_listener = GalleryListener(face_db).start()
 
-        self.cap = cv2.VideoCapture(0)
+        # Cámara en su propio hilo (ya volteada); la vista previa solo se redibuja con cuadros nuevos
+        self.capture = FrameCapture(0).start()
+        self.last_drawn_seq = 0
         self.canvas = tk.Canvas(root, width=640, height=480)
         self.canvas.pack()
+        self.preview = PreviewRenderer(self.canvas, overlays=[silhouette_overlay()])
 
         self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
 
@@ -32,29 +43,18 @@ class FaceRegister:
         self.update_frame()
 
     def update_frame(self):
-        ret, frame = self.cap.read()
-        if not ret:
+        if not self.capture.running:
             return
-
-        frame = cv2.flip(frame, 1)
-
-        overlay = frame.copy()
-        center_x, center_y = frame.shape[1] // 2, frame.shape[0] // 2
-        axes_length = (150, 200)
-        color = (128, 128, 128)
-        thickness = 2
-        alpha = 0.3
-
-        cv2.ellipse(overlay, (center_x, center_y), axes_length, 0, 0, 360, color, thickness)
-        cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0, frame)
-
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(frame_rgb)
-        imgtk = ImageTk.PhotoImage(image=img)
-        self.canvas.imgtk = imgtk
-        self.canvas.create_image(0, 0, anchor=tk.NW, image=imgtk)
-
-        self.root.after(15, self.update_frame)
+        ref = self.capture.acquire(after_seq=self.last_drawn_seq, timeout=0)
+        if ref is not None:
+            try:
+                self.last_drawn_seq = ref.seq
+                # La silueta es un overlay en caché: solo se mezclan sus píxeles
+                self.preview.prepare(ref.frame)
+            finally:
+                self.capture.release(ref)
+            self.preview.show()
+        self.root.after(10, self.update_frame)
 
     def show_save_result(self, success, message):
         if success:
@@ -62,36 +62,74 @@ class FaceRegister:
         else:
             messagebox.showerror("Error", message)
 
+    def _best_face(self, frames=REGISTRATION_FRAMES):
+        """
+        Lee varios cuadros seguidos y devuelve el recorte de mejor calidad
+        del rostro más grande de cada uno.
+
+        Returns:
+            (recorte, calidad) del mejor aceptable, o (None, calidad del mejor
+            rechazado) / (None, None) si no se detectó ningún rostro.
+        """
+        best, best_quality, best_rejected = None, None, None
+        last_seq = self.last_drawn_seq
+        for _ in range(frames):
+            ref = self.capture.acquire(after_seq=last_seq, timeout=1.0)
+            if ref is None:
+                continue
+            last_seq = ref.seq
+            try:
+                # Copia: el slot del anillo se reutiliza al devolverlo
+                frame = ref.frame.copy()
+            finally:
+                self.capture.release(ref)
+            detection = get_detector().detect(frame)
+            if not detection.boxes:
+                continue
+            i = max(range(len(detection.boxes)), key=lambda j: detection.boxes[j][2] * detection.boxes[j][3])
+            x, y, w, h = detection.boxes[i]
+            face_img = frame[max(0, y):y+h, max(0, x):x+w]
+            quality = assess_face(face_img, landmarks_for(detection, i))
+            if quality.reason is None:
+                if best_quality is None or quality.score > best_quality.score:
+                    best, best_quality = face_img, quality
+            elif best_rejected is None or quality.score > best_rejected.score:
+                best_rejected = quality
+        return (best, best_quality) if best is not None else (None, best_rejected)
+
     def capture_image(self):
-        ret, frame = self.cap.read()
-        if not ret:
+        if not self.capture.isOpened():
             messagebox.showerror("Error", "No se pudo acceder a la cámara.")
             return
 
-        frame = cv2.flip(frame, 1)
-        faces = detect_faces(frame)
-
-        if len(faces) == 0:
+        face_img, quality = self._best_face()
+        if quality is None:
             messagebox.showwarning("Advertencia", "No se detectó ningún rostro.")
             return
+        if face_img is None:
+            messagebox.showwarning("Advertencia", QUALITY_MESSAGES[quality.reason])
+            return
 
-        x, y, w, h = faces[0]
-        face_img = frame[y:y+h, x:x+w]
-        descriptor = get_face_descriptor(face_img)
+        # Un descriptor fallido no debe llegar a la verificación ni a la base de datos
+        batch = get_face_descriptors([face_img])
+        if not batch.valid[0]:
+            messagebox.showerror("Error", f"No se pudo extraer el descriptor del rostro: {batch.errors.get(0)}")
+            return
+        descriptor = batch.embeddings[0]
 
-        # Verificar duplicado
-        for _, existing_descriptor in self.face_db:
-            distance = np.linalg.norm(existing_descriptor - descriptor)
-            if distance < 0.9:
-                messagebox.showinfo("Ya registrado", "Este rostro ya está registrado en el sistema.")
-                return
+        # Verificar duplicado contra toda la galería en una sola operación
+        if find_near_duplicates(self.face_db, descriptor, DUPLICATE_THRESHOLD):
+            messagebox.showinfo("Ya registrado", "Este rostro ya está registrado en el sistema.")
+            return
 
-        self.cap.release()
+        self.capture.stop()
         # Pasar callback show_save_result para mostrar resultado después de guardar
         show_registration_form(self.root, descriptor, face_img, self.face_db, self.c, self.conn)
 
     def cancel(self):
-        self.cap.release()
+        self.capture.stop()
+        self.gallery_listener.stop()
+        release_db(self.conn)
         self.root.destroy()
 
         # Importar aquí para evitar el ciclo
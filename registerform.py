@@ -4,7 +4,7 @@ import numpy as np
 import tkinter as tk
 from tkinter import messagebox
 from PIL import Image, ImageTk
-from face_recognition import detect_faces, get_face_descriptor
+from database import register_person
 
 
 def show_registration_form(root, descriptor, face_image, face_db, c, conn):
@@ -33,19 +33,14 @@ def show_registration_form(root, descriptor, face_image, face_db, c, conn):
         correo_completo = correo_prefijo + correo_sufijo
 
         if nombre1 and apellido1 and cedula and correo_prefijo:
-            descriptor_list = descriptor.tolist()
-
-            c.execute("""
-                INSERT INTO personas (cedula, nombre, nombre2, apellido1, apellido2, correo_electronico)
-                VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
-            """, (cedula, nombre1, nombre2, apellido1, apellido2, correo_completo))
-            persona_id = c.fetchone()[0]
-
-            c.execute("""
-                INSERT INTO codificaciones_faciales (persona_id, codificacion)
-                VALUES (%s, %s)
-            """, (persona_id, descriptor_list))
-            conn.commit()
+            # Persona y plantilla en una sola transacción, con sentencias preparadas
+            persona_id, template_id = register_person(
+                c, conn, (cedula, nombre1, nombre2, apellido1, apellido2, correo_completo), descriptor
+            )
+
+            # Inserción incremental en la galería (y en su índice ANN, si tiene)
+            face_db.add(persona_id, nombre1, descriptor, template_id)
+            face_db.save_index()
             top.destroy()
             root.registration_form_open = False
 
@@ -0,0 +1,223 @@
+# scheduler.py
+"""
+Planificador adaptativo de detección y reconocimiento.
+
+Reemplaza el "detectar cada 6 cuadros" fijo: mide cuánto tardan la detección
+y los descriptores y decide en tiempo de ejecución cada cuánto detectar y
+cada cuánto re-verificar identidades.
+
+- Con rostros nuevos o todavía sin reconocer detecta seguido, para que el
+  reconocimiento llegue dentro de la latencia objetivo.
+- Con rostros ya reconocidos detecta a la frecuencia objetivo.
+- Con la escena vacía o quieta espacia la detección de a poco, hasta
+  MAX_DETECTION_INTERVAL; un movimiento (MotionGate, sobre 160 px de ancho)
+  la adelanta.
+- Si detección + descriptores + RetinaFace superan el presupuesto de CPU,
+  alarga el intervalo y los reintentos/re-verificaciones del tracker.
+
+El "presupuesto de CPU" es la fracción del tiempo de pared que se pasa en
+detección y descriptores, contando el hilo de RetinaFace (record_background):
+sus pasadas corren en paralelo, pero las dispara cada detección y salen de la
+misma CPU. Cada cambio de decisión queda
+en un registro (decisions) y se resume con report().
+"""
+import os
+import time
+from collections import deque, namedtuple
+
+from motion import MotionGate
+import metrics
+
+TARGET_FPS = float(os.environ.get("FACE_TARGET_FPS", "5"))  # Detecciones por segundo con rostros en escena
+TARGET_LATENCY = float(os.environ.get("FACE_TARGET_LATENCY", "0.5"))  # Segundos hasta reconocer un rostro nuevo
+CPU_BUDGET = float(os.environ.get("FACE_CPU_BUDGET", "0.5"))  # Fracción del tiempo en detección + descriptores
+MIN_DETECTION_INTERVAL = 0.05
+MAX_DETECTION_INTERVAL = 1.0
+BACKOFF_FACTOR = 1.5  # Crecimiento del intervalo por cada detección vacía o quieta
+MAX_RECOGNITION_SCALE = 4.0  # Máximo alargamiento de reintentos y re-verificaciones
+STATIC_MOTION = 0.002  # Fracción de píxeles con movimiento por debajo de la cual la escena está quieta
+WAKE_MOTION = 0.01  # Fracción que adelanta la detección cuando se está espaciando
+LOAD_WINDOW = 5.0  # Segundos sobre los que se mide la carga
+EMA_ALPHA = 0.2
+DECISION_LOG_SIZE = 200
+
+# state: urgente | estable | vacia | estatica | movimiento
+Decision = namedtuple("Decision", ["time", "state", "interval", "recognition_scale", "load", "reason"])
+
+
+class AdaptiveScheduler:
+    def __init__(self, tracker=None, target_fps=TARGET_FPS, target_latency=TARGET_LATENCY, cpu_budget=CPU_BUDGET,
+                 min_interval=MIN_DETECTION_INTERVAL, max_interval=MAX_DETECTION_INTERVAL, use_motion=True):
+        """
+        Args:
+            tracker: FaceTracker cuyos retry_interval y reverify_interval se
+                ajustan según la carga (opcional).
+            target_fps: Detecciones por segundo con rostros ya reconocidos.
+            target_latency: Segundos objetivo entre que aparece un rostro y se reconoce.
+            cpu_budget: Fracción del tiempo disponible para detección + descriptores.
+        """
+        self.tracker = tracker
+        self.target_fps = target_fps
+        self.target_latency = target_latency
+        self.cpu_budget = cpu_budget
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.motion = MotionGate() if use_motion else None
+        if tracker is not None:
+            self._base_retry = tracker.retry_interval
+            self._base_reverify = tracker.reverify_interval
+
+        self.interval = 1.0 / target_fps
+        self.state = "estable"
+        self.recognition_scale = 1.0
+        self.detect_ema = None
+        self.embed_ema = None  # Segundos por rostro
+        self.background_ema = None  # Segundos de RetinaFace por detección
+        self.detections = 0
+        self.decisions = deque(maxlen=DECISION_LOG_SIZE)
+        self.state_counts = {}
+        self._next_detection = 0.0
+        self._motion_since_detection = 0.0
+        self._background_since_detection = 0.0
+        self._work = deque()  # (marca de tiempo, segundos de detección o descriptores)
+        self._started = time.time()
+
+    def observe_frame(self, frame):
+        """Acumula el movimiento del cuadro (barato: 160 px de ancho en gris)."""
+        if self.motion is None:
+            return
+        mask = self.motion.update(frame)
+        if mask is not None:
+            self._motion_since_detection = max(self._motion_since_detection, float(mask.mean()))
+
+    def should_detect(self, now):
+        """True si toca detectar en este cuadro."""
+        if now >= self._next_detection:
+            return True
+        if self.state in ("vacia", "estatica") and self._motion_since_detection > WAKE_MOTION:
+            self._log(now, "movimiento", self.interval, f"movimiento {self._motion_since_detection:.3f}")
+            return True
+        return False
+
+    def record_embedding(self, seconds, faces, now):
+        """Tiempo de un lote de descriptores de faces rostros."""
+        if faces:
+            self.embed_ema = _ema(self.embed_ema, seconds / faces)
+        self._work.append((now, seconds))
+
+    def record_background(self, seconds, now):
+        """Tiempo de RetinaFace (en su propio hilo) desde la llamada anterior."""
+        if seconds > 0:
+            self._background_since_detection += seconds
+            self._work.append((now, seconds))
+
+    def pending_tracks(self, tracks, now):
+        """
+        Rostros sin identificar a los que les toca descriptor antes de la
+        próxima detección a la frecuencia objetivo. Un track que solo da
+        recortes de mala calidad deja de contar cuando el tracker espacia sus
+        reintentos, así que no mantiene al planificador en "urgente".
+        """
+        if self.tracker is None:
+            return sum(1 for t in tracks if t.last_embedding_time is None)
+        horizon = now + 1.0 / self.target_fps
+        return sum(1 for t in tracks if t.name is None and self.tracker.needs_embedding(t, horizon))
+
+    def record_detection(self, seconds, faces, pending, now):
+        """
+        Resultado de una detección; fija cuándo toca la siguiente.
+
+        Args:
+            seconds: Duración de la detección.
+            faces: Rostros visibles en el cuadro.
+            pending: Rostros que todavía esperan descriptor (pending_tracks).
+            now: Marca de tiempo del cuadro.
+        """
+        self.detections += 1
+        self.detect_ema = _ema(self.detect_ema, seconds)
+        self.background_ema = _ema(self.background_ema, self._background_since_detection)
+        self._background_since_detection = 0.0
+        self._work.append((now, seconds))
+        load = self.load(now)
+        motion, self._motion_since_detection = self._motion_since_detection, 0.0
+
+        base = 1.0 / self.target_fps
+        if pending:
+            state = "urgente"
+            # La latencia es intervalo + detección + descriptor
+            cost = self.detect_ema + (self.embed_ema or 0.0)
+            wanted = min(base, self.target_latency - cost)
+            reason = f"{pending} rostro(s) sin reconocer"
+        elif not faces or (self.motion is not None and motion < STATIC_MOTION):
+            state = "vacia" if not faces else "estatica"
+            grow_from = self.interval if self.state in ("vacia", "estatica") else base
+            wanted = grow_from * BACKOFF_FACTOR
+            reason = "sin rostros" if not faces else f"escena quieta (movimiento {motion:.4f})"
+        else:
+            state = "estable"
+            wanted = base
+            reason = f"{faces} rostro(s) reconocido(s)"
+
+        # Intervalo mínimo para que una detección, con el RetinaFace que
+        # dispara, quepa en el presupuesto
+        budget_interval = (self.detect_ema + self.background_ema) / self.cpu_budget
+        if wanted < budget_interval:
+            wanted = budget_interval
+            reason += f"; limitado por presupuesto de CPU ({load:.0%})"
+        interval = min(self.max_interval, max(self.min_interval, wanted))
+
+        self._adjust_recognition(load)
+        self.state_counts[state] = self.state_counts.get(state, 0) + 1
+        if state != self.state or abs(interval - self.interval) > 0.1 * self.interval:
+            self._log(now, state, interval, reason, load)
+        self.state, self.interval = state, interval
+        self._next_detection = now + interval
+
+    def load(self, now):
+        """Fracción de los últimos LOAD_WINDOW segundos pasada en detección, descriptores y RetinaFace."""
+        while self._work and self._work[0][0] < now - LOAD_WINDOW:
+            self._work.popleft()
+        return sum(seconds for _, seconds in self._work) / LOAD_WINDOW
+
+    def _adjust_recognition(self, load):
+        # Reintentos y re-verificaciones se espacian si no alcanza el presupuesto
+        # y vuelven de a poco a sus valores cuando sobra
+        scale = self.recognition_scale
+        if load > self.cpu_budget:
+            scale = min(MAX_RECOGNITION_SCALE, scale * 1.25)
+        elif load < 0.7 * self.cpu_budget:
+            scale = max(1.0, scale / 1.25)
+        if scale != self.recognition_scale:
+            self.recognition_scale = scale
+            if self.tracker is not None:
+                self.tracker.retry_interval = self._base_retry * scale
+                self.tracker.reverify_interval = self._base_reverify * scale
+
+    def _log(self, now, state, interval, reason, load=None):
+        load = self.load(now) if load is None else load
+        self.decisions.append(Decision(now, state, interval, self.recognition_scale, load, reason))
+        metrics.inc(f"planificador_{state}")
+
+    def report(self, last=10):
+        """Resumen de las decisiones, para imprimir al cerrar o exportar."""
+        elapsed = max(time.time() - self._started, 1e-3)
+        return {
+            "estado": self.state,
+            "intervalo_s": round(self.interval, 3),
+            "detecciones_por_s": round(self.detections / elapsed, 2),
+            "deteccion_ms": round((self.detect_ema or 0.0) * 1000, 1),
+            "descriptor_ms": round((self.embed_ema or 0.0) * 1000, 1),
+            "retinaface_ms": round((self.background_ema or 0.0) * 1000, 1),
+            "escala_reconocimiento": round(self.recognition_scale, 2),
+            "carga": round(self.load(time.time()), 3),
+            "detecciones_por_estado": dict(self.state_counts),
+            "decisiones": [
+                {"t": round(d.time - self._started, 2), "estado": d.state, "intervalo_s": round(d.interval, 3),
+                 "escala": round(d.recognition_scale, 2), "carga": round(d.load, 3), "motivo": d.reason}
+                for d in list(self.decisions)[-last:]
+            ],
+        }
+
+
+def _ema(current, value):
+    return value if current is None else (1 - EMA_ALPHA) * current + EMA_ALPHA * value
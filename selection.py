@@ -1,8 +1,10 @@
 # seleccion.py
 import tkinter as tk
+from face_recognition import warm_up, mark_startup
 from app import FaceRecognitionApp
 from register import FaceRegister
 from database import connect_db, load_faces_from_db
+from ann_index import maybe_attach_index
 
 class SelectionWindow:
     def __init__(self):
@@ -16,6 +18,8 @@ class SelectionWindow:
         btn_register.pack(pady=20)
         btn_verify.pack(pady=10)
 
+        warm_up()
+        self.root.after_idle(lambda: mark_startup("primera_ventana"))
         self.root.mainloop()
 
     def open_registration(self):
@@ -24,6 +28,7 @@ class SelectionWindow:
         root = tk.Tk()
         conn, c = connect_db()
         face_db = load_faces_from_db(c)
+        maybe_attach_index(face_db)
 
         # Crear la ventana de registro usando FaceRegister
         app = FaceRegister(root, face_db, c, conn)
@@ -0,0 +1,40 @@
+# tests/test_scheduler.py
+import numpy as np
+
+from scheduler import AdaptiveScheduler
+from tracker import FaceTracker
+
+
+def _run(seconds, fps=30.0):
+    """Escena quieta con un rostro cuyos recortes nunca pasan el filtro de calidad."""
+    tracker = FaceTracker()
+    scheduler = AdaptiveScheduler(tracker)
+    frame = np.full((240, 320, 3), 128, dtype=np.uint8)
+    states = []
+    for i in range(int(seconds * fps)):
+        now = i / fps
+        scheduler.observe_frame(frame)
+        if not scheduler.should_detect(now):
+            continue
+        tracks = tracker.update([(100, 60, 80, 80)], now)
+        for track in tracks:
+            if tracker.needs_embedding(track, now):
+                tracker.defer(track, now)
+        scheduler.record_detection(0.01, len(tracks), scheduler.pending_tracks(tracks, now), now)
+        states.append(scheduler.state)
+    return scheduler, states
+
+
+def test_quality_rejected_track_does_not_pin_urgent():
+    scheduler, states = _run(20.0)
+    # Solo vuelve a "urgente" cuando vence un reintento, cada vez más espaciado
+    assert states.count("urgente") <= len(states) // 4
+    assert scheduler.interval == scheduler.max_interval
+
+def test_new_track_is_pending():
+    tracker = FaceTracker()
+    scheduler = AdaptiveScheduler(tracker, use_motion=False)
+    tracks = tracker.update([(0, 0, 50, 50)], 0.0)
+    assert scheduler.pending_tracks(tracks, 0.0) == 1
+    tracker.set_identity(tracks[0], "ana", 0.3, 0.0, persona_id=1)
+    assert scheduler.pending_tracks(tracks, 0.0) == 0
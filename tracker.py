@@ -0,0 +1,176 @@
+# tracker.py
+import itertools
+
+import cv2
+import numpy as np
+
+
+class Track:
+    """Un rostro seguido entre cuadros, con la identidad que se le asignó."""
+
+    def __init__(self, track_id, box, now):
+        self.track_id = track_id
+        self.box = box
+        self.name = None
+        self.persona_id = None
+        self.distance = None
+        self.created_time = now
+        self.last_seen_time = now
+        self.last_embedding_time = None
+        self.embedding_count = 0
+        self.misses = 0
+
+    @property
+    def center(self):
+        x, y, w, h = self.box
+        return x + w / 2.0, y + h / 2.0
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """IoU entre todas las cajas (x, y, w, h) de a y de b, vectorizado."""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    ax2, ay2 = a[:, 0] + a[:, 2], a[:, 1] + a[:, 3]
+    bx2, by2 = b[:, 0] + b[:, 2], b[:, 1] + b[:, 3]
+    inter_w = np.clip(np.minimum(ax2[:, None], bx2[None]) - np.maximum(a[:, 0, None], b[None, :, 0]), 0, None)
+    inter_h = np.clip(np.minimum(ay2[:, None], by2[None]) - np.maximum(a[:, 1, None], b[None, :, 1]), 0, None)
+    inter = inter_w * inter_h
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-6), 0.0)
+
+
+class FaceTracker:
+    """
+    Seguidor ligero de rostros por IoU y distancia entre centros.
+
+    Cada detección se asocia con el track existente que más se le parece; si
+    no hay ninguno, se crea un track nuevo. La identidad reconocida queda en
+    el track, así que el descriptor solo se vuelve a calcular para tracks
+    nuevos, con confianza baja o cuando vence el intervalo de re-verificación.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_center_shift=0.5, max_misses=3,
+                 low_confidence_distance=0.6, retry_interval=0.5, reverify_interval=10.0,
+                 use_optical_flow=False):
+        self.iou_threshold = iou_threshold
+        self.max_center_shift = max_center_shift  # Proporción del ancho de la caja
+        self.max_misses = max_misses
+        self.low_confidence_distance = low_confidence_distance
+        self.retry_interval = retry_interval
+        self.reverify_interval = reverify_interval
+        self.use_optical_flow = use_optical_flow
+        self.tracks = []
+        self._ids = itertools.count(1)
+        self._prev_gray = None
+        self.embedding_calls = 0
+
+    def update(self, boxes, now):
+        """
+        Asocia las detecciones del cuadro actual con los tracks.
+
+        Args:
+            boxes: Lista de cajas (x, y, w, h) detectadas.
+            now: Marca de tiempo del cuadro.
+
+        Returns:
+            Tracks visibles en este cuadro, en el orden de boxes.
+        """
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        assigned = [None] * len(boxes)
+        free_tracks = set(range(len(self.tracks)))
+
+        if self.tracks and boxes:
+            ious = iou_matrix([t.box for t in self.tracks], boxes)
+            # Asociación voraz: primero los pares con mayor IoU
+            for flat in np.argsort(-ious, axis=None):
+                ti, bi = np.unravel_index(flat, ious.shape)
+                if ious[ti, bi] < self.iou_threshold:
+                    break
+                if ti in free_tracks and assigned[bi] is None:
+                    assigned[bi] = ti
+                    free_tracks.discard(ti)
+
+            # Respaldo por centro para movimientos rápidos que dejan IoU bajo
+            for bi, box in enumerate(boxes):
+                if assigned[bi] is not None:
+                    continue
+                cx, cy = box[0] + box[2] / 2.0, box[1] + box[3] / 2.0
+                best, best_dist = None, None
+                for ti in free_tracks:
+                    tx, ty = self.tracks[ti].center
+                    dist = np.hypot(cx - tx, cy - ty)
+                    if dist <= self.max_center_shift * max(box[2], self.tracks[ti].box[2]) and (best is None or dist < best_dist):
+                        best, best_dist = ti, dist
+                if best is not None:
+                    assigned[bi] = best
+                    free_tracks.discard(best)
+
+        visible = []
+        for bi, box in enumerate(boxes):
+            if assigned[bi] is None:
+                track = Track(next(self._ids), box, now)
+                self.tracks.append(track)
+            else:
+                track = self.tracks[assigned[bi]]
+                track.box = box
+                track.misses = 0
+                track.last_seen_time = now
+            visible.append(track)
+
+        for ti in free_tracks:
+            self.tracks[ti].misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+        return visible
+
+    def propagate(self, frame):
+        """
+        Opcional: desplaza las cajas entre detecciones con flujo óptico
+        (Lucas-Kanade sobre esquinas dentro de cada caja).
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        prev_gray, self._prev_gray = self._prev_gray, gray
+        if not self.use_optical_flow or prev_gray is None or prev_gray.shape != gray.shape:
+            return
+        for track in self.tracks:
+            x, y, w, h = track.box
+            mask = np.zeros_like(prev_gray)
+            mask[max(0, y):max(0, y + h), max(0, x):max(0, x + w)] = 255
+            points = cv2.goodFeaturesToTrack(prev_gray, maxCorners=30, qualityLevel=0.01, minDistance=5, mask=mask)
+            if points is None:
+                continue
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None)
+            ok = status.reshape(-1) == 1
+            if not ok.any():
+                continue
+            dx, dy = np.median((moved - points).reshape(-1, 2)[ok], axis=0)
+            track.box = (int(round(x + dx)), int(round(y + dy)), w, h)
+
+    def needs_embedding(self, track, now):
+        """Decide si vale la pena calcular el descriptor de este track ahora."""
+        if track.last_embedding_time is None:
+            return True
+        elapsed = now - track.last_embedding_time
+        low_confidence = track.name is None or track.distance is None or track.distance > self.low_confidence_distance
+        # Para desconocidos el reintento se espacia: 1x, 2x, 4x, 8x retry_interval
+        backoff = min(2 ** max(track.embedding_count - 1, 0), 8)
+        if low_confidence and elapsed > self.retry_interval * backoff:
+            return True
+        return elapsed > self.reverify_interval
+
+    def set_identity(self, track, name, distance, now, persona_id=None):
+        """Guarda el resultado del reconocimiento en el track."""
+        track.name = name
+        track.distance = distance
+        track.persona_id = persona_id
+        track.last_embedding_time = now
+        track.embedding_count += 1
+        self.embedding_calls += 1
+
+    def defer(self, track, now):
+        """
+        Cuenta un intento sin descriptor (recorte descartado por calidad): el
+        track conserva su identidad y el próximo intento sigue el mismo
+        espaciado que needs_embedding aplica a los desconocidos.
+        """
+        track.last_embedding_time = now
+        track.embedding_count += 1
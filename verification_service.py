@@ -0,0 +1,369 @@
+# verification_service.py
+"""
+Servicio local de verificación facial por HTTP.
+
+Uso:
+    python verification_service.py serve --port 8765
+    python verification_service.py serve --fake            # sin modelos ni base de datos
+    python verification_service.py loadgen --requests 1000 --concurrency 16
+
+POST /verify con la imagen (JPEG/PNG) en el cuerpo devuelve los rostros
+encontrados y la persona reconocida de cada uno. GET /stats devuelve
+contadores, latencias p50/p99 y solicitudes por segundo.
+
+Las solicitudes que llegan con pocos milisegundos de diferencia se agrupan
+en una sola llamada al extractor de descriptores (MicroBatcher).
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from gallery import FaceGallery
+
+RECOGNITION_THRESHOLD = 0.75  # Mismo umbral que FaceRecognitionApp
+MAX_BODY_BYTES = 8 * 1024 * 1024  # Imagen más grande que se acepta en /verify
+RATE_WINDOW = 10.0  # Segundos sobre los que se calcula solicitudes_por_s
+
+
+class Overloaded(Exception):
+    """La cola del servicio está llena."""
+
+
+class MicroBatcher:
+    """
+    Agrupa recortes de varias solicitudes en una sola llamada a embed_fn.
+
+    El hilo de trabajo toma el primer recorte pendiente y espera hasta
+    max_wait_ms a que lleguen más, sin pasar de max_batch. La cola admite
+    como mucho max_queue recortes; por encima submit() lanza Overloaded.
+    """
+
+    def __init__(self, embed_fn, max_batch=16, max_wait_ms=5.0, max_queue=256):
+        self.embed_fn = embed_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.batches = 0
+        self.items = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, crop):
+        """Encola un recorte y devuelve un Future con (descriptor o None, error)."""
+        future = Future()
+        try:
+            self._queue.put_nowait((crop, future))
+        except queue.Full:
+            raise Overloaded()
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            crops = [crop for crop, _ in batch]
+            try:
+                result = self.embed_fn(crops)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for i, (_, future) in enumerate(batch):
+                if result.valid[i]:
+                    future.set_result((result.embeddings[i], None))
+                else:
+                    future.set_result((None, result.errors.get(i)))
+
+
+class LatencyStats:
+    """Latencias de las últimas solicitudes y contadores del servicio."""
+
+    def __init__(self, window=10000):
+        self._lock = threading.Lock()
+        self._latencies = np.zeros(window, dtype=np.float64)
+        self._times = np.zeros(window, dtype=np.float64)  # Fin de cada solicitud, para la tasa reciente
+        self._count = 0
+        self.started = time.time()
+        self.counters = {"ok": 0, "rechazadas": 0, "errores": 0}
+
+    def record(self, latency):
+        with self._lock:
+            self._latencies[self._count % len(self._latencies)] = latency
+            self._times[self._count % len(self._times)] = time.time()
+            self._count += 1
+            self.counters["ok"] += 1
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            filled = min(self._count, len(self._latencies))
+            latencies = self._latencies[:filled].copy()
+            times = self._times[:filled].copy()
+            counters = dict(self.counters)
+        now = time.time()
+        p50, p99 = np.percentile(latencies, [50, 99]) if len(latencies) else (0.0, 0.0)
+        # Tasa de los últimos RATE_WINDOW segundos (desde la primera solicitud
+        # de la ventana, o desde lo que cubre el anillo), no de todo el tiempo encendido
+        recent = times[times >= now - RATE_WINDOW]
+        span = now - recent.min() if len(recent) else 0.0
+        return dict(counters, p50_ms=round(p50 * 1000, 2), p99_ms=round(p99 * 1000, 2),
+                    solicitudes_por_s=round(len(recent) / span, 2) if span > 0 else 0.0)
+
+
+class VerificationService:
+    """Detección + descriptores por lotes + búsqueda en la galería."""
+
+    def __init__(self, gallery, embed_fn, detect_fn=None, max_concurrency=32,
+                 max_batch=16, max_wait_ms=5.0, max_queue=256, timeout=10.0):
+        self.gallery = gallery
+        self.detect_fn = detect_fn
+        self.batcher = MicroBatcher(embed_fn, max_batch, max_wait_ms, max_queue)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.timeout = timeout
+        self.stats = LatencyStats()
+
+    def verify(self, image):
+        """
+        Verifica todos los rostros de una imagen BGR.
+
+        Returns:
+            Lista de dicts con caja, persona_id, nombre, distancia y score
+            (persona_id None si no se reconoció).
+        """
+        if self.detect_fn is None:
+            boxes = [(0, 0, image.shape[1], image.shape[0])]
+        else:
+            boxes = self.detect_fn(image)
+        futures = [self.batcher.submit(image[max(0, y):y + h, max(0, x):x + w]) for (x, y, w, h) in boxes]
+
+        faces = []
+        for box, future in zip(boxes, futures):
+            descriptor, error = future.result(timeout=self.timeout)
+            face = {"caja": [int(v) for v in box], "persona_id": None, "nombre": None,
+                    "distancia": None, "score": None}
+            if descriptor is None:
+                face["error"] = error
+            else:
+                match = self.gallery.best_match(descriptor, threshold=RECOGNITION_THRESHOLD)
+                if match is not None:
+                    face.update(persona_id=match.persona_id, nombre=match.name,
+                                distancia=round(match.distance, 4), score=round(match.score, 4))
+            faces.append(face)
+        return faces
+
+
+class VerificationServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # El valor por defecto (5) corta las ráfagas de conexiones
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                stats = service.stats.snapshot()
+                batcher = service.batcher
+                stats["lotes"] = batcher.batches
+                stats["tamano_lote_medio"] = round(batcher.items / batcher.batches, 2) if batcher.batches else 0.0
+                self._send(200, stats)
+            else:
+                self._send(404, {"error": "ruta desconocida"})
+
+        def do_POST(self):
+            if self.path != "/verify":
+                self._send(404, {"error": "ruta desconocida"})
+                return
+            start = time.perf_counter()
+            # El tamaño se valida antes de leer: el cuerpo nunca se lee sin límite
+            try:
+                length = int(self.headers.get("Content-Length", ""))
+            except ValueError:
+                service.stats.count("errores")
+                self.close_connection = True
+                self._send(411, {"error": "falta Content-Length"})
+                return
+            if length < 0 or length > MAX_BODY_BYTES:
+                service.stats.count("errores")
+                self.close_connection = True
+                self._send(413, {"error": f"imagen de más de {MAX_BODY_BYTES} bytes"})
+                return
+            body = self.rfile.read(length)
+            # Límite de solicitudes en curso: si no hay lugar se rechaza enseguida
+            if not service.slots.acquire(blocking=False):
+                service.stats.count("rechazadas")
+                self._send(503, {"error": "servicio saturado"})
+                return
+            try:
+                image = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if image is None:
+                    service.stats.count("errores")
+                    self._send(400, {"error": "imagen inválida"})
+                    return
+                faces = service.verify(image)
+            except Overloaded:
+                service.stats.count("rechazadas")
+                self._send(503, {"error": "cola de descriptores llena"})
+                return
+            except Exception as e:
+                service.stats.count("errores")
+                self._send(500, {"error": str(e)})
+                return
+            finally:
+                service.slots.release()
+            latency = time.perf_counter() - start
+            service.stats.record(latency)
+            self._send(200, {"rostros": faces, "latencia_ms": round(latency * 1000, 2)})
+
+        def log_message(self, format, *args):
+            pass  # Sin una línea de log por solicitud
+
+    return Handler
+
+
+def synthetic_face(seed, size=112):
+    """Imagen sintética reproducible que hace de 'rostro' en el modo --fake."""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+    image = cv2.resize(small, (size, size), interpolation=cv2.INTER_LINEAR)
+    noise = rng.integers(-8, 9, image.shape)
+    return np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def synthetic_gallery(people=1000):
+    """Galería con un descriptor de FakeEmbedder por cada synthetic_face(seed), seed < people."""
+    from face_recognition import FakeEmbedder
+    batch = FakeEmbedder()([synthetic_face(seed) for seed in range(people)])
+    return FaceGallery.from_arrays(batch.embeddings, np.arange(people), [f"Persona {i}" for i in range(people)],
+                                   np.arange(people))
+
+
+def build_fake_service(people=1000, **kwargs):
+    """Servicio sin modelos ni base de datos: FakeEmbedder y galería sintética."""
+    from face_recognition import FakeEmbedder
+    return VerificationService(synthetic_gallery(people), FakeEmbedder(), detect_fn=None, **kwargs)
+
+
+def build_service(**kwargs):
+    from ann_index import maybe_attach_index
+    from database import connect_db, release_db, load_faces_from_db
+    from face_recognition import detect_faces_still, get_face_descriptors, warm_up
+
+    warm_up()
+    conn, c = connect_db()
+    try:
+        gallery = load_faces_from_db(c)
+    finally:
+        release_db(conn)
+    maybe_attach_index(gallery)
+    return VerificationService(gallery, get_face_descriptors, detect_fn=detect_faces_still, **kwargs)
+
+
+def run_loadgen(url, requests, concurrency, people):
+    """
+    Generador de carga: envía imágenes sintéticas desde varios hilos y mide
+    latencia p50/p99 y solicitudes por segundo del lado del cliente.
+    """
+    payloads = [cv2.imencode(".jpg", synthetic_face(seed % people))[1].tobytes() for seed in range(min(requests, people))]
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+
+    def send(i):
+        request = urllib.request.Request(url + "/verify", data=payloads[i % len(payloads)], method="POST",
+                                         headers={"Content-Type": "application/octet-stream"})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except Exception:
+            status = "error"
+        elapsed = time.perf_counter() - start
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(send, range(requests)))
+    total = time.perf_counter() - start
+
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000 if latencies else (0.0, 0.0)
+    print(f"[INFO] {requests} solicitudes en {total:.2f}s: {len(latencies) / total:.1f} sol/s, "
+          f"p50 = {p50:.1f} ms, p99 = {p99:.1f} ms, estados = {statuses}")
+    with urllib.request.urlopen(url + "/stats") as response:
+        print(f"[INFO] Servidor: {json.loads(response.read())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio local de verificación facial")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--fake", action="store_true", help="FakeEmbedder y galería sintética, sin BD ni modelos")
+    serve.add_argument("--fake-people", type=int, default=1000)
+    serve.add_argument("--max-concurrency", type=int, default=32)
+    serve.add_argument("--max-batch", type=int, default=16)
+    serve.add_argument("--max-wait-ms", type=float, default=5.0)
+    serve.add_argument("--max-queue", type=int, default=256)
+
+    loadgen = sub.add_parser("loadgen")
+    loadgen.add_argument("--url", default="http://127.0.0.1:8765")
+    loadgen.add_argument("--requests", type=int, default=1000)
+    loadgen.add_argument("--concurrency", type=int, default=16)
+    loadgen.add_argument("--people", type=int, default=1000)
+
+    args = parser.parse_args()
+    if args.command == "loadgen":
+        run_loadgen(args.url, args.requests, args.concurrency, args.people)
+        return
+
+    options = dict(max_concurrency=args.max_concurrency, max_batch=args.max_batch,
+                   max_wait_ms=args.max_wait_ms, max_queue=args.max_queue)
+    service = build_fake_service(args.fake_people, **options) if args.fake else build_service(**options)
+    server = VerificationServer((args.host, args.port), make_handler(service))
+    print(f"[INFO] Servicio de verificación en http://{args.host}:{args.port} ({len(service.gallery)} plantillas)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+# video_analysis.py
+"""
+Análisis de video grabado, sin interfaz.
+
+Uso:
+    python video_analysis.py grabacion.mp4 --start 2026-10-17T08:00:00
+    python video_analysis.py grabacion.mp4 --workers 8 --sample-fps 4 --output linea.jsonl --events
+    python video_analysis.py prueba.mp4 --fake --detector none            # sin modelos ni BD
+
+El video se divide en tramos de --chunk-seconds que procesan en paralelo
+varios procesos (spawn), cada uno con su detector, su modelo de
+descriptores y la galería en memoria compartida (multicam.SharedGallery).
+Dentro de un tramo solo se decodifican --sample-fps cuadros por segundo
+(los demás se saltan con grab(), sin decodificar); en cada cuadro
+muestreado se detecta con detect_faces_still, se sigue con FaceTracker
+usando el tiempo del video, y los recortes que necesitan descriptor se
+juntan en lotes de --batch-size, también entre cuadros distintos. La
+detección no va en lotes (Haar y RetinaFace reciben una imagen a la vez): el
+paralelismo de la detección lo dan los tramos. Un recorte descartado por
+calidad cuenta como intento para el tracker, que espacia los reintentos.
+
+El resultado es una línea de tiempo por track: persona, inicio y fin
+(segundos del video y, con --start, hora), confianza y cantidad de
+observaciones, en CSV o JSONL según la extensión de --output, y con
+--events también en eventos_reconocimiento. Al final se informa el
+rendimiento en cuadros/s frente al tiempo real del video.
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+import multiprocessing
+
+import cv2
+
+from multicam import RECOGNITION_THRESHOLD, SharedGallery, load_gallery
+
+CHUNK_SECONDS = 60.0
+SAMPLE_FPS = 5.0  # Cuadros analizados por segundo de video
+BATCH_SIZE = 32  # Recortes por inferencia de descriptores
+EVENT_BATCH_SIZE = 500  # Filas por INSERT al escribir eventos
+BATCH_WINDOW = 1.0  # Segundos de video que un recorte puede esperar a que se llene el lote
+MERGE_GAP = 2.0  # Segundos entre tracks de la misma persona que se unen en uno
+MIN_OBSERVATIONS = 2  # Detecciones mínimas para que un track salga en la línea de tiempo
+
+TIMELINE_FIELDS = ["persona_id", "nombre", "inicio_s", "fin_s", "inicio", "fin", "confianza",
+                   "observaciones", "reconocimientos", "tramo", "track"]
+
+# Estado de cada proceso del pool, creado una sola vez en _init_worker
+_worker = {}
+
+
+def probe_video(path):
+    """(cuadros, fps) del archivo; falla si OpenCV no lo puede abrir."""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError(f"No se pudo abrir el video: {path}")
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    cap.release()
+    return frames, fps
+
+
+def split_chunks(frame_count, fps, chunk_seconds):
+    """Rangos [inicio, fin) de cuadros de chunk_seconds cada uno."""
+    size = max(1, int(round(chunk_seconds * fps)))
+    return [(start, min(start + size, frame_count)) for start in range(0, frame_count, size)]
+
+
+def _init_worker(spec, backend_name, detector):
+    from face_recognition import create_embedding_backend
+    gallery, blocks = SharedGallery.attach(spec)
+    _worker.update(gallery=gallery, blocks=blocks, backend=create_embedding_backend(backend_name),
+                   detector=detector)
+
+
+def _detect(frame, detector):
+    if detector == "none":
+        return [(0, 0, frame.shape[1], frame.shape[0])]
+    from face_recognition import detect_faces_still
+    return detect_faces_still(frame, accurate=(detector == "retinaface"))
+
+
+def analyze_chunk(path, chunk_index, start_frame, end_frame, fps, step, batch_size, threshold, quality_gate):
+    """
+    Procesa un tramo en un proceso del pool.
+
+    Returns:
+        (chunk_index, tracks, stats): tracks es una lista de dicts con las
+        observaciones de cada track (tiempo del video en segundos).
+    """
+    from face_quality import assess_face
+    from face_recognition import _embed_crops
+    from tracker import FaceTracker
+
+    gallery, backend, detector = _worker["gallery"], _worker["backend"], _worker["detector"]
+    tracker = FaceTracker()
+    records, pending, in_flight = {}, [], set()
+    stats = {"cuadros": 0, "analizados": 0, "descriptores": 0, "descartados_calidad": 0,
+             "deteccion_s": 0.0, "descriptor_s": 0.0}
+
+    def flush():
+        if not pending:
+            return
+        start = time.perf_counter()
+        result = _embed_crops(backend, [crop for _, crop, _ in pending])
+        stats["descriptor_s"] += time.perf_counter() - start
+        stats["descriptores"] += len(pending)
+        for i, (track, _, t) in enumerate(pending):
+            in_flight.discard(track.track_id)
+            match = gallery.best_match(result.embeddings[i], threshold=threshold) if result.valid[i] else None
+            if match is None:
+                tracker.set_identity(track, None, None, t)
+                continue
+            tracker.set_identity(track, match.name, match.distance, t, match.persona_id)
+            records[track.track_id]["reconocimientos"].append((t, match.persona_id, match.name, float(match.score)))
+        pending.clear()
+
+    cap = cv2.VideoCapture(path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    try:
+        for index in range(start_frame, end_frame):
+            # Los cuadros que no se analizan solo se avanzan, sin decodificar
+            if (index - start_frame) % step:
+                if not cap.grab():
+                    break
+                stats["cuadros"] += 1
+                continue
+            ok, frame = cap.read()
+            if not ok:
+                break
+            stats["cuadros"] += 1
+            stats["analizados"] += 1
+            t = index / fps
+
+            start = time.perf_counter()
+            boxes = _detect(frame, detector)
+            stats["deteccion_s"] += time.perf_counter() - start
+
+            for track in tracker.update(boxes, t):
+                record = records.setdefault(track.track_id, {
+                    "tramo": chunk_index, "track": track.track_id, "inicio_s": t, "fin_s": t,
+                    "observaciones": 0, "reconocimientos": []})
+                record["fin_s"] = t
+                record["observaciones"] += 1
+                if track.track_id in in_flight or not tracker.needs_embedding(track, t):
+                    continue
+                x, y, w, h = track.box
+                crop = frame[max(0, y):y + h, max(0, x):x + w]
+                if quality_gate and assess_face(crop).reason is not None:
+                    stats["descartados_calidad"] += 1
+                    tracker.defer(track, t)
+                    continue
+                # Copia: el cuadro se reemplaza en la próxima lectura
+                pending.append((track, crop.copy(), t))
+                in_flight.add(track.track_id)
+            # El tracker necesita la identidad para decidir reintentos: el lote
+            # no espera más de BATCH_WINDOW segundos de video
+            if pending and (len(pending) >= batch_size or t - pending[0][2] >= BATCH_WINDOW):
+                flush()
+        flush()
+    finally:
+        cap.release()
+    return chunk_index, list(records.values()), stats
+
+
+def resolve_track(record):
+    """
+    Identidad de un track: la persona con mayor suma de puntajes entre sus
+    reconocimientos; la confianza es el puntaje medio de esa persona.
+    """
+    totals = {}
+    for _, persona_id, name, score in record["reconocimientos"]:
+        total, count, _ = totals.get(persona_id, (0.0, 0, name))
+        totals[persona_id] = (total + score, count + 1, name)
+    entry = {key: record[key] for key in ("tramo", "track", "inicio_s", "fin_s", "observaciones")}
+    if not totals:
+        entry.update(persona_id=None, nombre=None, confianza=None, reconocimientos=0)
+        return entry
+    persona_id, (total, count, name) = max(totals.items(), key=lambda item: item[1][0])
+    entry.update(persona_id=persona_id, nombre=name, confianza=total / count, reconocimientos=count)
+    return entry
+
+
+def build_timeline(records, merge_gap=MERGE_GAP, min_observations=MIN_OBSERVATIONS):
+    """
+    Línea de tiempo ordenada por inicio. Los tracks de la misma persona
+    separados por menos de merge_gap segundos (por ejemplo, cortados en el
+    borde de un tramo o por una oclusión) se unen en una sola entrada.
+    """
+    entries = sorted((resolve_track(r) for r in records if r["observaciones"] >= min_observations),
+                     key=lambda e: e["inicio_s"])
+    timeline, open_by_person = [], {}
+    for entry in entries:
+        previous = open_by_person.get(entry["persona_id"]) if entry["persona_id"] is not None else None
+        if previous is not None and entry["inicio_s"] - previous["fin_s"] <= merge_gap:
+            total = previous["reconocimientos"] + entry["reconocimientos"]
+            previous["confianza"] = (previous["confianza"] * previous["reconocimientos"]
+                                     + entry["confianza"] * entry["reconocimientos"]) / total
+            previous["reconocimientos"] = total
+            previous["observaciones"] += entry["observaciones"]
+            previous["fin_s"] = max(previous["fin_s"], entry["fin_s"])
+            continue
+        timeline.append(entry)
+        if entry["persona_id"] is not None:
+            open_by_person[entry["persona_id"]] = entry
+    return timeline
+
+
+def _add_wall_times(timeline, start_time):
+    for entry in timeline:
+        entry["inicio_s"] = round(entry["inicio_s"], 3)
+        entry["fin_s"] = round(entry["fin_s"], 3)
+        if entry["confianza"] is not None:
+            entry["confianza"] = round(entry["confianza"], 4)
+        if start_time is not None:
+            entry["inicio"] = (start_time + timedelta(seconds=entry["inicio_s"])).isoformat(timespec="seconds")
+            entry["fin"] = (start_time + timedelta(seconds=entry["fin_s"])).isoformat(timespec="seconds")
+        else:
+            entry["inicio"] = entry["fin"] = None
+
+
+def write_timeline(timeline, path):
+    """CSV o JSONL según la extensión de path."""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".jsonl"):
+            for entry in timeline:
+                f.write(json.dumps({k: entry[k] for k in TIMELINE_FIELDS}, ensure_ascii=False) + "\n")
+        else:
+            writer = csv.DictWriter(f, fieldnames=TIMELINE_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(timeline)
+
+
+def write_events(timeline, start_time, ubicacion, batch_size=EVENT_BATCH_SIZE):
+    """
+    Un evento por entrada reconocida de la línea de tiempo, con la hora de su
+    inicio. Se escriben directo (sin RecognitionEventSink, que descarta con
+    la cola llena) en una sola transacción: si algo falla no queda nada a
+    medias y el error se propaga.
+    """
+    from psycopg2.extras import execute_values
+    from database import pooled_connection
+
+    rows = [(entry["persona_id"], entry["confianza"], start_time + timedelta(seconds=entry["inicio_s"]), ubicacion)
+            for entry in timeline if entry["persona_id"] is not None]
+    with pooled_connection() as (conn, c):
+        execute_values(c, """
+            INSERT INTO eventos_reconocimiento (persona_id, confianza, fecha_evento, ubicacion)
+            VALUES %s
+        """, rows, page_size=batch_size)
+    return len(rows)
+
+
+def analyze_video(path, workers, chunk_seconds=CHUNK_SECONDS, sample_fps=SAMPLE_FPS, batch_size=BATCH_SIZE,
+                  detector="haar", backend=None, fake=False, quality_gate=True, threshold=RECOGNITION_THRESHOLD):
+    """
+    Procesa el video en paralelo.
+
+    Returns:
+        (records, stats) con los tracks de todos los tramos y los totales.
+    """
+    from face_recognition import EMBEDDING_BACKEND
+    frame_count, fps = probe_video(path)
+    step = max(1, int(round(fps / sample_fps)))
+    chunks = split_chunks(frame_count, fps, chunk_seconds)
+    backend = "fake" if fake else (backend or EMBEDDING_BACKEND)
+
+    gallery = load_gallery(fake_people=1000 if fake else 0)
+    shared = SharedGallery(gallery)
+    print(f"[INFO] {path}: {frame_count} cuadros a {fps:.1f} FPS ({frame_count / fps:.0f} s), "
+          f"{len(chunks)} tramos, 1 de cada {step} cuadros, {workers} procesos, galería de {len(gallery)} plantillas")
+
+    records = []
+    totals = {"cuadros": 0, "analizados": 0, "descriptores": 0, "descartados_calidad": 0,
+              "deteccion_s": 0.0, "descriptor_s": 0.0}
+    start = time.time()
+    # spawn: TensorFlow no tolera bien heredar el estado con fork
+    context = multiprocessing.get_context("spawn")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(shared.spec, backend, detector)) as pool:
+            futures = [pool.submit(analyze_chunk, path, i, first, last, fps, step, batch_size, threshold,
+                                   quality_gate)
+                       for i, (first, last) in enumerate(chunks)]
+            for done, future in enumerate(as_completed(futures), 1):
+                chunk_index, chunk_records, stats = future.result()
+                records.extend(chunk_records)
+                for key in totals:
+                    totals[key] += stats[key]
+                print(f"[INFO] Tramo {chunk_index + 1} listo ({done}/{len(chunks)}): {stats['analizados']} cuadros "
+                      f"analizados, {len(chunk_records)} tracks")
+    finally:
+        shared.close()
+
+    elapsed = time.time() - start
+    totals.update(segundos=elapsed, fps_video=fps, duracion_video_s=frame_count / fps)
+    return records, totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconocimiento facial sobre video grabado")
+    parser.add_argument("video")
+    parser.add_argument("--output", default=None, help="Archivo .csv o .jsonl (por defecto <video>.linea.csv)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--chunk-seconds", type=float, default=CHUNK_SECONDS)
+    parser.add_argument("--sample-fps", type=float, default=SAMPLE_FPS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--detector", choices=("haar", "retinaface", "none"), default="haar",
+                        help="none usa el cuadro entero como rostro")
+    parser.add_argument("--backend", default=None, help="Backend de descriptores (tf, onnx, onnx-int8, fake)")
+    parser.add_argument("--no-quality", action="store_true", help="No descartar recortes de baja calidad")
+    parser.add_argument("--merge-gap", type=float, default=MERGE_GAP)
+    parser.add_argument("--min-observations", type=int, default=MIN_OBSERVATIONS)
+    parser.add_argument("--start", default=None, help="Hora de inicio de la grabación (ISO 8601)")
+    parser.add_argument("--events", action="store_true", help="Escribir los reconocimientos en eventos_reconocimiento")
+    parser.add_argument("--ubicacion", default=None, help="Ubicación de los eventos (por defecto, el nombre del video)")
+    parser.add_argument("--fake", action="store_true", help="FakeEmbedder y galería sintética, sin BD ni modelos")
+    args = parser.parse_args()
+
+    start_time = datetime.fromisoformat(args.start) if args.start else None
+    if args.events and start_time is None:
+        parser.error("--events necesita --start para fechar los eventos")
+
+    records, totals = analyze_video(args.video, args.workers, args.chunk_seconds, args.sample_fps,
+                                    args.batch_size, args.detector, args.backend, args.fake, not args.no_quality)
+    timeline = build_timeline(records, args.merge_gap, args.min_observations)
+    _add_wall_times(timeline, start_time)
+
+    output = args.output or os.path.splitext(args.video)[0] + ".linea.csv"
+    write_timeline(timeline, output)
+    recognized = sum(1 for e in timeline if e["persona_id"] is not None)
+    print(f"[INFO] Línea de tiempo: {len(timeline)} entradas ({recognized} reconocidas) en {output}")
+
+    if args.events and not args.fake:
+        written = write_events(timeline, start_time, args.ubicacion or os.path.basename(args.video))
+        print(f"[INFO] {written} eventos escritos en eventos_reconocimiento")
+
+    elapsed = totals["segundos"]
+    print(f"[INFO] {totals['cuadros']} cuadros en {elapsed:.1f} s: {totals['cuadros'] / elapsed:.1f} cuadros/s, "
+          f"{totals['duracion_video_s'] / elapsed:.1f}x tiempo real ({totals['fps_video']:.1f} FPS); "
+          f"{totals['analizados']} analizados, {totals['descriptores']} descriptores, "
+          f"{totals['descartados_calidad']} descartados por calidad; "
+          f"detección {totals['deteccion_s']:.1f} s, descriptores {totals['descriptor_s']:.1f} s (sumados entre procesos)")
+
+
+if __name__ == "__main__":
+    main()